@@ -1,7 +1,23 @@
+from __future__ import annotations
+
+import json
+import os
+from pathlib import Path
+from typing import TYPE_CHECKING
+
 import streamlit as st
-import pandas as pd
-from io import BytesIO
-import altair as alt
+
+from cache_compartida import CacheCompartida
+from rendimiento import Medidor, configurar_log
+from trabajos import Trabajo, iniciar_trabajo, soltar_trabajo
+
+# pandas, altair, los motores de Excel y los módulos que los usan se
+# importan recién en la sección que los necesita, así la página de carga
+# de archivos queda lista sin esperarlos (Python los importa una vez por
+# proceso; después cada import es una búsqueda en sys.modules)
+if TYPE_CHECKING:
+    from motor import Resultado
+    from tendencias import Tendencias
 
 # -------------------------------------------------------------------
 # Configuración básica de la página
@@ -15,10 +31,16 @@ st.set_page_config(
 # Encabezado: logo + título
 # -------------------------------------------------------------------
 # El archivo de imagen debe llamarse "logo_siel.png"
-# y estar en la misma carpeta que este app.py
+# y estar en la misma carpeta que este app.py; se lee una vez por proceso
+RUTA_LOGO = Path(__file__).with_name("logo_siel.png")
+
+@st.cache_resource
+def leer_logo() -> bytes:
+    return RUTA_LOGO.read_bytes()
+
 col_izq, col_centro, col_der = st.columns([1, 2, 1])
 with col_centro:
-    st.image("logo_siel.png", width=220)
+    st.image(leer_logo(), width=220)
 
 st.markdown(
     "<h1 style='text-align:center;'>CARTERA DE PRESTACIONES, REVISIÓN</h1>",
@@ -54,579 +76,998 @@ with col_cartera:
 
 st.write("")  # espacio
 
-# Lista de hojas de hospitales en la cartera
-HOSPITALES = [
-    "HHHA", "CAPLC", "HINI", "HPITRU", "HLAUTA", "HVILLA",
-    "HCARAH", "HCUNCO", "HTOLTE", "HGALVA", "HLONCO",
-    "HGORBE", "HSAAVE", "HVILCU"
-]
+# Máximo de exámenes que se muestran en el selector (el resto se busca)
+MAX_OPCIONES_EXAMEN = 50
+
+# Procesos para leer los Excel en paralelo (1 = lectura en serie)
+PROCESOS_LECTURA = int(os.environ.get("SIEL_PROCESOS_LECTURA", "1"))
+
+# Registro de rendimiento: SIEL_LOG_RENDIMIENTO=archivo agrega una línea
+# JSON por etapa. El pico de memoria por etapa no se mide en la app: con
+# sesiones y trabajos en hilos a la vez, tracemalloc mezclaría la memoria
+# de todos (ver rendimiento.Medidor; se mide con lote.py o benchmark.py)
+if os.environ.get("SIEL_LOG_RENDIMIENTO"):
+    configurar_log(os.environ["SIEL_LOG_RENDIMIENTO"])
+
+# Carpeta del historial de versiones de la cartera ("" = desactivado)
+CARPETA_HISTORIAL = os.environ.get("SIEL_HISTORIAL", "historial")
+
+# Carpeta del servidor con carteras antiguas que se pueden incorporar al
+# historial desde la app (sin ella, solo con `tendencias.py ingestar`)
+CARPETA_CARTERAS = os.environ.get("SIEL_CARTERAS") or None
+
+# Carpeta con los topologia_*.json para el modo de varios servicios
+# (por defecto, la de la app)
+CARPETA_TOPOLOGIAS = os.environ.get("SIEL_TOPOLOGIAS") or None
+
+# Secciones de análisis (hospitales, Nodo y complejidad, carteras) y
+# tendencias plegadas y calculadas recién al abrirlas; con
+# SIEL_SECCIONES_DIFERIDAS=0 el trabajo las calcula todas y se muestran abiertas
+SECCIONES_DIFERIDAS = os.environ.get("SIEL_SECCIONES_DIFERIDAS", "1") != "0"
+
+# Límite de memoria de la caché compartida entre sesiones (MB)
+LIMITE_CACHE_MB = float(os.environ.get("SIEL_CACHE_MB", "1024"))
 
 # -------------------------------------------------------------------
-# Función auxiliar: DataFrame a Excel (bytes) para descarga simple
+# Caché compartida por todas las sesiones del servidor: archivos
+# leídos, resultados y descargas se guardan una vez por hash de los
+# archivos subidos y se entregan sin copiar a cada sesión (solo
+# lectura). Se mantiene bajo LIMITE_CACHE_MB descartando lo usado hace
+# más tiempo.
 # -------------------------------------------------------------------
-def df_to_excel_bytes(df: pd.DataFrame, sheet_name: str = "Hoja1") -> BytesIO:
-    buffer = BytesIO()
-    with pd.ExcelWriter(buffer, engine="xlsxwriter") as writer:
-        df.to_excel(writer, index=False, sheet_name=sheet_name)
-    buffer.seek(0)
-    return buffer
+@st.cache_resource
+def cache_compartida() -> CacheCompartida:
+    return CacheCompartida(LIMITE_CACHE_MB)
+
+cache = cache_compartida()
 
 # -------------------------------------------------------------------
-# Lógica principal (solo si ambos archivos fueron cargados)
+# Descargas bajo demanda: el archivo se genera recién al presionar el
+# botón (en otro hilo, sin rerun) y queda en la caché por los hashes de
+# los archivos subidos y el formato, así una segunda descarga (de esta
+# u otra sesión) es inmediata y los reruns no serializan ningún archivo.
 # -------------------------------------------------------------------
-if archivo_siel is not None and archivo_cartera is not None:
-    try:
-        # -------------------------
-        # 1. Cargar dataframes base
-        # -------------------------
-        df_siel = pd.read_excel(archivo_siel)
-        df_bd = pd.read_excel(archivo_cartera, sheet_name="BD")  # cartera base
-
-        # --------------------------------------------
-        # 2. Homologar nombres de columnas en SIEL
-        # --------------------------------------------
-        rename_map = {}
-        if "Nombre exámen" in df_siel.columns:
-            rename_map["Nombre exámen"] = "Nombre exámen SIEL"
-        if "Sección" in df_siel.columns:
-            rename_map["Sección"] = "Sección SIEL"
-        if rename_map:
-            df_siel = df_siel.rename(columns=rename_map)
-
-        # -------------------------------------------------
-        # 3. Alinear columnas de df_siel con las de df_bd
-        # -------------------------------------------------
-        df_siel = df_siel[df_bd.columns]
-
-        # Normalización de Número para comparaciones
-        siel_num = df_siel["Número"].astype(str).str.strip()
-        bd_num = df_bd["Número"].astype(str).str.strip()
-
-        # -------------------------------------------------
-        # 4. Exámenes en SIEL y no en cartera (BD)
-        # -------------------------------------------------
-        mask_siel_no_en_bd = ~siel_num.isin(bd_num)
-        examenes_siel_no_en_cartera = df_siel[mask_siel_no_en_bd].copy()
-
-        # -------------------------------------------------
-        # 5. Exámenes en cartera (BD) y no en SIEL
-        # -------------------------------------------------
-        mask_bd_no_en_siel = ~bd_num.isin(siel_num)
-        examenes_cartera_no_en_siel = df_bd[mask_bd_no_en_siel].copy()
+def exportar_cache(clave_datos: str, salida: str, formato: str, resultado: Resultado) -> bytes:
+    from exportar import exportar
+
+    def generar():
+        hojas = resultado.hojas(salida)
+        medidor = Medidor({"clave": clave_datos, "formato": formato})
+        with medidor.etapa(f"exportar {salida}", filas=sum(len(df) for df in hojas.values())):
+            return exportar(hojas, formato)
+
+    return cache.obtener(("exportar", clave_datos, salida, formato), generar)
+
+# Hojas sueltas (cartera personalizada, consolidado de servicios,
+# tendencias), generadas recién al presionar el botón de descarga
+def exportar_hojas(hojas: dict, formato: str = "Excel (.xlsx)") -> bytes:
+    from exportar import exportar
+
+    return exportar(hojas, formato)
+
+def boton_descarga(label: str, salida: str, resultado: Resultado, formato: str):
+    from exportar import FORMATOS as FORMATOS_DESCARGA
+
+    _, extension, mime = FORMATOS_DESCARGA[formato]
+    st.download_button(
+        label=label,
+        data=lambda: exportar_cache(resultado.clave_de(salida), salida, formato, resultado),
+        file_name=salida + extension,
+        mime=mime,
+        on_click="ignore",
+    )
 
-        # -------------------------------------------------------------------
-        # 7. Sección de descargas (comparación SIEL vs cartera)
-        # -------------------------------------------------------------------
-        st.subheader("Descarga de resultados")
+# Matrices de todas las versiones del historial, cargadas una vez por
+# conjunto de versiones y compartidas (solo lectura) entre sesiones
+@st.cache_resource(max_entries=2, show_spinner="Cargando historial...")
+def tendencias_cache(versiones: tuple, carpeta: str) -> Tendencias:
+    from historial import Historial
+    from tendencias import Tendencias
 
-        col1, col2 = st.columns(2)
+    return Tendencias(Historial(carpeta))
 
-        with col1:
-            st.download_button(
-                label="SIEL no en cartera",
-                data=df_to_excel_bytes(
-                    examenes_siel_no_en_cartera,
-                    sheet_name="SIEL_no_en_cartera"
-                ),
-                file_name="examenes_siel_no_en_cartera.xlsx",
-                mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
-            )
+# Carpetas que se ofrecen para incorporar al historial: SIEL_CARTERAS y
+# sus subcarpetas, descartando las que (por enlaces) salen de ella
+def carpetas_carteras(raiz: str) -> list:
+    raiz = Path(raiz).resolve()
+    if not raiz.is_dir():
+        return []
+    carpetas = [raiz] + sorted(p for p in raiz.iterdir() if p.is_dir())
+    return [p for p in carpetas if p.resolve().is_relative_to(raiz)]
 
-        with col2:
-            st.download_button(
-                label="Cartera no en SIEL",
-                data=df_to_excel_bytes(
-                    examenes_cartera_no_en_siel,
-                    sheet_name="cartera_no_en_SIEL"
-                ),
-                file_name="examenes_cartera_no_en_siel.xlsx",
-                mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
-            )
+# -------------------------------------------------------------------
+# Cálculos de las secciones de análisis sobre la matriz del trabajo,
+# guardados en la caché compartida por hash de la cartera. Con secciones
+# diferidas cada sección los pide al abrirse; si no, el trabajo los hace
+# todos por adelantado.
+# -------------------------------------------------------------------
+ETAPAS_SECCIONES = {
+    "hospitales": ["nadie_realiza_no_informados", "solapamiento_hospitales"],
+    "nodos": ["resumen_nodos_complejidad", "indice_examenes"],
+    "carteras": ["carteras_agregadas"],
+}
+
+# Descargas de la comparación SIEL vs cartera (no dependen de las secciones)
+SALIDAS_COMPARACION = ["examenes_siel_no_en_cartera", "examenes_cartera_no_en_siel"]
+
+def calcular_etapa(nombre: str, trabajo: Trabajo) -> int:
+    """Calcula una etapa de sección sobre el resultado del trabajo; devuelve sus filas."""
+    from busqueda import construir_indice_examenes
+    from motor import (
+        calcular_carteras_agregadas,
+        calcular_nadie_realiza,
+        calcular_no_informados,
+        calcular_resumenes_grupos,
+        calcular_solapamiento,
+    )
 
-        st.write("")
-        st.write("")
+    resultado = trabajo.datos["resultado"]
+    matriz = resultado.matriz
+    hash_cartera = trabajo.clave.split(":")[1]
+
+    # Exámenes que ningún hospital realiza (todos NO) y exámenes no
+    # informados (algún hospital NO INFORMADO)
+    if nombre == "nadie_realiza_no_informados":
+        resultado.nadie_realiza = cache.obtener(
+            ("nadie_realiza", hash_cartera), lambda: calcular_nadie_realiza(matriz)
+        )
+        resultado.no_informado = cache.obtener(
+            ("no_informado", hash_cartera), lambda: calcular_no_informados(matriz)
+        )
+        return len(resultado.no_informado)
 
-        # Resumen de cantidades
-        st.markdown("**Resumen rápido:**")
-        st.write(f"- Exámenes en SIEL y no en cartera: {len(examenes_siel_no_en_cartera)}")
-        st.write(f"- Exámenes en cartera y no en SIEL: {len(examenes_cartera_no_en_siel)}")
+    # Exámenes comunes, Jaccard y "solo X" entre cada par de hospitales
+    if nombre == "solapamiento_hospitales":
+        resultado.solapamiento = cache.obtener(
+            ("solapamiento", hash_cartera), lambda: calcular_solapamiento(matriz)
+        )
+        return len(matriz.base)
 
-        # -------------------------------------------------------------------
-        # Análisis por hospitales SSASUR (datos + Excel + gráficos)
-        # -------------------------------------------------------------------
-        st.subheader("Análisis por hospitales")
+    # Resumen por Nodo y nivel de complejidad de todos los exámenes
+    if nombre == "resumen_nodos_complejidad":
+        resultado.nodos, resultado.complejidad = cache.obtener(
+            ("resumenes_grupos", hash_cartera), lambda: calcular_resumenes_grupos(matriz)
+        )
+        return len(resultado.nodos) + len(resultado.complejidad)
 
-        # Asegurar que exista 'Nombre exámen SIEL' en df_bd
-        if "Nombre exámen SIEL" not in df_bd.columns and "Nombre exámen" in df_bd.columns:
-            df_bd = df_bd.rename(columns={"Nombre exámen": "Nombre exámen SIEL"})
+    # Índice etiqueta -> fila para el selector de exámenes
+    if nombre == "indice_examenes":
+        trabajo.datos["indice_examenes"] = cache.obtener(
+            ("indice_examenes", hash_cartera),
+            lambda: construir_indice_examenes(matriz.base, matriz.claves),
+        )
+        return len(trabajo.datos["indice_examenes"])
 
-        # Volver al inicio del archivo de cartera para leer todas las hojas
-        archivo_cartera.seek(0)
-        xls = pd.ExcelFile(archivo_cartera)
+    # Básica (todos los hospitales), nodos (todos los de mediana
+    # complejidad), alta (HHHA) y baja (todos los de baja complejidad)
+    if nombre == "carteras_agregadas":
+        resultado.carteras = cache.obtener(
+            ("carteras_agregadas", hash_cartera), lambda: calcular_carteras_agregadas(matriz)
+        )
+        return sum(len(df) for df in resultado.carteras.values())
 
-        # 1. Cargar hojas de hospitales desde el archivo de cartera
-        dfs_hospitales = {
-            h: pd.read_excel(xls, sheet_name=h)
-            for h in HOSPITALES
-        }
+    raise KeyError(nombre)
 
-        # 2. Matriz base con Número y Nombre exámen SIEL
-        df_merged = df_bd[["Número", "Nombre exámen SIEL"]].drop_duplicates().copy()
+def calcular_seccion(seccion: str, trabajo: Trabajo, medidor: Medidor):
+    for nombre in ETAPAS_SECCIONES[seccion]:
+        with medidor.etapa(nombre) as registro:
+            registro["filas"] = calcular_etapa(nombre, trabajo)
 
-        # 3. Construcción de matriz hospitalaria
-        for h in HOSPITALES:
-            df_h = dfs_hospitales[h].copy()
+# -------------------------------------------------------------------
+# Proceso pesado en segundo plano (trabajos.py): lectura, comparación
+# de Números, matriz, historial y archivos de descarga (más las
+# secciones de análisis si no son diferidas), en un hilo por par de
+# archivos. Cada paso queda en la caché compartida, así que repetir un
+# trabajo cancelado no repite lo ya calculado.
+# -------------------------------------------------------------------
+def salidas_previas() -> list:
+    """Descargas que el trabajo deja listas de antemano."""
+    from motor import SALIDAS
+
+    return list(SALIDAS_COMPARACION if SECCIONES_DIFERIDAS else SALIDAS)
+
+def etapas_trabajo() -> list:
+    """Etapas esperadas del trabajo, para el avance."""
+    secciones = [] if SECCIONES_DIFERIDAS else [
+        nombre for etapas in ETAPAS_SECCIONES.values() for nombre in etapas
+    ]
+    return (
+        ["lectura", "comparacion_numeros", "nombres", "matriz"]
+        + secciones
+        + (["historial"] if CARPETA_HISTORIAL else [])
+        + [f"descarga {salida}" for salida in salidas_previas()]
+    )
 
-            # Detectar columna Número
-            if "Número" in df_h.columns:
-                num_col = "Número"
-            else:
-                num_col = df_h.columns[0]  # Columna A
-
-            # Normalizar Cartera
-            df_h["Cartera"] = (
-                df_h["Cartera"]
-                .astype(str)
-                .str.strip()
-                .str.upper()
-                .replace({"NAN": None, "": None})
-            )
+def preparar_resultados(
+    trabajo: Trabajo,
+    datos_siel: bytes,
+    datos_cartera: bytes,
+    nombre_cartera: str,
+    formato: str,
+):
+    from carga import cargar_insumos
+    from historial import Historial, comparar_versiones
+    from matriz import construir_matriz
+    from motor import HOSPITALES, Resultado, calcular_nombres, comparar_numeros
+
+    hash_siel, hash_cartera = trabajo.clave.split(":")
+    resultado = Resultado(clave=trabajo.clave)
+    trabajo.datos["resultado"] = resultado
+
+    # 1-3. Cargar dataframes base, homologar columnas y alinear df_siel con df_bd
+    with trabajo.etapa("lectura") as registro:
+        df_siel, df_bd, dfs_hospitales, claves = cache.obtener(
+            ("insumos", hash_siel, hash_cartera),
+            lambda: cargar_insumos(datos_siel, datos_cartera, HOSPITALES, PROCESOS_LECTURA),
+        )
+        registro["filas"] = len(df_bd)
 
-            tmp = (
-                df_h[[num_col, "Cartera"]]
-                .rename(columns={num_col: "Número", "Cartera": h})
-                .drop_duplicates(subset="Número", keep="last")
-            )
+    # 4-5. Exámenes en SIEL y no en cartera (BD), y en cartera (BD) y no en SIEL
+    with trabajo.etapa("comparacion_numeros") as registro:
+        resultado.siel_no_en_cartera, resultado.cartera_no_en_siel = cache.obtener(
+            ("comparacion_numeros", hash_siel, hash_cartera),
+            lambda: comparar_numeros(df_siel, df_bd, claves),
+        )
+        registro["filas"] = len(df_siel) + len(df_bd)
+
+    # Nombres a actualizar y posibles duplicados (hojas extra de la
+    # descarga "SIEL no en cartera", por eso antes del hito)
+    with trabajo.etapa("nombres") as registro:
+        resultado.nombres_a_actualizar, resultado.posibles_duplicados = cache.obtener(
+            ("nombres", hash_siel, hash_cartera),
+            lambda: calcular_nombres(df_siel, df_bd, claves),
+        )
+        registro["filas"] = len(df_siel) + len(df_bd)
+    trabajo.hito("comparacion")
+
+    # Matriz hospitalaria codificada (SI / NO / NO INFORMADO), con sus
+    # vistas (etiquetas, df_matriz, conteos del gráfico por hospital)
+    # ya armadas, así la caché cuenta su tamaño completo
+    with trabajo.etapa("matriz") as registro:
+        matriz = cache.obtener(
+            ("matriz", hash_cartera),
+            lambda: construir_matriz(df_bd, dfs_hospitales, HOSPITALES, claves).calcular_vistas(),
+        )
+        registro["filas"] = len(matriz.base)
+    resultado.matriz = matriz
+
+    # Secciones de análisis por adelantado (sin secciones diferidas)
+    if not SECCIONES_DIFERIDAS:
+        for etapas in ETAPAS_SECCIONES.values():
+            for nombre in etapas:
+                with trabajo.etapa(nombre) as registro:
+                    registro["filas"] = calcular_etapa(nombre, trabajo)
+
+    # Historial de versiones: cada cartera procesada se guarda una vez
+    # y se compara con la versión anterior guardada
+    if CARPETA_HISTORIAL:
+        with trabajo.etapa("historial") as registro:
+            historial = Historial(CARPETA_HISTORIAL)
+            historial.guardar(hash_cartera, nombre_cartera, matriz)
+            resultado.version_anterior = historial.anterior(hash_cartera)
+            if resultado.version_anterior is not None:
+                resultado.delta = cache.obtener(
+                    ("delta_versiones", resultado.version_anterior, hash_cartera),
+                    lambda: comparar_versiones(historial.cargar(resultado.version_anterior), matriz),
+                )
+                registro["filas"] = len(resultado.delta.cambios)
+    trabajo.hito("analisis")
 
-            df_merged = df_merged.merge(tmp, on="Número", how="left")
+    # Archivos de descarga en el formato elegido, para que la primera
+    # descarga sea inmediata (la página ya se muestra mientras tanto)
+    salidas = salidas_previas() + (["CAMBIOS_ENTRE_VERSIONES"] if resultado.delta is not None else [])
+    for salida in salidas:
+        with trabajo.etapa(f"descarga {salida}"):
+            exportar_cache(resultado.clave_de(salida), salida, formato, resultado)
 
-        # 4. Normalización final de la matriz (SI / NO / NO INFORMADO)
-        cartera_norm = df_merged[HOSPITALES].copy()
+# -------------------------------------------------------------------
+# 7. Sección de descargas (comparación SIEL vs cartera). Se muestra
+# apenas está la comparación de Números, mientras sigue el resto.
+# -------------------------------------------------------------------
+def mostrar_comparacion(resultado: Resultado) -> str:
+    from exportar import FORMATOS as FORMATOS_DESCARGA
 
-        for h in HOSPITALES:
-            cartera_norm[h] = cartera_norm[h].fillna("NO INFORMADO")
-            cartera_norm[h] = cartera_norm[h].replace("", "NO INFORMADO")
-            cartera_norm[h] = cartera_norm[h].str.upper().str.strip()
+    st.subheader("Descarga de resultados")
+
+    formato_descarga = st.radio(
+        "Formato de descarga",
+        list(FORMATOS_DESCARGA),
+        horizontal=True,
+        help="CSV y Parquet se entregan como .zip con un archivo por hoja.",
+        key="formato_descarga",
+    )
 
-        # Matriz completa final (Número + Nombre exámen SIEL + hospitales)
-        df_matriz = pd.concat(
-            [df_merged[["Número", "Nombre exámen SIEL"]], cartera_norm],
-            axis=1
+    col1, col2 = st.columns(2)
+
+    with col1:
+        boton_descarga(
+            "SIEL no en cartera",
+            "examenes_siel_no_en_cartera",
+            resultado,
+            formato_descarga,
         )
 
-        # 5. Exámenes que ningún hospital realiza (todos NO)
-        mask_nadie = (cartera_norm == "NO").all(axis=1)
-        examenes_nadie_realiza = df_matriz.loc[
-            mask_nadie, ["Número", "Nombre exámen SIEL"]
-        ]
-
-        # 6. Exámenes no informados (algún hospital NO INFORMADO)
-        mask_no_inf = (cartera_norm == "NO INFORMADO").any(axis=1)
-        df_no_informado = df_matriz.loc[
-            mask_no_inf, ["Número", "Nombre exámen SIEL"]
-        ].copy()
-
-        def hospitales_no_inf(row):
-            return ", ".join([h for h in HOSPITALES if row[h] == "NO INFORMADO"])
-
-        df_no_informado["Hospitales_no_informaron"] = df_matriz.loc[
-            mask_no_inf, HOSPITALES
-        ].apply(hospitales_no_inf, axis=1)
-
-        # 7. Botón para descargar todo en un único Excel (análisis hospitales)
-        def exportar_excel_multi():
-            buffer = BytesIO()
-            with pd.ExcelWriter(buffer, engine="openpyxl") as writer:
-                examenes_nadie_realiza.to_excel(
-                    writer, index=False, sheet_name="NINGUN_HOSPITAL_REALIZA"
-                )
-                df_no_informado.to_excel(
-                    writer, index=False, sheet_name="NO_INFORMADO"
-                )
-                df_matriz.to_excel(
-                    writer, index=False, sheet_name="MATRIZ_COMPLETA"
-                )
-            buffer.seek(0)
-            return buffer
-
-        st.download_button(
-            label="Descargar análisis por hospitales (Excel)",
-            data=exportar_excel_multi(),
-            file_name="ANALISIS_HOSPITALES_SSASUR.xlsx",
-            mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+    with col2:
+        boton_descarga(
+            "Cartera no en SIEL",
+            "examenes_cartera_no_en_siel",
+            resultado,
+            formato_descarga,
         )
 
+    st.write("")
+    st.write("")
+
+    # Resumen de cantidades
+    st.markdown("**Resumen rápido:**")
+    st.write(f"- Exámenes en SIEL y no en cartera: {len(resultado.siel_no_en_cartera)}")
+    st.write(f"- Exámenes en cartera y no en SIEL: {len(resultado.cartera_no_en_siel)}")
+    st.write(f"- Nombres a actualizar (mismo Número, otro nombre): {len(resultado.nombres_a_actualizar)}")
+    st.write(f"- Posibles duplicados (otro Número, nombre casi igual): {len(resultado.posibles_duplicados)}")
+    return formato_descarga
+
+# Avance del trabajo, refrescado cada segundo sin volver a ejecutar la
+# página; cuando el análisis está listo se ejecuta la página completa
+@st.fragment(run_every=1)
+def mostrar_avance(trabajo: Trabajo):
+    if trabajo.alcanzo("analisis") or trabajo.terminado or trabajo.cancelado:
+        st.rerun()
+    st.progress(
+        trabajo.avance(),
+        text=(
+            f"Procesando archivos ({len(trabajo.completadas)}/{len(trabajo.etapas)}): "
+            f"{trabajo.actual or 'en cola'}"
+        ),
+    )
+    if trabajo.alcanzo("comparacion"):
+        mostrar_comparacion(trabajo.datos["resultado"])
+
+# -------------------------------------------------------------------
+# Lógica principal (solo si ambos archivos fueron cargados)
+# -------------------------------------------------------------------
+if archivo_siel is not None and archivo_cartera is not None:
+    import pandas as pd
+
+    from carga import hash_contenido, validar_esquema
+    from exportar import FORMATOS as FORMATOS_DESCARGA
+    from motor import HOSPITALES, NODOS, TOPOLOGIA
+
+    medidor = Medidor()
+    trabajo = None
+    try:
+        datos_siel = archivo_siel.getvalue()
+        datos_cartera = archivo_cartera.getvalue()
+        hash_siel = hash_contenido(datos_siel)
+        hash_cartera = hash_contenido(datos_cartera)
+        clave = f"{hash_siel}:{hash_cartera}"
+        medidor.contexto["clave"] = clave
+        with medidor.etapa("validacion"):
+            problemas = cache.obtener(
+                ("validacion", hash_siel, hash_cartera),
+                lambda: validar_esquema(datos_siel, datos_cartera, HOSPITALES),
+            )
+        if problemas:
+            st.error(
+                "Los archivos no tienen el formato esperado:\n"
+                + "\n".join(f"- {p}" for p in problemas)
+            )
+            st.stop()
+
+        # Trabajo de este par de archivos: el de la sesión si sigue
+        # vigente; si se subió otro archivo, la sesión suelta el anterior
+        # (se cancela si ninguna otra sesión lo está usando)
+        trabajo = st.session_state.get("trabajo")
+        if trabajo is None or trabajo.clave != clave or trabajo.cancelado:
+            if trabajo is not None:
+                soltar_trabajo(trabajo)
+            nombre_cartera = archivo_cartera.name
+            formato_inicial = st.session_state.get("formato_descarga", list(FORMATOS_DESCARGA)[0])
+            trabajo = iniciar_trabajo(
+                clave,
+                etapas_trabajo(),
+                lambda t: preparar_resultados(
+                    t, datos_siel, datos_cartera, nombre_cartera, formato_inicial
+                ),
+                Medidor({"clave": clave}),
+            )
+            st.session_state["trabajo"] = trabajo
+
+        if not (trabajo.alcanzo("analisis") or trabajo.terminado):
+            mostrar_avance(trabajo)
+            st.stop()
+        if trabajo.error is not None:
+            raise trabajo.error
+
+        resultado = trabajo.datos["resultado"]
+        matriz = resultado.matriz
+        formato_descarga = mostrar_comparacion(resultado)
+
         # -------------------------------------------------------------------
-        # Pestaña de visualización (gráficos)
+        # Análisis por hospitales SSASUR (datos + Excel + gráficos). Ésta y
+        # las otras secciones de análisis se calculan recién al abrirlas
+        # (salvo con SIEL_SECCIONES_DIFERIDAS=0)
         # -------------------------------------------------------------------
         st.write("")
-        st.write("")
-        st.subheader("Visualización")
-
-        tab1, = st.tabs([
-            "Barras por hospital",
-        ])
-
-        # 1) Barras apiladas SI / NO / NO INFORMADO por hospital
-        with tab1:
-            # Selector de hospital
-            opcion_hosp = st.selectbox(
-                "Selecciona hospital para visualizar",
-                ["Todos los hospitales"] + HOSPITALES
-            )
-
-            # Pasar matriz a formato largo
-            df_long = (
-                cartera_norm
-                .reset_index(drop=False)
-                .melt(
-                    id_vars="index",
-                    value_vars=HOSPITALES,
-                    var_name="Hospital",
-                    value_name="Estado"
+        seccion_hospitales = st.expander(
+            "Análisis por hospitales",
+            expanded=not SECCIONES_DIFERIDAS,
+            key="seccion_hospitales",
+            on_change="rerun",
+        )
+        if seccion_hospitales.open:
+            with seccion_hospitales:
+                import altair as alt
+
+                calcular_seccion("hospitales", trabajo, medidor)
+
+                # 7. Botón para descargar todo en un único archivo (análisis hospitales)
+                boton_descarga(
+                    "Descargar análisis por hospitales",
+                    "ANALISIS_HOSPITALES_SSASUR",
+                    resultado,
+                    formato_descarga,
                 )
-            )
 
-            # Agrupar por hospital y estado
-            df_counts = (
-                df_long
-                .groupby(["Hospital", "Estado"])
-                .size()
-                .reset_index(name="Cantidad")
-            )
+                # -------------------------------------------------------------------
+                # Pestaña de visualización (gráficos)
+                # -------------------------------------------------------------------
+                st.write("")
+                st.write("")
+                st.subheader("Visualización")
+
+                tab1, tab2 = st.tabs([
+                    "Barras por hospital",
+                    "Solapamiento entre hospitales",
+                ])
+
+                # 1) Barras apiladas SI / NO / NO INFORMADO por hospital
+                with tab1:
+                    # Selector de hospital
+                    opcion_hosp = st.selectbox(
+                        "Selecciona hospital para visualizar",
+                        ["Todos los hospitales"] + HOSPITALES
+                    )
 
-            # Filtrar según elección del usuario
-            if opcion_hosp != "Todos los hospitales":
-                df_counts_plot = df_counts[df_counts["Hospital"] == opcion_hosp]
-                titulo = f"Distribución de exámenes en {opcion_hosp}"
-            else:
-                df_counts_plot = df_counts
-                titulo = "Distribución de exámenes por hospital según estado de cartera"
-
-            # Gráfico
-            chart_barras = (
-                alt.Chart(df_counts_plot)
-                .mark_bar()
-                .encode(
-                    x=alt.X("Hospital:N", title="Hospital"),
-                    y=alt.Y("Cantidad:Q", title="Cantidad de exámenes"),
-                    color=alt.Color("Estado:N", title="Estado"),
-                    tooltip=["Hospital", "Estado", "Cantidad"]
-                )
-                .properties(
-                    width=700,
-                    height=400,
-                    title=titulo
-                )
-            )
-            st.altair_chart(chart_barras, use_container_width=True)
+                    with medidor.etapa("grafico_hospitales"):
+                        # Cantidad por hospital y estado, calculada una vez por
+                        # matriz (sin pasarla a formato largo)
+                        df_counts = matriz.conteos_por_hospital
+
+                        # Filtrar según elección del usuario
+                        if opcion_hosp != "Todos los hospitales":
+                            df_counts_plot = df_counts[df_counts["Hospital"] == opcion_hosp]
+                            titulo = f"Distribución de exámenes en {opcion_hosp}"
+                        else:
+                            df_counts_plot = df_counts
+                            titulo = "Distribución de exámenes por hospital según estado de cartera"
+
+                        # Gráfico
+                        chart_barras = (
+                            alt.Chart(df_counts_plot)
+                            .mark_bar()
+                            .encode(
+                                x=alt.X("Hospital:N", title="Hospital"),
+                                y=alt.Y("Cantidad:Q", title="Cantidad de exámenes"),
+                                color=alt.Color("Estado:N", title="Estado"),
+                                tooltip=["Hospital", "Estado", "Cantidad"]
+                            )
+                            .properties(
+                                width=700,
+                                height=400,
+                                title=titulo
+                            )
+                        )
+                        st.altair_chart(chart_barras, use_container_width=True)
+
+                # 2) Mapa de calor hospital × hospital: exámenes comunes, Jaccard
+                # o lo que realiza el hospital de la fila y el de la columna no
+                with tab2:
+                    metricas = {
+                        "Similitud (Jaccard)": "JACCARD",
+                        "Exámenes en común": "COMUNES",
+                        "Solo el hospital de la fila": "SOLO_FILA",
+                    }
+                    col_met, col_nodo = st.columns(2)
+                    metrica = col_met.selectbox("Medida", list(metricas))
+                    opcion_nodo = col_nodo.selectbox(
+                        "Hospitales", ["Todos los hospitales"] + [f"Nodo {n}" for n in NODOS]
+                    )
+                    if opcion_nodo == "Todos los hospitales":
+                        hospitales_mapa = HOSPITALES
+                    else:
+                        hospitales_mapa = NODOS[opcion_nodo.removeprefix("Nodo ")]
+
+                    with medidor.etapa("grafico_solapamiento"):
+                        tabla = resultado.solapamiento[metricas[metrica]]
+                        df_mapa = (
+                            tabla[tabla["Hospital"].isin(hospitales_mapa)][["Hospital"] + hospitales_mapa]
+                            .melt(id_vars="Hospital", var_name="Otro hospital", value_name="Valor")
+                        )
+                        chart_mapa = (
+                            alt.Chart(df_mapa)
+                            .mark_rect()
+                            .encode(
+                                x=alt.X("Otro hospital:N", title="Hospital (columna)", sort=hospitales_mapa),
+                                y=alt.Y("Hospital:N", title="Hospital (fila)", sort=hospitales_mapa),
+                                color=alt.Color("Valor:Q", title=metrica),
+                                tooltip=["Hospital", "Otro hospital", "Valor"],
+                            )
+                            .properties(
+                                width=600,
+                                height=600,
+                                title=metrica,
+                            )
+                        )
+                        st.altair_chart(chart_mapa, use_container_width=True)
+
+                    st.markdown("**Exámenes que solo realiza cada hospital en la red**")
+                    st.dataframe(
+                        resultado.solapamiento["EXCLUSIVOS"], use_container_width=True, hide_index=True
+                    )
+                    boton_descarga(
+                        "Descargar solapamiento entre hospitales",
+                        "SOLAPAMIENTO_HOSPITALES_SSASUR",
+                        resultado,
+                        formato_descarga,
+                    )
 
         # -------------------------------------------------------------------
         # Análisis por Nodo y nivel de complejidad (por examen)
         # -------------------------------------------------------------------
-        st.write("")
-        st.write("")
-        st.subheader("Análisis por Nodo y nivel de complejidad (por examen)")
-
-        # Definición de Nodos (según estructura entregada)
-        NODOS = {
-            "CENTRO": ["CAPLC", "HCUNCO"],
-            "COSTERO": ["HINI", "HCARAH", "HSAAVE"],
-            "SUR": ["HPITRU", "HTOLTE", "HGORBE"],
-            "NORTE": ["HLAUTA", "HGALVA", "HVILCU"],
-            "LACUSTRE": ["HVILLA", "HLONCO"],
-        }
-
-        # Definición de complejidad por hospital
-        COMPLEJIDAD = {
-            "HHHA": "ALTA",
-            "CAPLC": "MEDIANA",
-            "HINI": "MEDIANA",
-            "HPITRU": "MEDIANA",
-            "HLAUTA": "MEDIANA",
-            "HVILLA": "MEDIANA",
-            "HCARAH": "BAJA",
-            "HCUNCO": "BAJA",
-            "HTOLTE": "BAJA",
-            "HGALVA": "BAJA",
-            "HLONCO": "BAJA",
-            "HGORBE": "BAJA",
-            "HSAAVE": "BAJA",
-            "HVILCU": "BAJA",
-        }
-
-        # Selector de examen a partir de df_matriz
-        opciones_examen = df_matriz[["Número", "Nombre exámen SIEL"]].copy()
-        opciones_examen["label"] = (
-            opciones_examen["Número"].astype(str)
-            + " - "
-            + opciones_examen["Nombre exámen SIEL"].astype(str)
+        seccion_nodos = st.expander(
+            "Análisis por Nodo y nivel de complejidad (por examen)",
+            expanded=not SECCIONES_DIFERIDAS,
+            key="seccion_nodos",
+            on_change="rerun",
         )
-        opciones_examen = opciones_examen.drop_duplicates(subset=["label"])
+        if seccion_nodos.open:
+            with seccion_nodos:
+                import altair as alt
 
-        examen_seleccionado = st.selectbox(
-            "Selecciona un examen para analizar por Nodo y complejidad:",
-            opciones_examen["label"].sort_values().tolist(),
-        )
+                from busqueda import buscar_examenes
+                from matriz import resumen_de_examen
 
-        if examen_seleccionado:
-            fila_sel = opciones_examen.loc[
-                opciones_examen["label"] == examen_seleccionado
-            ].iloc[0]
+                calcular_seccion("nodos", trabajo, medidor)
 
-            numero_sel = fila_sel["Número"]
-            nombre_sel = fila_sel["Nombre exámen SIEL"]
+                # Resumen de todos los exámenes (calculado en el trabajo)
+                df_nodos_todos, df_complejidad_todos = resultado.nodos, resultado.complejidad
 
-            # Buscamos la fila correspondiente en df_matriz
-            fila_examen = df_matriz[
-                (df_matriz["Número"] == numero_sel)
-                & (df_matriz["Nombre exámen SIEL"] == nombre_sel)
-            ]
+                # Selector de examen: búsqueda sobre el índice de la cartera y
+                # solo las mejores coincidencias van al selectbox
+                indice_examenes = trabajo.datos["indice_examenes"]
+                texto_busqueda = st.text_input(
+                    "Buscar examen por Número o nombre:",
+                    key="busqueda_examen",
+                )
+                opciones_examen = buscar_examenes(
+                    indice_examenes, texto_busqueda, limite=MAX_OPCIONES_EXAMEN
+                )
+                st.caption(
+                    f"Mostrando {len(opciones_examen)} de {len(indice_examenes)} exámenes; "
+                    "escribe para filtrar."
+                )
 
-            if not fila_examen.empty:
-                fila_examen = fila_examen.iloc[0]
+                examen_seleccionado = st.selectbox(
+                    "Selecciona un examen para analizar por Nodo y complejidad:",
+                    opciones_examen,
+                )
 
-                # Estados por hospital para ese examen
-                estados_por_hospital = {
-                    h: fila_examen[h] for h in HOSPITALES if h in fila_examen.index
-                }
+                if examen_seleccionado:
+                    posicion = indice_examenes.fila_de[examen_seleccionado]
+                    numero_sel = matriz.base["Número"].iat[posicion]
+                    nombre_sel = matriz.base["Nombre exámen SIEL"].iat[posicion]
 
-                # ------------------------------------------
-                # 1) Resumen por NODO
-                # ------------------------------------------
-                datos_nodos = []
-                for nodo, lista_hosp in NODOS.items():
-                    estados = [
-                        estados_por_hospital[h]
-                        for h in lista_hosp
-                        if h in estados_por_hospital
-                    ]
-
-                    total_hosp_nodo = len(estados)
-                    if total_hosp_nodo == 0:
-                        continue
-
-                    n_si = sum(e == "SI" for e in estados)
-                    n_no = sum(e == "NO" for e in estados)
-                    n_no_inf = sum(e == "NO INFORMADO" for e in estados)
-
-                    # Regla de estado del Nodo
-                    if n_si >= 1:
-                        estado_nodo = "SI"
-                    elif n_si == 0 and n_no_inf > 0:
-                        estado_nodo = "NO INFORMADO"
-                    else:
-                        estado_nodo = "NO"
-
-                    porcentaje_si = round((n_si / total_hosp_nodo) * 100, 1)
-
-                    datos_nodos.append(
-                        {
-                            "Nodo": nodo,
-                            "Total_hospitales_nodo": total_hosp_nodo,
-                            "Hospitales_SI": n_si,
-                            "Hospitales_NO": n_no,
-                            "Hospitales_NO_INFORMADO": n_no_inf,
-                            "%_hospitales_SI": porcentaje_si,
-                            "Estado_nodo": estado_nodo,
-                        }
+                    # Tablas del examen: corte del resumen precalculado
+                    df_nodos = resumen_de_examen(df_nodos_todos, posicion)
+                    df_complejidad = resumen_de_examen(df_complejidad_todos, posicion)
+
+                    # ------------------------------------------
+                    # Mostrar tablas resumen
+                    # ------------------------------------------
+                    st.markdown(
+                        f"**Examen seleccionado:** `{numero_sel}` - {nombre_sel}"
                     )
 
-                df_nodos = pd.DataFrame(datos_nodos)
-
-                # ------------------------------------------
-                # 2) Resumen por nivel de COMPLEJIDAD
-                # ------------------------------------------
-                grupos_complejidad = {}
-                for hosp, comp in COMPLEJIDAD.items():
-                    if hosp in estados_por_hospital:
-                        grupos_complejidad.setdefault(comp, []).append(hosp)
-
-                datos_complejidad = []
-                for comp, lista_hosp in grupos_complejidad.items():
-                    estados = [estados_por_hospital[h] for h in lista_hosp]
-
-                    total_hosp_comp = len(estados)
-                    n_si = sum(e == "SI" for e in estados)
-                    n_no = sum(e == "NO" for e in estados)
-                    n_no_inf = sum(e == "NO INFORMADO" for e in estados)
-
-                    porcentaje_si = round((n_si / total_hosp_comp) * 100, 1)
-
-                    datos_complejidad.append(
-                        {
-                            "Complejidad": comp,
-                            "Total_hospitales": total_hosp_comp,
-                            "Hospitales_SI": n_si,
-                            "Hospitales_NO": n_no,
-                            "Hospitales_NO_INFORMADO": n_no_inf,
-                            "%_hospitales_SI": porcentaje_si,
-                        }
+                    col_tab1, col_tab2 = st.columns(2)
+                    with col_tab1:
+                        st.markdown("**Resumen por Nodo**")
+                        st.dataframe(df_nodos, use_container_width=True)
+
+                    with col_tab2:
+                        st.markdown("**Resumen por nivel de complejidad**")
+                        st.dataframe(df_complejidad, use_container_width=True)
+
+                    # ------------------------------------------
+                    # Gráfico de porcentaje de hospitales que realizan el examen
+                    # por Nodo
+                    # ------------------------------------------
+                    st.markdown("**Porcentaje de hospitales que realizan el examen por Nodo**")
+                    chart_nodos = (
+                        alt.Chart(df_nodos)
+                        .mark_bar()
+                        .encode(
+                            x=alt.X("Nodo:N", title="Nodo"),
+                            y=alt.Y("%_hospitales_SI:Q", title="% hospitales que realizan el examen"),
+                            tooltip=[
+                                "Nodo",
+                                "%_hospitales_SI",
+                                "Hospitales_SI",
+                                "Total_hospitales_nodo",
+                                "Estado_nodo",
+                            ],
+                        )
+                        .properties(
+                            width=600,
+                            height=300,
+                        )
+                    )
+                    st.altair_chart(chart_nodos, use_container_width=True)
+
+                    # ------------------------------------------
+                    # Gráfico de porcentaje de hospitales que realizan el examen
+                    # por nivel de complejidad
+                    # ------------------------------------------
+                    st.markdown("**Porcentaje de hospitales que realizan el examen por nivel de complejidad**")
+                    chart_comp = (
+                        alt.Chart(df_complejidad)
+                        .mark_bar()
+                        .encode(
+                            x=alt.X("Complejidad:N", title="Nivel de complejidad"),
+                            y=alt.Y("%_hospitales_SI:Q", title="% hospitales que realizan el examen"),
+                            tooltip=[
+                                "Complejidad",
+                                "%_hospitales_SI",
+                                "Hospitales_SI",
+                                "Total_hospitales",
+                            ],
+                        )
+                        .properties(
+                            width=600,
+                            height=300,
+                        )
                     )
+                    st.altair_chart(chart_comp, use_container_width=True)
+
+                # Descarga del resumen de todos los exámenes por Nodo y complejidad
+                boton_descarga(
+                    "Descargar resumen por Nodo y complejidad, todos los exámenes",
+                    "RESUMEN_NODOS_COMPLEJIDAD_SSASUR",
+                    resultado,
+                    formato_descarga,
+                )
+
+        # -------------------------------------------------------------------
+        # Carteras agregadas (básica, nodos, alta, baja complejidad)
+        # -------------------------------------------------------------------
+        seccion_carteras = st.expander(
+            "Carteras agregadas (estándar básica, nodos, alta y baja complejidad)",
+            expanded=not SECCIONES_DIFERIDAS,
+            key="seccion_carteras",
+            on_change="rerun",
+        )
+        if seccion_carteras.open:
+            with seccion_carteras:
+                import altair as alt
 
-                df_complejidad = pd.DataFrame(datos_complejidad)
+                from motor import cartera_de_consulta
 
-                # ------------------------------------------
-                # Mostrar tablas resumen
-                # ------------------------------------------
-                st.markdown(
-                    f"**Examen seleccionado:** `{numero_sel}` - {nombre_sel}"
+                calcular_seccion("carteras", trabajo, medidor)
+
+                # Botón de descarga con una hoja por cartera
+                boton_descarga(
+                    "Descargar carteras agregadas",
+                    "CARTERAS_AGREGADAS_SSASUR",
+                    resultado,
+                    formato_descarga,
                 )
 
-                col_tab1, col_tab2 = st.columns(2)
-                with col_tab1:
-                    st.markdown("**Resumen por Nodo**")
-                    st.dataframe(df_nodos, use_container_width=True)
-
-                with col_tab2:
-                    st.markdown("**Resumen por nivel de complejidad**")
-                    st.dataframe(df_complejidad, use_container_width=True)
-
-                # ------------------------------------------
-                # Gráfico de porcentaje de hospitales que realizan el examen
-                # por Nodo
-                # ------------------------------------------
-                st.markdown("**Porcentaje de hospitales que realizan el examen por Nodo**")
-                chart_nodos = (
-                    alt.Chart(df_nodos)
-                    .mark_bar()
-                    .encode(
-                        x=alt.X("Nodo:N", title="Nodo"),
-                        y=alt.Y("%_hospitales_SI:Q", title="% hospitales que realizan el examen"),
-                        tooltip=[
-                            "Nodo",
-                            "%_hospitales_SI",
-                            "Hospitales_SI",
-                            "Total_hospitales_nodo",
-                            "Estado_nodo",
-                        ],
-                    )
-                    .properties(
-                        width=600,
-                        height=300,
+                # Gráfico con la cantidad de exámenes en cada cartera (las
+                # carteras y sus descripciones vienen de la topología)
+                df_resumen_carteras = pd.DataFrame({
+                    "Tipo_cartera": [
+                        TOPOLOGIA.carteras[nombre].get("descripcion", nombre) for nombre in resultado.carteras
+                    ],
+                    "Cantidad_examenes": [len(df) for df in resultado.carteras.values()],
+                })
+
+                st.markdown("**Cantidad de exámenes por tipo de cartera**")
+                with medidor.etapa("grafico_carteras"):
+                    chart_carteras = (
+                        alt.Chart(df_resumen_carteras)
+                        .mark_bar()
+                        .encode(
+                            x=alt.X("Tipo_cartera:N", title="Tipo de cartera"),
+                            y=alt.Y("Cantidad_examenes:Q", title="Cantidad de exámenes"),
+                            tooltip=["Tipo_cartera", "Cantidad_examenes"]
+                        )
+                        .properties(
+                            width=700,
+                            height=400
+                        )
                     )
+                    st.altair_chart(chart_carteras, use_container_width=True)
+
+                # Cartera personalizada: consulta de bits sobre los hospitales que
+                # realizan cada examen (p. ej. todo el Nodo SUR más HHHA, o al
+                # menos 2 de LACUSTRE)
+                st.markdown("**Cartera personalizada**")
+                condiciones = {
+                    "Todos": "todos",
+                    "Al menos uno": "alguno",
+                    "Al menos k": "al_menos",
+                    "Ninguno": "ninguno",
+                }
+                col_ref, col_cond, col_k = st.columns([3, 1, 1])
+                referencias = col_ref.multiselect(
+                    "Hospitales, Nodos, niveles de complejidad o grupos",
+                    TOPOLOGIA.referencias(),
+                    help="RED = todos los hospitales; NODO:, COMPLEJIDAD: y GRUPO: según la topología.",
                 )
-                st.altair_chart(chart_nodos, use_container_width=True)
-
-                # ------------------------------------------
-                # Gráfico de porcentaje de hospitales que realizan el examen
-                # por nivel de complejidad
-                # ------------------------------------------
-                st.markdown("**Porcentaje de hospitales que realizan el examen por nivel de complejidad**")
-                chart_comp = (
-                    alt.Chart(df_complejidad)
-                    .mark_bar()
-                    .encode(
-                        x=alt.X("Complejidad:N", title="Nivel de complejidad"),
-                        y=alt.Y("%_hospitales_SI:Q", title="% hospitales que realizan el examen"),
-                        tooltip=[
-                            "Complejidad",
-                            "%_hospitales_SI",
-                            "Hospitales_SI",
-                            "Total_hospitales",
-                        ],
+                condicion = col_cond.selectbox("Realizan el examen", list(condiciones))
+                minimo = col_k.number_input("k", min_value=1, value=2, disabled=condicion != "Al menos k")
+                if referencias:
+                    operador = condiciones[condicion]
+                    consulta = (
+                        {"al_menos": int(minimo), "de": referencias}
+                        if operador == "al_menos" else {operador: referencias}
                     )
-                    .properties(
-                        width=600,
-                        height=300,
+                    with medidor.etapa("cartera_personalizada"):
+                        cartera_propia = cartera_de_consulta(matriz, TOPOLOGIA, consulta)
+                    st.write(f"{len(cartera_propia)} exámenes. Consulta: `{json.dumps(consulta, ensure_ascii=False)}`")
+                    st.dataframe(cartera_propia, use_container_width=True, hide_index=True)
+                    _, extension, mime = FORMATOS_DESCARGA[formato_descarga]
+                    st.download_button(
+                        label="Descargar cartera personalizada",
+                        data=lambda: exportar_hojas({"CARTERA_PERSONALIZADA": cartera_propia}, formato_descarga),
+                        file_name="CARTERA_PERSONALIZADA" + extension,
+                        mime=mime,
+                        on_click="ignore",
                     )
-                )
-                st.altair_chart(chart_comp, use_container_width=True)
-            else:
-                st.warning("No se encontró el examen seleccionado en la matriz.")
 
         # -------------------------------------------------------------------
-        # Carteras agregadas (básica, nodos, alta, baja complejidad)
+        # Historial de versiones: cada cartera procesada se guarda una vez
+        # y se compara con la versión anterior guardada
         # -------------------------------------------------------------------
-        st.write("")
-        st.write("")
-        st.subheader("Carteras agregadas (estándar básica, nodos, alta y baja complejidad)")
-
-        # 1) Cartera estándar básica: exámenes que TODOS los hospitales realizan
-        mask_cartera_basica = (cartera_norm[HOSPITALES] == "SI").all(axis=1)
-        cartera_basica = df_matriz.loc[
-            mask_cartera_basica,
-            ["Número", "Nombre exámen SIEL"]
-        ].drop_duplicates()
-
-        # 2) Cartera nodos: exámenes realizados por TODOS los laboratorios de mediana complejidad (nodos)
-        hospitales_mediana = ["CAPLC", "HINI", "HPITRU", "HLAUTA", "HVILLA"]
-        mask_cartera_nodos = (cartera_norm[hospitales_mediana] == "SI").all(axis=1)
-        cartera_nodos = df_matriz.loc[
-            mask_cartera_nodos,
-            ["Número", "Nombre exámen SIEL"]
-        ].drop_duplicates()
-
-        # 3) Cartera alta complejidad (HHHA)
-        mask_alta = cartera_norm["HHHA"] == "SI"
-        cartera_alta = df_matriz.loc[
-            mask_alta,
-            ["Número", "Nombre exámen SIEL"]
-        ].drop_duplicates()
-
-        # 4) Cartera baja complejidad: exámenes realizados por TODOS los hospitales de baja complejidad
-        hospitales_baja = [h for h, comp in COMPLEJIDAD.items() if comp == "BAJA"]
-        mask_baja = (cartera_norm[hospitales_baja] == "SI").all(axis=1)
-        cartera_baja = df_matriz.loc[
-            mask_baja,
-            ["Número", "Nombre exámen SIEL"]
-        ].drop_duplicates()
-
-        # Botón de descarga Excel con 4 hojas
-        def exportar_carteras_excel():
-            buffer = BytesIO()
-            with pd.ExcelWriter(buffer, engine="openpyxl") as writer:
-                cartera_basica.to_excel(writer, index=False, sheet_name="CARTERA_BASICA")
-                cartera_nodos.to_excel(writer, index=False, sheet_name="CARTERA_NODOS")
-                cartera_alta.to_excel(writer, index=False, sheet_name="ALTA_COMPLEJIDAD")
-                cartera_baja.to_excel(writer, index=False, sheet_name="BAJA_COMPLEJIDAD")
-            buffer.seek(0)
-            return buffer
-
-        st.download_button(
-            label="Descargar carteras agregadas (Excel)",
-            data=exportar_carteras_excel(),
-            file_name="CARTERAS_AGREGADAS_SSASUR.xlsx",
-            mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
-        )
+        if CARPETA_HISTORIAL:
+            st.write("")
+            st.write("")
+            st.subheader("Cambios respecto de la versión anterior")
 
-        # Gráfico con la cantidad de exámenes en cada cartera
-        df_resumen_carteras = pd.DataFrame({
-            "Tipo_cartera": [
-                "Cartera estándar básica (todos los hospitales)",
-                "Cartera nodos (todos los nodos de mediana complejidad)",
-                "Alta complejidad (HHHA)",
-                "Baja complejidad (hospitales baja complejidad)"
-            ],
-            "Cantidad_examenes": [
-                len(cartera_basica),
-                len(cartera_nodos),
-                len(cartera_alta),
-                len(cartera_baja)
-            ]
-        })
-
-        st.markdown("**Cantidad de exámenes por tipo de cartera**")
-        chart_carteras = (
-            alt.Chart(df_resumen_carteras)
-            .mark_bar()
-            .encode(
-                x=alt.X("Tipo_cartera:N", title="Tipo de cartera"),
-                y=alt.Y("Cantidad_examenes:Q", title="Cantidad de exámenes"),
-                tooltip=["Tipo_cartera", "Cantidad_examenes"]
-            )
-            .properties(
-                width=700,
-                height=400
-            )
-        )
-        st.altair_chart(chart_carteras, use_container_width=True)
+            if resultado.delta is None:
+                st.info("Es la primera versión de la cartera en el historial; se usará como base de comparación.")
+            else:
+                delta = resultado.delta
+                col_a, col_b, col_c = st.columns(3)
+                col_a.metric("Exámenes agregados", len(delta.agregados))
+                col_b.metric("Exámenes eliminados", len(delta.eliminados))
+                col_c.metric("Cambios de estado", len(delta.cambios))
+
+                with st.expander("Ver detalle de cambios"):
+                    st.markdown("**Cambios de estado por hospital**")
+                    st.dataframe(delta.cambios, use_container_width=True, hide_index=True)
+                    st.markdown("**Exámenes agregados**")
+                    st.dataframe(delta.agregados, use_container_width=True, hide_index=True)
+                    st.markdown("**Exámenes eliminados**")
+                    st.dataframe(delta.eliminados, use_container_width=True, hide_index=True)
+
+                boton_descarga(
+                    "Descargar cambios entre versiones",
+                    "CAMBIOS_ENTRE_VERSIONES",
+                    resultado,
+                    formato_descarga,
+                )
 
     except Exception as e:
         st.error(f"Ocurrió un error al procesar los archivos: {e}")
 
+    # -------------------------------------------------------------------
+    # Rendimiento: etapas del trabajo en segundo plano y de esta ejecución
+    # -------------------------------------------------------------------
+    with st.expander("Rendimiento"):
+        etapas = (trabajo.medidor.etapas if trabajo is not None else []) + medidor.etapas
+        if etapas:
+            st.dataframe(pd.DataFrame(etapas), use_container_width=True, hide_index=True)
+            st.caption(
+                f"Total: {round(sum(e['segundos'] for e in etapas), 4)} s. Las descargas en"
+                " otros formatos se miden al generarse y quedan en el registro JSON"
+                " (SIEL_LOG_RENDIMIENTO)."
+            )
+        estadisticas = cache.estadisticas()
+        st.caption(
+            f"Caché compartida: {estadisticas['entradas']} entradas, "
+            f"{estadisticas['ocupado_mb']} de {estadisticas['limite_mb']} MB; "
+            f"{estadisticas['aciertos']} aciertos, {estadisticas['fallos']} fallos, "
+            f"{estadisticas['desalojos']} descartes por memoria."
+        )
+
 else:
     st.info("Sube ambos archivos para habilitar los resultados y las descargas.")
+    # Sin archivos la sesión suelta su trabajo (se cancela si nadie más lo usa)
+    if "trabajo" in st.session_state:
+        soltar_trabajo(st.session_state.pop("trabajo"))
+
+# -------------------------------------------------------------------
+# Varios servicios: SIEL contra las carteras de varios servicios a la
+# vez y matriz consolidada (ver multiservicio.py). La topología de cada
+# libro se elige por sus hojas entre los topologia_*.json disponibles.
+# -------------------------------------------------------------------
+st.write("")
+st.write("")
+st.subheader("Varios servicios de salud")
+seccion_servicios = st.expander(
+    "Comparar SIEL con las carteras de varios servicios",
+    key="seccion_servicios",
+    on_change="rerun",
+)
+if seccion_servicios.open:
+    with seccion_servicios:
+        try:
+            from carga import hash_contenido
+            from exportar import FORMATOS as FORMATOS_DESCARGA
+            from multiservicio import Servicio, detectar_topologia, procesar_servicios
+            from topologia import topologias_disponibles
+
+            topologias = topologias_disponibles(CARPETA_TOPOLOGIAS)
+            st.caption(
+                "Topologías disponibles: "
+                + (", ".join(t.servicio for t in topologias) or "ninguna")
+                + ". Cada cartera se asigna al servicio cuyos hospitales son sus hojas."
+            )
+            archivos_servicios = st.file_uploader(
+                "Carteras de los servicios",
+                type=["xlsx"],
+                accept_multiple_files=True,
+                key="carteras_servicios",
+            )
+            if archivo_siel is None:
+                st.info("Sube el archivo SIEL para consolidar las carteras.")
+            elif archivos_servicios:
+                datos_siel_multi = archivo_siel.getvalue()
+                datos_servicios = [a.getvalue() for a in archivos_servicios]
+                clave_multi = (
+                    "servicios",
+                    hash_contenido(datos_siel_multi),
+                    tuple(hash_contenido(d) for d in datos_servicios),
+                )
+                if st.button("Consolidar servicios"):
+                    st.session_state["clave_servicios"] = clave_multi
+
+                if st.session_state.get("clave_servicios") == clave_multi:
+                    def consolidar_servicios():
+                        servicios = [
+                            Servicio(detectar_topologia(datos, topologias), datos)
+                            for datos in datos_servicios
+                        ]
+                        medidor_multi = Medidor({"clave": clave_multi[1]})
+                        resultado = procesar_servicios(
+                            datos_siel_multi, servicios, PROCESOS_LECTURA, medidor_multi
+                        )
+                        resultado.matriz.calcular_vistas()
+                        return resultado
+
+                    with st.spinner("Leyendo y consolidando las carteras..."):
+                        resultado_multi = cache.obtener(clave_multi, consolidar_servicios)
+
+                    st.dataframe(resultado_multi.resumen, use_container_width=True, hide_index=True)
+                    st.caption(
+                        f"{len(resultado_multi.matriz.base)} exámenes y "
+                        f"{len(resultado_multi.matriz.hospitales)} hospitales en la matriz consolidada; "
+                        f"{len(resultado_multi.siel_no_en_servicios)} exámenes SIEL no están en ningún servicio."
+                    )
+                    formato_multi = st.session_state.get("formato_descarga", list(FORMATOS_DESCARGA)[0])
+                    _, extension_multi, mime_multi = FORMATOS_DESCARGA[formato_multi]
+                    st.download_button(
+                        label="Descargar consolidado de servicios",
+                        data=lambda: cache.obtener(
+                            ("exportar",) + clave_multi + (formato_multi,),
+                            lambda: exportar_hojas(resultado_multi.hojas(), formato_multi),
+                        ),
+                        file_name=f"CONSOLIDADO_SERVICIOS{extension_multi}",
+                        mime=mime_multi,
+                        on_click="ignore",
+                    )
+        except Exception as e:
+            st.error(f"Ocurrió un error al consolidar los servicios: {e}")
+
+# -------------------------------------------------------------------
+# Tendencias entre versiones guardadas en el historial (no requiere
+# subir archivos): cobertura por Nodo, complejidad, hospital o examen
+# -------------------------------------------------------------------
+if CARPETA_HISTORIAL:
+    st.write("")
+    st.write("")
+    st.subheader("Tendencias entre versiones de la cartera")
+    seccion_tendencias = st.expander(
+        "Cobertura por Nodo, complejidad, hospital o examen en cada versión",
+        expanded=not SECCIONES_DIFERIDAS,
+        key="seccion_tendencias",
+        on_change="rerun",
+    )
+    if seccion_tendencias.open:
+        with seccion_tendencias:
+            try:
+                import altair as alt
+
+                from exportar import FORMATOS as FORMATOS_DESCARGA
+                from historial import Historial
+                from motor import HOSPITALES
+                from tendencias import CONSULTAS, consultar, ingestar_carpeta
+
+                historial = Historial(CARPETA_HISTORIAL)
+
+                if CARPETA_CARTERAS:
+                    with st.expander("Incorporar carteras antiguas desde una carpeta del servidor"):
+                        carpetas = carpetas_carteras(CARPETA_CARTERAS)
+                        carpeta_versiones = st.selectbox(
+                            "Carpeta con los archivos de cartera (.xlsx)",
+                            carpetas,
+                            format_func=lambda p: p.name,
+                        )
+                        if st.button("Incorporar al historial") and carpeta_versiones:
+                            with st.spinner("Leyendo carteras..."):
+                                informe = ingestar_carpeta(
+                                    historial, carpeta_versiones, HOSPITALES, PROCESOS_LECTURA
+                                )
+                            st.dataframe(informe, use_container_width=True, hide_index=True)
+
+                versiones = historial.versiones()
+                if len(versiones) < 2:
+                    st.info("Se necesitan al menos dos versiones en el historial para ver tendencias.")
+                else:
+                    tendencias = tendencias_cache(tuple(versiones["version"]), CARPETA_HISTORIAL)
+                    st.caption(
+                        f"{len(tendencias)} versiones, desde {versiones['fecha'].iloc[0]} "
+                        f"hasta {versiones['fecha'].iloc[-1]}."
+                    )
+
+                    tendencia_por = st.radio(
+                        "Tendencia por", list(CONSULTAS), horizontal=True, format_func=str.capitalize
+                    )
+                    numero_tendencia = None
+                    if tendencia_por == "examen":
+                        numero_tendencia = st.text_input("Número del examen", key="numero_tendencia")
+
+                    if tendencia_por != "examen" or numero_tendencia:
+                        df_tendencia = consultar(tendencias, tendencia_por, numero_tendencia)
+                        col_color, col_valor = CONSULTAS[tendencia_por]
+
+                        if tendencia_por == "examen":
+                            # Estado por hospital (filas) y versión (columnas)
+                            chart_tendencia = (
+                                alt.Chart(df_tendencia)
+                                .mark_rect()
+                                .encode(
+                                    x=alt.X("Fecha:T", title="Versión"),
+                                    y=alt.Y("Hospital:N", title="Hospital"),
+                                    color=alt.Color("Estado:N", title="Estado"),
+                                    tooltip=["Versión", "Hospital", "Estado"],
+                                )
+                            )
+                        else:
+                            chart_tendencia = (
+                                alt.Chart(df_tendencia)
+                                .mark_line(point=True)
+                                .encode(
+                                    x=alt.X("Fecha:T", title="Versión"),
+                                    y=alt.Y(f"{col_valor}:Q", title=col_valor),
+                                    color=alt.Color(f"{col_color}:N", title=col_color),
+                                    tooltip=list(df_tendencia.columns),
+                                )
+                            )
+                        st.altair_chart(chart_tendencia.properties(height=350), use_container_width=True)
+                        st.dataframe(df_tendencia, use_container_width=True, hide_index=True)
+
+                        nombre_tendencia = f"TENDENCIA_{tendencia_por.upper()}"
+                        st.download_button(
+                            label="Descargar tendencia",
+                            data=lambda: exportar_hojas({nombre_tendencia: df_tendencia}),
+                            file_name=f"{nombre_tendencia}.xlsx",
+                            mime=FORMATOS_DESCARGA["Excel (.xlsx)"][2],
+                            on_click="ignore",
+                        )
+
+            except Exception as e:
+                st.error(f"Ocurrió un error al consultar el historial: {e}")
 
 # -------------------------------------------------------------------
 # Pie de página
@@ -0,0 +1,220 @@
+"""Benchmark de las etapas del proceso sobre archivos sintéticos.
+
+Ejemplos:
+    python benchmark.py
+    python benchmark.py --examenes 1000 10000 200000 --sitios 14 100 --repeticiones 3
+    python benchmark.py --examenes 50000 --formatos xlsx parquet --json bench.json
+    python benchmark.py --arranque --repeticiones 5
+
+Genera (o reutiliza, si ya existen en --datos) los pares SIEL / cartera
+de cada tamaño con generar_datos.py, ejecuta las etapas del proceso
+(motor.procesar) con la misma topología de los archivos y muestra la
+mediana de segundos por etapa y tamaño. No requiere red ni datos reales.
+
+Con --arranque mide en cambio cuánto tarda app.py en quedar interactiva
+(la página de carga de archivos): en un proceso nuevo, como la primera
+sesión tras iniciar el servidor, y en una sesión nueva de un proceso que
+ya la sirvió.
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+
+import pandas as pd
+
+from exportar import FORMATOS, excel_bytes
+from generar_datos import generar_par, topologia_sintetica
+from motor import procesar
+from rendimiento import Medidor
+
+# Escritores medidos: los de la app y, como referencia, la escritura
+# anterior con pandas.ExcelWriter y openpyxl
+FORMATOS_BENCH = {
+    "xlsx": FORMATOS["Excel (.xlsx)"][0],
+    "xlsx-openpyxl": excel_bytes,
+    "csv": FORMATOS["CSV (.zip)"][0],
+    "parquet": FORMATOS["Parquet (.zip)"][0],
+}
+
+
+# -------------------------------------------------------------------
+# Etapas del proceso: motor.procesar (las mismas de la app y de lote.py)
+# con la topología sintética de los archivos, más la matriz con
+# etiquetas y las exportaciones
+# -------------------------------------------------------------------
+def medir_etapas(
+    datos_siel: bytes,
+    datos_cartera: bytes,
+    n_sitios: int,
+    medidor: Medidor,
+    formatos: list,
+    n_procesos: int = 1,
+):
+    resultado = procesar(
+        datos_siel, datos_cartera, n_procesos, medidor, topologia_sintetica(n_sitios)
+    )
+
+    with medidor.etapa("etiquetas_matriz") as registro:
+        registro["filas"] = len(resultado.matriz.df_matriz)
+
+    for formato in formatos:
+        hojas = resultado.hojas("ANALISIS_HOSPITALES_SSASUR")
+        with medidor.etapa(f"exportar analisis {formato}", filas=sum(len(df) for df in hojas.values())):
+            FORMATOS_BENCH[formato](hojas)
+
+
+# -------------------------------------------------------------------
+# Ejecución de todos los tamaños y repeticiones
+# -------------------------------------------------------------------
+def ejecutar(
+    examenes: list,
+    sitios: list,
+    repeticiones: int,
+    carpeta_datos: Path,
+    formatos: list,
+    n_procesos: int = 1,
+    medir_memoria: bool = False,
+) -> pd.DataFrame:
+    registros = []
+    for n_examenes in examenes:
+        for n_sitios in sitios:
+            ruta_siel = carpeta_datos / f"SIEL_{n_examenes}x{n_sitios}.xlsx"
+            ruta_cartera = carpeta_datos / f"CARTERA_{n_examenes}x{n_sitios}.xlsx"
+            if not (ruta_siel.exists() and ruta_cartera.exists()):
+                print(f"Generando {n_examenes} exámenes x {n_sitios} sitios...", flush=True)
+                generar_par(carpeta_datos, n_examenes, n_sitios)
+            datos_siel = ruta_siel.read_bytes()
+            datos_cartera = ruta_cartera.read_bytes()
+
+            for repeticion in range(repeticiones):
+                medidor = Medidor(
+                    {"examenes": n_examenes, "sitios": n_sitios, "repeticion": repeticion},
+                    memoria=medir_memoria,
+                )
+                medir_etapas(datos_siel, datos_cartera, n_sitios, medidor, formatos, n_procesos)
+                registros += [{**medidor.contexto, **e} for e in medidor.etapas]
+                print(
+                    f"{n_examenes} x {n_sitios}, repetición {repeticion + 1}: "
+                    f"{medidor.total_segundos()} s",
+                    flush=True,
+                )
+    return pd.DataFrame(registros)
+
+
+def resumir(registros: pd.DataFrame) -> pd.DataFrame:
+    """Mediana de segundos por etapa (filas) y tamaño (columnas)."""
+    tabla = registros.pivot_table(
+        index="etapa",
+        columns=["examenes", "sitios"],
+        values="segundos",
+        aggfunc="median",
+        sort=False,
+    )
+    tabla.loc["TOTAL"] = tabla.sum()
+    return tabla
+
+
+# -------------------------------------------------------------------
+# Tiempo hasta la primera página interactiva de app.py. Cada repetición
+# corre en un proceso nuevo con Streamlit ya importado (como el
+# servidor) y mide la primera ejecución del script y la de una segunda
+# sesión. El historial va a una carpeta temporal.
+# -------------------------------------------------------------------
+_MEDIR_ARRANQUE = """
+import json, os, sys, time
+import streamlit
+from streamlit.testing.v1 import AppTest
+os.chdir(sys.argv[1])
+tiempos = {}
+for sesion in ("proceso_nuevo", "sesion_nueva"):
+    app = AppTest.from_file("app.py", default_timeout=120)
+    inicio = time.perf_counter()
+    app.run()
+    tiempos[sesion] = time.perf_counter() - inicio
+    if app.exception:
+        raise SystemExit(app.exception[0].message)
+tiempos["modulos_pesados"] = sorted(
+    m for m in ("pandas", "altair", "openpyxl", "xlsxwriter", "pyarrow") if m in sys.modules
+)
+print(json.dumps(tiempos))
+"""
+
+
+def medir_arranque(repeticiones: int, carpeta_app: Path = None) -> pd.DataFrame:
+    carpeta_app = carpeta_app or Path(__file__).resolve().parent
+    registros = []
+    with tempfile.TemporaryDirectory() as historial:
+        entorno = {**os.environ, "SIEL_HISTORIAL": historial}
+        for repeticion in range(repeticiones):
+            salida = subprocess.run(
+                [sys.executable, "-c", _MEDIR_ARRANQUE, str(carpeta_app)],
+                capture_output=True, text=True, check=True, env=entorno,
+            )
+            tiempos = json.loads(salida.stdout.strip().splitlines()[-1])
+            registros.append({"repeticion": repeticion, **tiempos})
+            print(
+                f"repetición {repeticion + 1}: {tiempos['proceso_nuevo']:.3f} s proceso nuevo, "
+                f"{tiempos['sesion_nueva']:.3f} s sesión nueva",
+                flush=True,
+            )
+    return pd.DataFrame(registros)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--examenes", type=int, nargs="+", default=[1000, 10000])
+    parser.add_argument("--sitios", type=int, nargs="+", default=[14])
+    parser.add_argument("--repeticiones", type=int, default=3)
+    parser.add_argument("--datos", type=Path, default=Path("datos_bench"), help="carpeta de archivos sintéticos")
+    parser.add_argument("--formatos", nargs="*", choices=FORMATOS_BENCH, default=list(FORMATOS_BENCH))
+    parser.add_argument("--procesos", type=int, default=1, help="procesos de lectura")
+    parser.add_argument("--medir-memoria", action="store_true", help="pico de memoria por etapa (más lento)")
+    parser.add_argument("--json", type=Path, help="guarda todas las mediciones en este archivo")
+    parser.add_argument(
+        "--arranque", action="store_true",
+        help="mide el tiempo hasta la primera página interactiva de la app en vez de las etapas",
+    )
+    parser.add_argument("--app", type=Path, help="carpeta de app.py para --arranque (por defecto esta)")
+    args = parser.parse_args(argv)
+
+    if args.arranque:
+        registros = medir_arranque(args.repeticiones, args.app)
+        print()
+        print(registros[["proceso_nuevo", "sesion_nueva"]].median().round(3).to_string())
+        print("módulos pesados cargados:", ", ".join(registros["modulos_pesados"].iloc[-1]) or "ninguno")
+        if args.json is not None:
+            args.json.write_text(json.dumps(
+                {"python": platform.python_version(), "mediciones": registros.to_dict(orient="records")},
+                ensure_ascii=False,
+                indent=1,
+            ), encoding="utf-8")
+        return
+
+    registros = ejecutar(
+        args.examenes, args.sitios, args.repeticiones, args.datos,
+        args.formatos, args.procesos, args.medir_memoria,
+    )
+    print()
+    print(resumir(registros).round(3).to_string())
+
+    if args.json is not None:
+        args.json.write_text(json.dumps(
+            {
+                "python": platform.python_version(),
+                "pandas": pd.__version__,
+                "plataforma": platform.platform(),
+                "mediciones": registros.to_dict(orient="records"),
+            },
+            ensure_ascii=False,
+            indent=1,
+            default=str,
+        ), encoding="utf-8")
+
+
+if __name__ == "__main__":
+    main()
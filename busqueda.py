@@ -0,0 +1,79 @@
+"""Índice de exámenes para el selector: etiqueta -> fila de la matriz y búsqueda por texto."""
+import unicodedata
+from dataclasses import dataclass
+
+import numpy as np
+import pandas as pd
+
+
+# -------------------------------------------------------------------
+# Normalización de texto para búsquedas: sin tildes y en minúsculas
+# -------------------------------------------------------------------
+def normalizar_texto(texto) -> str:
+    texto = unicodedata.normalize("NFKD", str(texto))
+    texto = "".join(c for c in texto if not unicodedata.combining(c))
+    return " ".join(texto.casefold().split())
+
+
+# -------------------------------------------------------------------
+# Índice de exámenes, construido una vez por matriz. Las etiquetas
+# "Número - Nombre" quedan ordenadas y cada una apunta a su fila en la
+# matriz, así elegir un examen no requiere recorrer df_matriz.
+# -------------------------------------------------------------------
+@dataclass
+class IndiceExamenes:
+    etiquetas: np.ndarray   # ordenadas alfabéticamente
+    numeros: pd.Series      # Número normalizado, mismo orden
+    claves: pd.Series       # etiqueta normalizada, mismo orden
+    fila_de: dict           # etiqueta -> posición en la matriz
+
+    def __len__(self):
+        return len(self.etiquetas)
+
+
+def construir_indice_examenes(base: pd.DataFrame, claves: pd.Series = None) -> IndiceExamenes:
+    etiquetas = (
+        base["Número"].astype(str)
+        + " - "
+        + base["Nombre exámen SIEL"].astype(str)
+    )
+    # Primera fila de cada etiqueta, ordenadas por etiqueta
+    etiquetas = etiquetas[~etiquetas.duplicated()].sort_values()
+
+    fila_de = dict(zip(etiquetas.tolist(), etiquetas.index.tolist()))
+    # Número para búsqueda por prefijo: la clave canónica si viene
+    if claves is None:
+        claves = base["Número"].astype(str).str.strip()
+    numeros = claves.astype(str).loc[etiquetas.index]
+    claves = etiquetas.map(normalizar_texto)
+
+    return IndiceExamenes(
+        etiquetas=etiquetas.to_numpy(dtype=object),
+        numeros=numeros.reset_index(drop=True),
+        claves=claves.reset_index(drop=True),
+        fila_de=fila_de,
+    )
+
+
+# -------------------------------------------------------------------
+# Búsqueda incremental: primero los Número que empiezan con el texto,
+# luego las etiquetas que lo contienen al inicio de alguna palabra y al
+# final el resto de coincidencias. Solo se devuelven `limite` opciones.
+# -------------------------------------------------------------------
+def buscar_examenes(indice: IndiceExamenes, texto: str, limite: int = 50) -> list:
+    consulta = normalizar_texto(texto or "")
+    if not consulta:
+        return indice.etiquetas[:limite].tolist()
+
+    contiene = indice.claves.str.contains(consulta, regex=False).to_numpy()
+    por_numero = indice.numeros.str.startswith(consulta).to_numpy()
+    por_palabra = (
+        indice.claves.str.startswith(consulta)
+        | indice.claves.str.contains(" " + consulta, regex=False)
+    ).to_numpy()
+
+    # Rango 0 = mejor; el orden alfabético desempata (orden estable)
+    rango = np.where(por_numero, 0, np.where(por_palabra, 1, 2))
+    candidatos = np.flatnonzero(contiene)
+    mejores = candidatos[np.argsort(rango[candidatos], kind="stable")[:limite]]
+    return indice.etiquetas[mejores].tolist()
@@ -0,0 +1,118 @@
+"""Caché de objetos compartida por todas las sesiones de la app.
+
+Las sesiones que suben los mismos archivos (mismo hash) reciben el mismo
+objeto, sin copias: lo leído de la caché es de solo lectura. El total se
+mantiene bajo un límite de memoria; al superarlo se descartan las
+entradas usadas hace más tiempo (LRU).
+"""
+import sys
+import threading
+from collections import OrderedDict
+from dataclasses import is_dataclass
+
+
+# -------------------------------------------------------------------
+# Tamaño aproximado de un objeto en memoria (DataFrames, arreglos,
+# bytes y contenedores o dataclasses que los agrupan). Los objetos
+# compartidos entre partes del resultado se cuentan una vez. pandas y
+# numpy no se importan aquí: si no están cargados, el objeto no puede
+# ser de sus tipos.
+# -------------------------------------------------------------------
+def tamano_bytes(objeto, _vistos: set = None) -> int:
+    vistos = set() if _vistos is None else _vistos
+    if id(objeto) in vistos:
+        return 0
+    vistos.add(id(objeto))
+
+    pd = sys.modules.get("pandas")
+    np = sys.modules.get("numpy")
+    if pd is not None and isinstance(objeto, pd.DataFrame):
+        return int(objeto.memory_usage(index=True, deep=True).sum())
+    if pd is not None and isinstance(objeto, (pd.Series, pd.Index)):
+        return int(objeto.memory_usage(deep=True))
+    if np is not None and isinstance(objeto, np.ndarray):
+        return objeto.nbytes
+    if isinstance(objeto, (bytes, bytearray, str)):
+        return sys.getsizeof(objeto)
+    if isinstance(objeto, dict):
+        return sum(tamano_bytes(k, vistos) + tamano_bytes(v, vistos) for k, v in objeto.items())
+    if isinstance(objeto, (list, tuple, set)):
+        return sum(tamano_bytes(v, vistos) for v in objeto)
+    if is_dataclass(objeto):
+        # vars() incluye las vistas de cached_property ya calculadas
+        return sum(tamano_bytes(v, vistos) for v in vars(objeto).values())
+    return sys.getsizeof(objeto)
+
+
+# -------------------------------------------------------------------
+# Caché LRU con límite de memoria y contadores de aciertos / fallos
+# -------------------------------------------------------------------
+class CacheCompartida:
+    def __init__(self, limite_mb: float):
+        self.limite = int(limite_mb * 1024 * 1024)
+        self._entradas = OrderedDict()      # clave -> (objeto, bytes)
+        self._ocupado = 0
+        self._candado = threading.Lock()
+        self._calculando = {}               # clave -> candado del cálculo en curso
+        self.aciertos = 0
+        self.fallos = 0
+        self.desalojos = 0
+
+    def __len__(self):
+        return len(self._entradas)
+
+    def _acierto(self, clave):
+        self._entradas.move_to_end(clave)
+        self.aciertos += 1
+        return self._entradas[clave][0]
+
+    def obtener(self, clave, calcular):
+        """Objeto guardado bajo `clave`; si no está, lo calcula con `calcular()`.
+
+        Si dos sesiones piden a la vez la misma clave, la segunda espera
+        el cálculo de la primera en vez de repetirlo.
+        """
+        with self._candado:
+            if clave in self._entradas:
+                return self._acierto(clave)
+            candado_clave = self._calculando.setdefault(clave, threading.Lock())
+
+        with candado_clave:
+            with self._candado:
+                if clave in self._entradas:
+                    return self._acierto(clave)
+                self.fallos += 1
+            try:
+                objeto = calcular()
+                self._guardar(clave, objeto, tamano_bytes(objeto))
+            finally:
+                with self._candado:
+                    self._calculando.pop(clave, None)
+        return objeto
+
+    def _guardar(self, clave, objeto, tamano: int):
+        # Un objeto mayor que el límite completo no se guarda
+        if tamano > self.limite:
+            return
+        with self._candado:
+            if clave in self._entradas:
+                self._ocupado -= self._entradas.pop(clave)[1]
+            self._entradas[clave] = (objeto, tamano)
+            self._ocupado += tamano
+            while self._ocupado > self.limite:
+                _, (_, liberado) = self._entradas.popitem(last=False)
+                self._ocupado -= liberado
+                self.desalojos += 1
+
+    def estadisticas(self) -> dict:
+        with self._candado:
+            consultas = self.aciertos + self.fallos
+            return {
+                "entradas": len(self._entradas),
+                "ocupado_mb": round(self._ocupado / 1024 / 1024, 1),
+                "limite_mb": round(self.limite / 1024 / 1024, 1),
+                "aciertos": self.aciertos,
+                "fallos": self.fallos,
+                "desalojos": self.desalojos,
+                "tasa_aciertos": round(self.aciertos / consultas, 3) if consultas else None,
+            }
@@ -0,0 +1,489 @@
+"""Lectura y normalización de los archivos SIEL y cartera de prestaciones."""
+import hashlib
+import multiprocessing
+import posixpath
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from io import BytesIO
+from xml.etree import ElementTree
+
+import numpy as np
+import pandas as pd
+from pandas.io.parsers import TextParser
+
+
+# -------------------------------------------------------------------
+# Huella del contenido de un archivo subido
+# -------------------------------------------------------------------
+def hash_contenido(datos: bytes) -> str:
+    return hashlib.sha256(datos).hexdigest()
+
+
+# -------------------------------------------------------------------
+# Lectura en streaming (openpyxl read-only) de una hoja, conservando
+# solo algunas columnas. Las celdas se convierten igual que en
+# pd.read_excel y el resultado pasa por el mismo TextParser, así los
+# tipos y valores nulos quedan idénticos a la lectura tradicional.
+# openpyxl se importa recién al leer (la validación y el hash no lo
+# usan); los códigos de error son los de openpyxl.cell.cell.ERROR_CODES.
+# -------------------------------------------------------------------
+ERROR_CODES = ("#NULL!", "#DIV/0!", "#VALUE!", "#REF!", "#NAME?", "#NUM!", "#N/A")
+
+
+def _convertir_celda(valor):
+    if valor is None:
+        return ""
+    if isinstance(valor, float) and valor.is_integer():
+        return int(valor)
+    if isinstance(valor, str) and valor in ERROR_CODES:
+        return np.nan
+    return valor
+
+
+def _leer_hoja(libro, nombre_hoja: str, elegir_columnas=None) -> pd.DataFrame:
+    if nombre_hoja not in libro.sheetnames:
+        raise ValueError(f"Worksheet named '{nombre_hoja}' not found")
+
+    hoja = libro[nombre_hoja]
+    hoja.reset_dimensions()
+
+    filas = []
+    indices = None
+    ultima_con_datos = -1
+    for n_fila, fila in enumerate(hoja.iter_rows(values_only=True)):
+        fila = [_convertir_celda(v) for v in fila]
+        # Celdas vacías al final (p. ej. con formato pero sin valor) no
+        # cuentan como columnas, igual que en pd.read_excel
+        while fila and fila[-1] == "":
+            fila.pop()
+        if fila:
+            ultima_con_datos = n_fila
+
+        if indices is None and elegir_columnas is not None:
+            indices = elegir_columnas(fila)
+        if indices is not None:
+            fila = [fila[i] if i < len(fila) else "" for i in indices]
+        filas.append(fila)
+
+    # Quitar filas vacías al final y completar filas cortas
+    filas = filas[: ultima_con_datos + 1]
+    if filas:
+        ancho = max(len(f) for f in filas)
+        filas = [f + [""] * (ancho - len(f)) for f in filas]
+
+    return TextParser(filas, header=0).read()
+
+
+def _columnas_hospital(encabezado: list) -> list:
+    # Número (o columna A si no existe) + Cartera
+    if "Cartera" not in encabezado:
+        raise KeyError("Cartera")
+    idx_numero = encabezado.index("Número") if "Número" in encabezado else 0
+    return sorted({idx_numero, encabezado.index("Cartera")})
+
+
+# -------------------------------------------------------------------
+# Cartera: BD + hojas de hospitales abriendo el libro una sola vez
+# -------------------------------------------------------------------
+def _leer_hojas(datos_cartera: bytes, hojas: list) -> dict:
+    from openpyxl import load_workbook
+
+    libro = load_workbook(
+        BytesIO(datos_cartera), read_only=True, data_only=True, keep_links=False
+    )
+    try:
+        return {
+            h: _leer_hoja(libro, h, None if h == "BD" else _columnas_hospital)
+            for h in hojas
+        }
+    finally:
+        libro.close()
+
+
+def leer_cartera(datos_cartera: bytes, hospitales: list):
+    """(hoja BD, {hospital: hoja}) tal como vienen; ver homologar_bd."""
+    hojas = _leer_hojas(datos_cartera, ["BD"] + list(hospitales))
+    df_bd = hojas.pop("BD")
+    return df_bd, hojas
+
+
+# Nombre antiguo de la columna de nombre en la hoja BD
+RENOMBRAR_BD = {"Nombre exámen": "Nombre exámen SIEL"}
+
+
+def columnas_homologadas_bd(columnas) -> list:
+    """Columnas de BD con "Nombre exámen SIEL" (si solo trae el nombre antiguo)."""
+    columnas = list(columnas)
+    if "Nombre exámen SIEL" in columnas:
+        return columnas
+    return [RENOMBRAR_BD.get(c, c) for c in columnas]
+
+
+def homologar_bd(df_bd: pd.DataFrame) -> pd.DataFrame:
+    """Hoja BD leída con leer_cartera, con sus columnas homologadas."""
+    return df_bd.set_axis(columnas_homologadas_bd(df_bd.columns), axis=1)
+
+
+def _leer_siel(datos_siel: bytes) -> pd.DataFrame:
+    return pd.read_excel(BytesIO(datos_siel))
+
+
+# Nombres de columnas de SIEL homologados a los de la hoja BD
+RENOMBRAR_SIEL = {"Nombre exámen": "Nombre exámen SIEL", "Sección": "Sección SIEL"}
+
+
+def leer_siel(datos_siel: bytes) -> pd.DataFrame:
+    """Archivo SIEL con sus columnas homologadas (sin alinear a una BD)."""
+    return _leer_siel(datos_siel).rename(columns=RENOMBRAR_SIEL)
+
+
+# -------------------------------------------------------------------
+# Validación previa del esquema: solo nombres de hojas y encabezados,
+# sin parsear los datos. El .xlsx se lee como zip y cada hoja con
+# iterparse hasta su primera fila con datos; de sharedStrings solo se
+# recorren las entradas que usan los encabezados. Así la validación no
+# depende del tamaño de los archivos.
+# -------------------------------------------------------------------
+_NS = "{http://schemas.openxmlformats.org/spreadsheetml/2006/main}"
+_NS_REL = "{http://schemas.openxmlformats.org/officeDocument/2006/relationships}"
+_NS_PKG = "{http://schemas.openxmlformats.org/package/2006/relationships}"
+_NS_TIPOS = "{http://schemas.openxmlformats.org/package/2006/content-types}"
+
+# Tipos de contenido del libro, en el orden en que los busca openpyxl
+_TIPOS_LIBRO = [
+    "application/vnd.ms-excel.template.macroEnabled.main+xml",
+    "application/vnd.openxmlformats-officedocument.spreadsheetml.template.main+xml",
+    "application/vnd.ms-excel.sheet.macroEnabled.main+xml",
+    "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml",
+]
+
+
+def _ruta_libro(paquete) -> str:
+    """Parte del libro en el zip, buscada como en openpyxl: por su tipo en
+    [Content_Types].xml, o xl/workbook.xml si el tipo es el predeterminado."""
+    tipos = ElementTree.fromstring(paquete.read("[Content_Types].xml"))
+    partes = {o.get("ContentType"): o.get("PartName") for o in tipos.iter(_NS_TIPOS + "Override")}
+    for tipo in _TIPOS_LIBRO:
+        if tipo in partes:
+            return partes[tipo].lstrip("/")
+    if any(d.get("ContentType") in _TIPOS_LIBRO for d in tipos.iter(_NS_TIPOS + "Default")):
+        return "xl/workbook.xml"
+    raise ValueError("El archivo no contiene un libro de Excel válido")
+
+
+def _ruta_en_zip(destino: str, carpeta: str) -> str:
+    # Los destinos relativos son relativos a la carpeta de la parte
+    if destino.startswith("/"):
+        return destino[1:]
+    return posixpath.normpath(posixpath.join(carpeta, destino))
+
+
+def _indice_columna(ref: str) -> int:
+    indice = 0
+    for letra in ref:
+        if not letra.isalpha():
+            break
+        indice = indice * 26 + ord(letra.upper()) - 64
+    return indice - 1
+
+
+def _texto(elemento) -> str:
+    # Texto de <si> / <is>: <t> directo o los <t> de cada tramo <r>,
+    # dejando fuera la guía fonética (<rPh>)
+    partes = []
+    for hijo in elemento:
+        if hijo.tag == _NS + "t":
+            partes.append(hijo.text or "")
+        elif hijo.tag == _NS + "r":
+            t = hijo.find(_NS + "t")
+            partes.append((t.text or "") if t is not None else "")
+    return "".join(partes)
+
+
+def _primera_fila(paquete, ruta: str):
+    """(número de fila, celdas) de la primera fila con algún valor."""
+    numero = 0
+    for _, elemento in ElementTree.iterparse(paquete.open(ruta)):
+        if elemento.tag != _NS + "row":
+            continue
+        # El atributo r es opcional: sin él, la fila sigue a la anterior
+        r = elemento.get("r")
+        numero = int(float(r)) if r else numero + 1
+        celdas = {}
+        for n, c in enumerate(elemento.iter(_NS + "c")):
+            tipo = c.get("t", "n")
+            ref = c.get("r")
+            col = _indice_columna(ref) if ref else n
+            if tipo == "inlineStr":
+                nodo = c.find(_NS + "is")
+                valor = ("inline", _texto(nodo)) if nodo is not None else None
+            else:
+                v = c.find(_NS + "v")
+                valor = (tipo, v.text) if v is not None and v.text is not None else None
+            if valor is not None:
+                celdas[col] = valor
+        elemento.clear()
+        if celdas:
+            return numero, celdas
+    return 0, {}
+
+
+def _compartidos(paquete, ruta: str, indices: set) -> dict:
+    textos = {}
+    if not indices:
+        return textos
+    ultimo = max(indices)
+    n = 0
+    for _, elemento in ElementTree.iterparse(paquete.open(ruta)):
+        if elemento.tag != _NS + "si":
+            continue
+        if n in indices:
+            textos[n] = _texto(elemento)
+        elemento.clear()
+        if n >= ultimo:
+            break
+        n += 1
+    return textos
+
+
+def _valor_encabezado(tipo: str, texto: str, compartidos: dict):
+    if tipo == "s":
+        return compartidos.get(int(texto), "")
+    if tipo in ("inline", "str"):
+        return texto
+    if tipo == "b":
+        return bool(int(texto))
+    if tipo == "e":
+        return np.nan
+    valor = float(texto)
+    return int(valor) if valor.is_integer() else valor
+
+
+def encabezados_xlsx(datos: bytes, hojas: list = None):
+    """Devuelve (nombres de hojas, {hoja: (n° fila, encabezado)}).
+
+    Sin `hojas` se lee solo la primera hoja. Las celdas vacías del
+    encabezado quedan como "Unnamed: n", igual que en TextParser.
+    """
+    with zipfile.ZipFile(BytesIO(datos)) as paquete:
+        ruta_libro = _ruta_libro(paquete)
+        carpeta, archivo = posixpath.split(ruta_libro)
+        libro = ElementTree.fromstring(paquete.read(ruta_libro))
+        relaciones = [
+            r
+            for r in ElementTree.fromstring(
+                paquete.read(posixpath.join(carpeta, "_rels", f"{archivo}.rels"))
+            ).iter(_NS_PKG + "Relationship")
+            if r.get("TargetMode") != "External"
+        ]
+        destinos = {r.get("Id"): _ruta_en_zip(r.get("Target"), carpeta) for r in relaciones}
+        ruta_compartidos = next(
+            (destinos[r.get("Id")] for r in relaciones if r.get("Type", "").endswith("/sharedStrings")),
+            None,
+        )
+        rutas = {h.get("name"): destinos[h.get(_NS_REL + "id")] for h in libro.iter(_NS + "sheet")}
+        nombres = list(rutas)
+        if hojas is None:
+            hojas = nombres[:1]
+
+        filas = {h: _primera_fila(paquete, rutas[h]) for h in hojas if h in rutas}
+        indices = {
+            int(texto)
+            for _, celdas in filas.values()
+            for tipo, texto in celdas.values()
+            if tipo == "s"
+        }
+        compartidos = _compartidos(paquete, ruta_compartidos, indices) if ruta_compartidos else {}
+
+    encabezados = {}
+    for h, (numero, celdas) in filas.items():
+        ancho = max(celdas) + 1 if celdas else 0
+        encabezado = []
+        for i in range(ancho):
+            valor = _valor_encabezado(*celdas[i], compartidos) if i in celdas else ""
+            valor = "" if valor is None else valor
+            encabezado.append(str(valor) if valor != "" else f"Unnamed: {i}")
+        encabezados[h] = (numero, encabezado)
+    return nombres, encabezados
+
+
+def validar_esquema(datos_siel: bytes, datos_cartera: bytes, hospitales: list) -> list:
+    """Lista de problemas de hojas y columnas (vacía si todo está bien)."""
+    problemas = []
+
+    columnas_bd = None
+    try:
+        hojas, encabezados = encabezados_xlsx(datos_cartera, ["BD"] + list(hospitales))
+    except Exception as e:
+        problemas.append(f"No se pudo abrir el archivo de cartera: {e}")
+    else:
+        if "BD" not in hojas:
+            problemas.append("La cartera no tiene la hoja BD")
+        else:
+            columnas_bd = columnas_homologadas_bd(encabezados["BD"][1])
+            if "Número" not in columnas_bd:
+                problemas.append("La hoja BD de la cartera no tiene la columna Número")
+            if "Nombre exámen SIEL" not in columnas_bd:
+                problemas.append(
+                    "La hoja BD de la cartera no tiene la columna Nombre exámen SIEL (ni Nombre exámen)"
+                )
+        for h in hospitales:
+            if h not in hojas:
+                problemas.append(f"La cartera no tiene la hoja del hospital {h}")
+                continue
+            # La lectura de hospitales toma la fila 1 como encabezado
+            numero, encabezado = encabezados[h]
+            if numero != 1 or "Cartera" not in encabezado:
+                problemas.append(f"La hoja {h} de la cartera no tiene la columna Cartera")
+
+    try:
+        hojas, encabezados = encabezados_xlsx(datos_siel)
+    except Exception as e:
+        problemas.append(f"No se pudo abrir el archivo SIEL: {e}")
+    else:
+        if not hojas:
+            problemas.append("El archivo SIEL no tiene hojas")
+        elif columnas_bd is not None:
+            columnas_siel = {RENOMBRAR_SIEL.get(c, c) for c in encabezados[hojas[0]][1]}
+            faltantes = [c for c in columnas_bd if c not in columnas_siel]
+            if faltantes:
+                problemas.append(
+                    "Al archivo SIEL le faltan columnas de la hoja BD: " + ", ".join(faltantes)
+                )
+
+    return problemas
+
+
+# -------------------------------------------------------------------
+# Lectura en paralelo (opcional): el archivo SIEL y grupos de hojas de
+# la cartera se parsean a la vez en procesos separados. El pool se
+# reutiliza entre lecturas para no pagar el arranque de cada proceso.
+# -------------------------------------------------------------------
+_pool = None
+_pool_procesos = 0
+
+
+def _obtener_pool(n_procesos: int) -> ProcessPoolExecutor:
+    global _pool, _pool_procesos
+    if _pool is None or _pool_procesos != n_procesos:
+        if _pool is not None:
+            _pool.shutdown(wait=False, cancel_futures=True)
+        # "spawn" evita heredar los hilos del servidor de Streamlit
+        _pool = ProcessPoolExecutor(
+            max_workers=n_procesos,
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+        _pool_procesos = n_procesos
+    return _pool
+
+
+def _descartar_pool():
+    global _pool, _pool_procesos
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+    _pool = None
+    _pool_procesos = 0
+
+
+def _leer_en_paralelo(datos_siel: bytes, datos_cartera: bytes, hospitales: list, n_procesos: int):
+    hojas = ["BD"] + list(hospitales)
+    grupos = [hojas[i::n_procesos] for i in range(n_procesos)]
+
+    pool = _obtener_pool(n_procesos)
+    futuro_siel = pool.submit(_leer_siel, datos_siel)
+    futuros = [pool.submit(_leer_hojas, datos_cartera, g) for g in grupos if g]
+
+    leidas = {}
+    for futuro in futuros:
+        leidas.update(futuro.result())
+    df_siel = futuro_siel.result()
+
+    df_bd = leidas.pop("BD")
+    dfs_hospitales = {h: leidas[h] for h in hospitales}
+    return df_siel, df_bd, dfs_hospitales
+
+
+def leer_archivos(datos_siel: bytes, datos_cartera: bytes, hospitales: list, n_procesos: int = 1):
+    """Devuelve (df_siel, df_bd, dfs_hospitales) tal como vienen en los Excel.
+
+    Con n_procesos > 1 la lectura se reparte en un pool de procesos; si el
+    pool no se puede usar (entorno sin multiprocessing, proceso caído) se
+    vuelve a la lectura en serie.
+    """
+    if n_procesos and n_procesos > 1:
+        try:
+            return _leer_en_paralelo(datos_siel, datos_cartera, hospitales, n_procesos)
+        except (BrokenProcessPool, OSError):
+            _descartar_pool()
+
+    df_siel = _leer_siel(datos_siel)
+    df_bd, dfs_hospitales = leer_cartera(datos_cartera, hospitales)
+    return df_siel, df_bd, dfs_hospitales
+
+
+# -------------------------------------------------------------------
+# Clave canónica de Número, calculada una vez por hoja. 123, 123.0 y
+# " 123 " quedan como el mismo entero; si la hoja tiene Números que no
+# son enteros (o vacíos) la clave es texto, con los enteros escritos sin
+# decimales, para que siga calzando con la de otras hojas. Cruces, isin
+# y búsquedas usan esta clave y no el valor original de la celda.
+# -------------------------------------------------------------------
+def clave_numero(serie: pd.Series) -> pd.Series:
+    nulos = serie.isna().to_numpy(copy=True)
+    texto = serie.astype(str).str.strip()
+    nulos |= (texto == "").to_numpy(dtype=bool, na_value=True)
+
+    valores = pd.to_numeric(texto.where(~nulos), errors="coerce").to_numpy(
+        dtype=float, na_value=np.nan
+    )
+    with np.errstate(invalid="ignore"):
+        enteros = np.isfinite(valores) & (valores == np.floor(valores)) & (np.abs(valores) < 2**53)
+
+    if enteros.all():
+        return pd.Series(valores.astype(np.int64), index=serie.index, name="Número")
+
+    claves = texto.to_numpy(dtype=object, na_value=None)
+    claves[enteros] = valores[enteros].astype(np.int64).astype(str)
+    claves[nulos] = None
+    return pd.Series(claves, index=serie.index, name="Número", dtype=object)
+
+
+def claves_comparables(*claves: pd.Series) -> list:
+    """Deja las claves en un mismo tipo: int64 si todas lo son, si no texto."""
+    if all(c.dtype == np.int64 for c in claves):
+        return list(claves)
+    return [
+        pd.Series(c.to_numpy().astype(str).astype(object), index=c.index, name=c.name)
+        if c.dtype == np.int64 else c
+        for c in claves
+    ]
+
+
+# -------------------------------------------------------------------
+# Carga de dataframes base + hojas de hospitales
+# -------------------------------------------------------------------
+def cargar_insumos(datos_siel: bytes, datos_cartera: bytes, hospitales: list, n_procesos: int = 1):
+    """Devuelve (df_siel, df_bd, dfs_hospitales, claves) ya homologados.
+
+    `claves` tiene la clave canónica de Número de cada hoja: "SIEL", "BD"
+    y una entrada por hospital.
+    """
+    df_siel, df_bd, dfs_hospitales = leer_archivos(
+        datos_siel, datos_cartera, hospitales, n_procesos
+    )
+
+    # Homologar nombres de columnas en SIEL y BD
+    df_siel = df_siel.rename(columns=RENOMBRAR_SIEL)
+    df_bd = homologar_bd(df_bd)
+
+    # Alinear columnas de df_siel con las de df_bd
+    df_siel = df_siel[df_bd.columns]
+
+    claves = {"SIEL": clave_numero(df_siel["Número"]), "BD": clave_numero(df_bd["Número"])}
+    for h, df_h in dfs_hospitales.items():
+        # Detectar columna Número (si no, columna A)
+        num_col = "Número" if "Número" in df_h.columns else df_h.columns[0]
+        claves[h] = clave_numero(df_h[num_col])
+
+    return df_siel, df_bd, dfs_hospitales, claves
@@ -0,0 +1,141 @@
+"""Generación de los archivos de descarga (Excel, CSV y Parquet)."""
+import zipfile
+from io import BytesIO
+
+import pandas as pd
+
+MIME_XLSX = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+MIME_ZIP = "application/zip"
+
+MAX_FILAS_EXCEL = 1048576
+MAX_NOMBRE_HOJA = 31
+CARACTERES_INVALIDOS_HOJA = "[]:*?/\\"
+
+
+def problema_nombre_hoja(nombre: str):
+    """Por qué `nombre` no sirve como nombre de hoja de Excel (None si sirve)."""
+    if not isinstance(nombre, str) or not nombre.strip():
+        return "el nombre de hoja no puede estar vacío"
+    if len(nombre) > MAX_NOMBRE_HOJA:
+        return f"el nombre de hoja tiene {len(nombre)} caracteres (máximo {MAX_NOMBRE_HOJA})"
+    invalidos = sorted({c for c in nombre if c in CARACTERES_INVALIDOS_HOJA})
+    if invalidos:
+        return f"el nombre de hoja no puede contener {' '.join(invalidos)}"
+    if nombre.startswith("'") or nombre.endswith("'"):
+        return "el nombre de hoja no puede empezar ni terminar con '"
+    return None
+
+
+# -------------------------------------------------------------------
+# Valores de un DataFrame fila a fila, ya convertidos a tipos que
+# xlsxwriter escribe directo (None = celda vacía). La conversión es
+# por columna, así el costo por celda queda en C.
+# -------------------------------------------------------------------
+def _filas_para_excel(df: pd.DataFrame):
+    columnas = []
+    for _, serie in df.items():
+        if isinstance(serie.dtype, pd.DatetimeTZDtype):
+            serie = serie.dt.tz_localize(None)
+        valores = serie.astype(object)
+        columnas.append(valores.where(serie.notna(), None).tolist())
+    return zip(*columnas)
+
+
+# -------------------------------------------------------------------
+# Excel en modo streaming (xlsxwriter constant_memory): cada fila se
+# escribe y se descarta, así la memoria no crece con el tamaño de la
+# hoja. El encabezado usa el mismo estilo que pandas.to_excel.
+# xlsxwriter se importa recién al generar el primer Excel.
+# -------------------------------------------------------------------
+def xlsx_bytes(hojas: dict) -> bytes:
+    import xlsxwriter
+
+    buffer = BytesIO()
+    libro = xlsxwriter.Workbook(buffer, {
+        "constant_memory": True,
+        "strings_to_formulas": False,
+        "strings_to_urls": False,
+        "default_date_format": "yyyy-mm-dd hh:mm:ss",
+    })
+    formato_encabezado = libro.add_format(
+        {"bold": True, "border": 1, "align": "center", "valign": "top"}
+    )
+
+    for nombre, df in hojas.items():
+        if len(df) + 1 > MAX_FILAS_EXCEL:
+            raise ValueError(
+                f"La hoja {nombre} tiene {len(df)} filas; Excel admite hasta {MAX_FILAS_EXCEL - 1}"
+            )
+        hoja = libro.add_worksheet(nombre)
+        hoja.write_row(0, 0, [str(c) for c in df.columns], formato_encabezado)
+        for n_fila, fila in enumerate(_filas_para_excel(df), start=1):
+            hoja.write_row(n_fila, 0, fila)
+
+    libro.close()
+    return buffer.getvalue()
+
+
+# -------------------------------------------------------------------
+# Paquetes .zip con un archivo por hoja, para procesos posteriores
+# -------------------------------------------------------------------
+def zip_csv_bytes(hojas: dict) -> bytes:
+    buffer = BytesIO()
+    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as paquete:
+        for nombre, df in hojas.items():
+            paquete.writestr(f"{nombre}.csv", df.to_csv(index=False).encode("utf-8"))
+    return buffer.getvalue()
+
+
+def _para_parquet(df: pd.DataFrame) -> pd.DataFrame:
+    # Parquet exige un tipo por columna: las columnas con tipos mezclados
+    # (p. ej. Número con textos y enteros) se guardan como texto
+    df = df.copy()
+    for col in df.columns:
+        if df[col].dtype == object and pd.api.types.infer_dtype(df[col], skipna=True).startswith("mixed"):
+            df[col] = df[col].where(df[col].isna(), df[col].astype(str))
+    df.columns = [str(c) for c in df.columns]
+    return df
+
+
+def zip_parquet_bytes(hojas: dict) -> bytes:
+    buffer = BytesIO()
+    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_STORED) as paquete:
+        for nombre, df in hojas.items():
+            contenido = BytesIO()
+            _para_parquet(df).to_parquet(contenido, index=False)
+            paquete.writestr(f"{nombre}.parquet", contenido.getvalue())
+    return buffer.getvalue()
+
+
+# -------------------------------------------------------------------
+# Formatos disponibles: nombre -> (función, extensión, mime)
+# -------------------------------------------------------------------
+FORMATOS = {
+    "Excel (.xlsx)": (xlsx_bytes, ".xlsx", MIME_XLSX),
+    "CSV (.zip)": (zip_csv_bytes, ".zip", MIME_ZIP),
+    "Parquet (.zip)": (zip_parquet_bytes, ".zip", MIME_ZIP),
+}
+
+
+# Nombres cortos de los formatos para --formato en lote.py y multiservicio.py
+FORMATOS_CLI = {
+    "xlsx": "Excel (.xlsx)",
+    "csv": "CSV (.zip)",
+    "parquet": "Parquet (.zip)",
+}
+
+
+def exportar(hojas: dict, formato: str = "Excel (.xlsx)") -> bytes:
+    funcion, _, _ = FORMATOS[formato]
+    return funcion(hojas)
+
+
+# -------------------------------------------------------------------
+# Escritura anterior con pandas.ExcelWriter (referencia para medir)
+# -------------------------------------------------------------------
+def excel_bytes(hojas: dict, engine: str = "openpyxl") -> bytes:
+    buffer = BytesIO()
+    with pd.ExcelWriter(buffer, engine=engine) as writer:
+        for nombre, df in hojas.items():
+            df.to_excel(writer, index=False, sheet_name=nombre)
+    return buffer.getvalue()
@@ -0,0 +1,167 @@
+"""Generador de archivos SIEL y cartera sintéticos para pruebas de rendimiento.
+
+Ejemplo:
+    python generar_datos.py --examenes 10000 --sitios 14 --salida datos_bench
+
+Crea SIEL_<examenes>x<sitios>.xlsx y CARTERA_<examenes>x<sitios>.xlsx con
+la misma estructura que los archivos reales (hoja BD + una hoja por
+hospital), sin datos de pacientes. Incluye los casos que el proceso debe
+tolerar: Números como texto con espacios, hojas sin columna Número,
+Cartera en minúsculas, vacía o con valores inesperados, filas repetidas
+y exámenes que faltan en un lado u otro. Misma semilla = mismos archivos.
+"""
+import argparse
+from datetime import datetime
+from pathlib import Path
+
+import numpy as np
+import xlsxwriter
+
+from motor import COMPLEJIDAD, HOSPITALES, NODOS, TOPOLOGIA
+from topologia import Topologia
+
+SECCIONES = ["QUIMICA", "HEMATOLOGIA", "INMUNOLOGIA", "MICROBIOLOGIA", "ORINA", "HORMONAS"]
+PALABRAS = [
+    "ácido", "úrico", "glucosa", "hemoglobina", "glicosilada", "proteína",
+    "C reactiva", "sodio", "potasio", "cloro", "colesterol", "HDL", "LDL",
+    "triglicéridos", "creatinina", "orina", "cultivo", "antígeno", "anticuerpo",
+    "TSH", "T4 libre", "ferritina", "vitamina", "B12", "perfil", "lipídico",
+]
+# Valores de Cartera y su probabilidad
+VALORES_CARTERA = ["SI", "NO", "si ", "No", "", "NO APLICA"]
+PROB_CARTERA = [0.52, 0.36, 0.04, 0.03, 0.04, 0.01]
+
+
+# -------------------------------------------------------------------
+# Topología sintética: los 14 hospitales reales y, sobre eso, sitios
+# H015, H016, ... repartidos entre los Nodos existentes (baja
+# complejidad), para probar carteras de hasta 100 sitios. Los grupos y
+# las carteras agregadas son los de la topología configurada.
+# -------------------------------------------------------------------
+def topologia_sintetica(n_sitios: int) -> Topologia:
+    hospitales = list(HOSPITALES[:n_sitios])
+    hospitales += [f"H{n:03d}" for n in range(len(hospitales) + 1, n_sitios + 1)]
+
+    nodos = {nodo: list(lista) for nodo, lista in NODOS.items()}
+    complejidad = dict(COMPLEJIDAD)
+    nombres_nodos = list(nodos)
+    for k, h in enumerate(hospitales[len(HOSPITALES):]):
+        nodos[nombres_nodos[k % len(nombres_nodos)]].append(h)
+        complejidad[h] = "BAJA"
+
+    nodos = {n: [h for h in lista if h in hospitales] for n, lista in nodos.items()}
+    complejidad = {h: c for h, c in complejidad.items() if h in hospitales}
+    return Topologia(
+        servicio=f"{TOPOLOGIA.servicio}_{n_sitios}",
+        hospitales=hospitales,
+        nodos=nodos,
+        complejidad=complejidad,
+        grupos={g: [h for h in lista if h in hospitales] for g, lista in TOPOLOGIA.grupos.items()},
+        carteras=dict(TOPOLOGIA.carteras),
+    )
+
+
+def _nombres(rng, numeros) -> list:
+    indices = rng.integers(0, len(PALABRAS), size=(len(numeros), 3))
+    return [
+        f"{PALABRAS[a].capitalize()} {PALABRAS[b]} {PALABRAS[c]} {n}"
+        for n, (a, b, c) in zip(numeros, indices)
+    ]
+
+
+def _escribir_libro(ruta: Path, hojas: dict):
+    libro = xlsxwriter.Workbook(str(ruta), {"constant_memory": True, "strings_to_numbers": False})
+    # Fecha fija: misma semilla = mismo archivo, byte a byte
+    libro.set_properties({"created": datetime(2025, 1, 1)})
+    for nombre, (encabezado, columnas) in hojas.items():
+        hoja = libro.add_worksheet(nombre)
+        hoja.write_row(0, 0, encabezado)
+        for n_fila, fila in enumerate(zip(*columnas), start=1):
+            hoja.write_row(n_fila, 0, fila)
+    libro.close()
+
+
+# -------------------------------------------------------------------
+# Generación de un par SIEL / cartera
+# -------------------------------------------------------------------
+def generar_par(carpeta, n_examenes: int, n_sitios: int = 14, semilla: int = 0):
+    """Escribe el par en `carpeta` y devuelve (ruta SIEL, ruta cartera, hospitales)."""
+    rng = np.random.default_rng(semilla)
+    carpeta = Path(carpeta)
+    carpeta.mkdir(parents=True, exist_ok=True)
+    hospitales = topologia_sintetica(n_sitios).hospitales
+
+    numeros = np.arange(1000, 1000 + n_examenes)
+    nombres = _nombres(rng, numeros)
+    secciones = rng.choice(SECCIONES, size=n_examenes).tolist()
+    codigos = [f"C{n}" for n in numeros]
+
+    # Cartera: BD con ~0,5 % de filas repetidas
+    repetidas = rng.choice(n_examenes, size=n_examenes // 200, replace=False)
+    orden_bd = np.sort(np.concatenate([np.arange(n_examenes), repetidas]))
+    hojas_cartera = {
+        "BD": (
+            ["Número", "Nombre exámen SIEL", "Sección SIEL", "Código"],
+            [
+                numeros[orden_bd].tolist(),
+                [nombres[i] for i in orden_bd],
+                [secciones[i] for i in orden_bd],
+                [codigos[i] for i in orden_bd],
+            ],
+        )
+    }
+    for j, h in enumerate(hospitales):
+        # ~90 % de los exámenes informados, en orden aleatorio
+        filas = rng.permutation(np.flatnonzero(rng.random(n_examenes) < 0.9))
+        numeros_h = numeros[filas].astype(object)
+        # ~2 % de Números escritos como texto con espacios
+        como_texto = rng.random(len(filas)) < 0.02
+        numeros_h[como_texto] = [f" {n} " for n in numeros_h[como_texto]]
+        cartera = rng.choice(VALORES_CARTERA, size=len(filas), p=PROB_CARTERA).tolist()
+        # Una de cada tres hojas no tiene encabezado Número (se usa la columna A)
+        col_numero = "Número" if j % 3 else "Cod"
+        hojas_cartera[h] = (
+            [col_numero, "Nombre", "Cartera"],
+            [numeros_h.tolist(), [nombres[i] for i in filas], cartera],
+        )
+
+    # SIEL: 90 % de los exámenes de la cartera + 10 % que no están en ella
+    n_comunes = int(n_examenes * 0.9)
+    nuevos = np.arange(9_000_000, 9_000_000 + n_examenes - n_comunes)
+    numeros_siel = np.concatenate([numeros[:n_comunes], nuevos])
+    nombres_siel = nombres[:n_comunes] + _nombres(rng, nuevos)
+    hojas_siel = {
+        "Hoja1": (
+            ["Número", "Nombre exámen", "Sección", "Código", "Vigente"],
+            [
+                numeros_siel.tolist(),
+                nombres_siel,
+                rng.choice(SECCIONES, size=len(numeros_siel)).tolist(),
+                [f"C{n}" for n in numeros_siel],
+                ["SI"] * len(numeros_siel),
+            ],
+        )
+    }
+
+    ruta_siel = carpeta / f"SIEL_{n_examenes}x{n_sitios}.xlsx"
+    ruta_cartera = carpeta / f"CARTERA_{n_examenes}x{n_sitios}.xlsx"
+    _escribir_libro(ruta_siel, hojas_siel)
+    _escribir_libro(ruta_cartera, hojas_cartera)
+    return ruta_siel, ruta_cartera, hospitales
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--examenes", type=int, default=10000, help="exámenes en la cartera (1000 a 200000)")
+    parser.add_argument("--sitios", type=int, default=14, help="hospitales (14 a 100)")
+    parser.add_argument("--semilla", type=int, default=0)
+    parser.add_argument("--salida", type=Path, default=Path("datos_bench"))
+    args = parser.parse_args(argv)
+
+    ruta_siel, ruta_cartera, _ = generar_par(args.salida, args.examenes, args.sitios, args.semilla)
+    print(ruta_siel)
+    print(ruta_cartera)
+
+
+if __name__ == "__main__":
+    main()
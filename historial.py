@@ -0,0 +1,226 @@
+"""Historial local de versiones de la cartera y diferencias entre versiones.
+
+Cada versión procesada (identificada por el hash del archivo de cartera)
+se guarda una sola vez: la matriz codificada en un Parquet (clave de
+Número, Número, nombre y un código int8 por hospital) y sus datos en un
+catálogo SQLite. Comparar una carga nueva con la versión anterior solo
+lee ese Parquet, sin volver a parsear libros antiguos.
+"""
+import json
+import os
+import re
+import sqlite3
+import tempfile
+from contextlib import contextmanager
+from dataclasses import dataclass
+from datetime import date, datetime
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from carga import clave_numero, claves_comparables
+from matriz import MatrizCartera
+
+# -------------------------------------------------------------------
+# Fecha de la versión: la del nombre del archivo si trae una
+# (..._13072025 o ..._20250713), si no la fecha en que se guardó
+# -------------------------------------------------------------------
+def fecha_de_nombre(nombre: str):
+    for texto in re.findall(r"(?<!\d)(\d{8})(?!\d)", nombre or ""):
+        for formato in ("%d%m%Y", "%Y%m%d"):
+            try:
+                return datetime.strptime(texto, formato).date()
+            except ValueError:
+                pass
+    return None
+
+
+# -------------------------------------------------------------------
+# Diferencias entre dos versiones, alineadas por la clave de Número
+# -------------------------------------------------------------------
+@dataclass
+class DeltaVersiones:
+    agregados: pd.DataFrame     # exámenes nuevos
+    eliminados: pd.DataFrame    # exámenes que ya no están
+    cambios: pd.DataFrame       # Número, nombre, hospital, estado anterior y actual
+
+    def hojas(self) -> dict:
+        return {
+            "EXAMENES_AGREGADOS": self.agregados,
+            "EXAMENES_ELIMINADOS": self.eliminados,
+            "CAMBIOS_DE_ESTADO": self.cambios,
+        }
+
+
+def _primera_por_clave(matriz: MatrizCartera):
+    claves = pd.Series(matriz.claves)
+    unicas = ~claves.duplicated().to_numpy()
+    return claves[unicas].reset_index(drop=True), np.flatnonzero(unicas)
+
+
+def comparar_versiones(anterior: MatrizCartera, actual: MatrizCartera) -> DeltaVersiones:
+    claves_ant, filas_ant = _primera_por_clave(anterior)
+    claves_act, filas_act = _primera_por_clave(actual)
+    claves_ant, claves_act = claves_comparables(claves_ant, claves_act)
+
+    en_ant = pd.Index(claves_ant).get_indexer(claves_act)
+    nuevos = en_ant < 0
+    quitados = ~claves_ant.isin(claves_act).to_numpy()
+    columnas = ["Número", "Nombre exámen SIEL"]
+    agregados = actual.base.iloc[filas_act[nuevos]][columnas].reset_index(drop=True)
+    eliminados = anterior.base.iloc[filas_ant[quitados]][columnas].reset_index(drop=True)
+
+    # Códigos de la versión anterior traducidos a la tabla de etiquetas
+    # de la actual (los códigos 0-2 son fijos; los extra pueden variar)
+    etiquetas = list(actual.etiquetas)
+    traduccion = np.empty(len(anterior.etiquetas), dtype=np.int16)
+    for codigo, etiqueta in enumerate(anterior.etiquetas):
+        if etiqueta not in etiquetas:
+            etiquetas.append(etiqueta)
+        traduccion[codigo] = etiquetas.index(etiqueta)
+
+    hospitales = [h for h in actual.hospitales if h in anterior.hospitales]
+    comunes = np.flatnonzero(~nuevos)
+    cod_act = actual.columnas(hospitales)[filas_act[comunes]].astype(np.int16)
+    cod_ant = traduccion[anterior.columnas(hospitales)[filas_ant[en_ant[comunes]]]]
+
+    filas, cols = np.nonzero(cod_act != cod_ant)
+    etiquetas = np.array(etiquetas, dtype=object)
+    base_cambios = actual.base.iloc[filas_act[comunes[filas]]]
+    cambios = pd.DataFrame({
+        "Número": base_cambios["Número"].to_numpy(),
+        "Nombre exámen SIEL": base_cambios["Nombre exámen SIEL"].to_numpy(),
+        "Hospital": np.array(hospitales, dtype=object)[cols],
+        "Estado_anterior": etiquetas[cod_ant[filas, cols]],
+        "Estado_actual": etiquetas[cod_act[filas, cols]],
+    })
+    return DeltaVersiones(agregados, eliminados, cambios)
+
+
+# -------------------------------------------------------------------
+# Almacén: catálogo SQLite + un Parquet por versión
+# -------------------------------------------------------------------
+class Historial:
+    def __init__(self, carpeta):
+        self.carpeta = Path(carpeta)
+        (self.carpeta / "versiones").mkdir(parents=True, exist_ok=True)
+        with self._conectar() as con:
+            con.execute(
+                """
+                CREATE TABLE IF NOT EXISTS versiones (
+                    version TEXT PRIMARY KEY,
+                    nombre TEXT,
+                    fecha TEXT,
+                    guardado TEXT,
+                    n_examenes INTEGER,
+                    hospitales TEXT,
+                    etiquetas TEXT
+                )
+                """
+            )
+
+    @contextmanager
+    def _conectar(self):
+        # Una conexión por operación: confirma al salir y se cierra
+        con = sqlite3.connect(self.carpeta / "historial.sqlite", timeout=30)
+        try:
+            with con:
+                yield con
+        finally:
+            con.close()
+
+    def _ruta(self, version: str) -> Path:
+        return self.carpeta / "versiones" / f"{version}.parquet"
+
+    def versiones(self) -> pd.DataFrame:
+        """Versiones guardadas, de la más antigua a la más reciente."""
+        with self._conectar() as con:
+            return pd.read_sql_query(
+                "SELECT version, nombre, fecha, guardado, n_examenes "
+                "FROM versiones ORDER BY fecha, guardado",
+                con,
+            )
+
+    def contiene(self, version: str) -> bool:
+        with self._conectar() as con:
+            fila = con.execute("SELECT 1 FROM versiones WHERE version = ?", (version,)).fetchone()
+        return fila is not None
+
+    def guardar(self, version: str, nombre: str, matriz: MatrizCartera) -> bool:
+        """Guarda la versión si no estaba; devuelve True si la agregó.
+
+        Varios trabajos pueden guardar la misma versión a la vez (misma
+        cartera con otro SIEL, o lote.py en paralelo): el que llega
+        después la toma como ya guardada.
+        """
+        if self.contiene(version):
+            return False
+
+        claves = pd.Series(matriz.claves).astype(object)
+        datos = pd.DataFrame({
+            "clave": claves.where(claves.isna(), claves.astype(str)),
+            "Número": matriz.base["Número"].astype(str).to_numpy(dtype=object),
+            "Nombre exámen SIEL": matriz.base["Nombre exámen SIEL"].astype(str).to_numpy(dtype=object),
+        })
+        codigos = pd.DataFrame(matriz.codigos, columns=matriz.hospitales)
+        datos = pd.concat([datos, codigos], axis=1)
+
+        # Escritura a un temporal propio (en la misma carpeta) y luego
+        # renombre: nunca queda un Parquet a medias y dos escrituras
+        # simultáneas de la misma versión no se pisan el temporal
+        ruta = self._ruta(version)
+        if not ruta.exists():
+            with tempfile.NamedTemporaryFile(
+                dir=ruta.parent, prefix=f"{version}.", suffix=".tmp", delete=False
+            ) as archivo:
+                temporal = Path(archivo.name)
+            try:
+                datos.to_parquet(temporal, index=False)
+                try:
+                    os.replace(temporal, ruta)
+                except OSError:
+                    # Otro trabajo la dejó mientras tanto (p. ej. en Windows,
+                    # con el archivo abierto): su contenido es el mismo
+                    if not ruta.exists():
+                        raise
+            finally:
+                temporal.unlink(missing_ok=True)
+
+        guardado = datetime.now().isoformat(timespec="seconds")
+        fecha = fecha_de_nombre(nombre) or date.today()
+        with self._conectar() as con:
+            cursor = con.execute(
+                "INSERT OR IGNORE INTO versiones VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (
+                    version, nombre, fecha.isoformat(), guardado, len(matriz.base),
+                    json.dumps(matriz.hospitales), json.dumps(matriz.etiquetas, ensure_ascii=False),
+                ),
+            )
+        return cursor.rowcount == 1
+
+    def cargar(self, version: str) -> MatrizCartera:
+        with self._conectar() as con:
+            fila = con.execute(
+                "SELECT hospitales, etiquetas FROM versiones WHERE version = ?", (version,)
+            ).fetchone()
+        if fila is None:
+            raise KeyError(version)
+        hospitales, etiquetas = json.loads(fila[0]), json.loads(fila[1])
+
+        datos = pd.read_parquet(self._ruta(version))
+        return MatrizCartera(
+            base=datos[["Número", "Nombre exámen SIEL"]],
+            codigos=datos[hospitales].to_numpy(dtype=np.int8),
+            hospitales=hospitales,
+            etiquetas=etiquetas,
+            claves=clave_numero(datos["clave"]),
+        )
+
+    def anterior(self, version: str):
+        """Versión inmediatamente anterior a `version` (o la última, si no está guardada)."""
+        versiones = self.versiones()["version"].tolist()
+        if version in versiones:
+            posicion = versiones.index(version)
+            return versiones[posicion - 1] if posicion > 0 else None
+        return versiones[-1] if versiones else None
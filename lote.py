@@ -0,0 +1,174 @@
+"""Comparación por lotes SIEL vs cartera desde la línea de comandos.
+
+Ejemplos:
+    python lote.py --par SIEL.xlsx CARTERA.xlsx --salida resultados
+    python lote.py --carpeta entradas --salida resultados --procesos 4 --formato parquet
+
+Con --carpeta, cada subcarpeta es un par: el libro con hoja "BD" es la
+cartera y el otro .xlsx es el archivo SIEL. Los resultados de cada par
+quedan en una subcarpeta de --salida con los mismos archivos que ofrece
+la app.
+"""
+import argparse
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+from openpyxl import load_workbook
+
+from exportar import FORMATOS_CLI
+from historial import Historial
+from motor import escribir_salidas, procesar, registrar_en_historial
+from topologia import cargar_topologia
+from rendimiento import Medidor, configurar_log
+
+
+# -------------------------------------------------------------------
+# Descubrir pares (nombre, archivo SIEL, archivo cartera)
+# -------------------------------------------------------------------
+def _tiene_hoja_bd(ruta: Path) -> bool:
+    libro = load_workbook(ruta, read_only=True)
+    try:
+        return "BD" in libro.sheetnames
+    finally:
+        libro.close()
+
+
+def pares_de_carpeta(carpeta: Path) -> list:
+    pares = []
+    for sub in sorted(p for p in carpeta.iterdir() if p.is_dir()):
+        libros = sorted(sub.glob("*.xlsx"))
+        carteras = [r for r in libros if _tiene_hoja_bd(r)]
+        siel = [r for r in libros if r not in carteras]
+        if len(carteras) != 1 or len(siel) != 1:
+            raise ValueError(
+                f"{sub}: se esperaba un archivo SIEL y una cartera (con hoja BD), "
+                f"hay {len(siel)} y {len(carteras)}"
+            )
+        pares.append((sub.name, siel[0], carteras[0]))
+    return pares
+
+
+# -------------------------------------------------------------------
+# Procesar un par y escribir sus salidas
+# -------------------------------------------------------------------
+def procesar_par(
+    nombre: str,
+    ruta_siel: Path,
+    ruta_cartera: Path,
+    salida: Path,
+    formato: str,
+    log_rendimiento: str = None,
+    medir_memoria: bool = False,
+    carpeta_historial: str = None,
+    ruta_topologia: str = None,
+) -> dict:
+    if log_rendimiento:
+        configurar_log(log_rendimiento)
+    medidor = Medidor(
+        {"par": nombre, "siel": ruta_siel.name, "cartera": ruta_cartera.name},
+        memoria=medir_memoria,
+    )
+    inicio = time.perf_counter()
+    topologia = cargar_topologia(ruta_topologia) if ruta_topologia else None
+    resultado = procesar(
+        ruta_siel.read_bytes(), ruta_cartera.read_bytes(), medidor=medidor, topologia=topologia
+    )
+    if carpeta_historial:
+        registrar_en_historial(resultado, Historial(carpeta_historial), ruta_cartera.name, medidor)
+    escribir_salidas(resultado, salida / nombre, formato, medidor)
+    return {
+        "par": nombre,
+        "siel_no_en_cartera": len(resultado.siel_no_en_cartera),
+        "cartera_no_en_siel": len(resultado.cartera_no_en_siel),
+        "examenes_matriz": len(resultado.matriz.base),
+        "cambios": None if resultado.delta is None else len(resultado.delta.cambios),
+        "segundos": round(time.perf_counter() - inicio, 2),
+    }
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--par", nargs=2, action="append", default=[], metavar=("SIEL", "CARTERA"),
+        help="archivo SIEL y archivo de cartera (se puede repetir)",
+    )
+    parser.add_argument("--carpeta", type=Path, help="carpeta con una subcarpeta por par")
+    parser.add_argument("--salida", type=Path, required=True, help="carpeta de resultados")
+    parser.add_argument("--formato", choices=FORMATOS_CLI, default="xlsx")
+    parser.add_argument(
+        "--procesos", type=int, default=1,
+        help="pares procesados en paralelo (1 = en serie)",
+    )
+    parser.add_argument(
+        "--log-rendimiento", metavar="ARCHIVO",
+        help="agrega una línea JSON por etapa (tiempo, filas, memoria) a ARCHIVO",
+    )
+    parser.add_argument(
+        "--medir-memoria", action="store_true",
+        help="mide el pico de memoria de cada etapa (más lento)",
+    )
+    parser.add_argument(
+        "--historial", metavar="CARPETA",
+        help="guarda cada cartera en el historial y escribe los cambios respecto de la versión anterior",
+    )
+    parser.add_argument(
+        "--topologia", metavar="ARCHIVO",
+        help="topología de la red en JSON (por defecto la de SIEL_TOPOLOGIA o SSASUR)",
+    )
+    args = parser.parse_args(argv)
+    if args.topologia:
+        try:
+            cargar_topologia(args.topologia)
+        except ValueError as e:
+            parser.error(str(e))
+
+    pares = [
+        (f"{Path(s).stem}__{Path(c).stem}", Path(s), Path(c))
+        for s, c in args.par
+    ]
+    if args.carpeta is not None:
+        pares += pares_de_carpeta(args.carpeta)
+    if not pares:
+        parser.error("indica al menos un --par o una --carpeta")
+
+    formato = FORMATOS_CLI[args.formato]
+    opciones = (
+        args.salida, formato, args.log_rendimiento, args.medir_memoria, args.historial, args.topologia
+    )
+    errores = 0
+
+    def informar(nombre, obtener):
+        nonlocal errores
+        try:
+            resumen = obtener()
+        except Exception as e:
+            errores += 1
+            print(f"[ERROR] {nombre}: {e}", file=sys.stderr)
+            return
+        print(
+            f"[OK] {resumen['par']}: {resumen['siel_no_en_cartera']} SIEL no en cartera, "
+            f"{resumen['cartera_no_en_siel']} cartera no en SIEL, "
+            f"{resumen['examenes_matriz']} exámenes en matriz"
+            + ("" if resumen["cambios"] is None else f", {resumen['cambios']} cambios de estado")
+            + f" ({resumen['segundos']} s)"
+        )
+
+    if args.procesos > 1:
+        with ProcessPoolExecutor(max_workers=args.procesos) as pool:
+            futuros = [
+                (nombre, pool.submit(procesar_par, nombre, s, c, *opciones))
+                for nombre, s, c in pares
+            ]
+            for nombre, futuro in futuros:
+                informar(nombre, futuro.result)
+    else:
+        for nombre, s, c in pares:
+            informar(nombre, lambda: procesar_par(nombre, s, c, *opciones))
+
+    return 1 if errores else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,348 @@
+"""Matriz hospitalaria: estado de cartera (SI / NO / NO INFORMADO) por examen y hospital."""
+from dataclasses import dataclass
+from functools import cached_property
+
+import numpy as np
+import pandas as pd
+
+from carga import clave_numero, claves_comparables
+
+
+# -------------------------------------------------------------------
+# Tabla fija de códigos de estado. Valores inesperados en la columna
+# Cartera (p. ej. "NO APLICA") reciben códigos 3, 4, ... en orden de
+# aparición, para no perder información.
+# -------------------------------------------------------------------
+NO_INFORMADO, NO, SI = 0, 1, 2
+ESTADOS = ["NO INFORMADO", "NO", "SI"]
+
+
+# -------------------------------------------------------------------
+# Conjuntos de hospitales como bits: una fila de palabras uint64 con un
+# bit por hospital (bit k = columna k de la matriz). Con hasta 64
+# hospitales cada examen es una sola palabra, y "todos / alguno / al
+# menos k de estos hospitales" son operaciones de bits por palabra.
+# -------------------------------------------------------------------
+_BITS_EN_BYTE = np.array([bin(b).count("1") for b in range(256)], dtype=np.uint8)
+
+
+def empaquetar_bits(marcas: np.ndarray) -> np.ndarray:
+    """Booleanos (filas × hospitales) -> uint64 (filas × palabras)."""
+    marcas = np.atleast_2d(marcas)
+    n_bytes = max(-(-marcas.shape[1] // 64), 1) * 8
+    bytes_fila = np.zeros((marcas.shape[0], n_bytes), dtype=np.uint8)
+    empaquetado = np.packbits(marcas, axis=1, bitorder="little")
+    bytes_fila[:, :empaquetado.shape[1]] = empaquetado
+    return bytes_fila.view("<u8")
+
+
+def contar_bits(palabras: np.ndarray) -> np.ndarray:
+    """Bits en 1 por fila de `palabras` (uint64, filas × palabras)."""
+    return _BITS_EN_BYTE[palabras.view(np.uint8)].sum(axis=1, dtype=np.int64)
+
+
+# -------------------------------------------------------------------
+# Matriz codificada: int8 exámenes × hospitales. Las etiquetas de
+# texto solo se generan al mostrar o exportar (cartera_norm/df_matriz,
+# columnas categóricas sobre los mismos códigos).
+# -------------------------------------------------------------------
+@dataclass
+class MatrizCartera:
+    base: pd.DataFrame      # Número + Nombre exámen SIEL
+    codigos: np.ndarray     # int8, una columna por hospital
+    hospitales: list
+    etiquetas: list         # etiqueta de cada código
+    claves: pd.Series       # clave canónica de Número, por examen
+
+    def columnas(self, hospitales: list = None) -> np.ndarray:
+        if hospitales is None:
+            return self.codigos
+        return self.codigos[:, [self.hospitales.index(h) for h in hospitales]]
+
+    def todos(self, estado: int, hospitales: list = None) -> np.ndarray:
+        """Máscara de exámenes con `estado` en todos los hospitales indicados."""
+        return (self.columnas(hospitales) == estado).all(axis=1)
+
+    def alguno(self, estado: int, hospitales: list = None) -> np.ndarray:
+        """Máscara de exámenes con `estado` en al menos uno de los hospitales."""
+        return (self.columnas(hospitales) == estado).any(axis=1)
+
+    def hospitales_con(self, estado: int, filas: np.ndarray = None) -> np.ndarray:
+        """Texto "H1, H2, ..." con los hospitales en `estado`, por examen.
+
+        Cada fila se reduce a un patrón de bits (np.packbits); el texto se
+        arma una sola vez por patrón distinto y se reparte con el inverso
+        de np.unique, en vez de recorrer los hospitales fila por fila.
+        """
+        codigos = self.codigos if filas is None else self.codigos[filas]
+        patrones, inverso = np.unique(
+            np.packbits(codigos == estado, axis=1), axis=0, return_inverse=True
+        )
+        nombres = np.array(self.hospitales, dtype=object)
+        marcas = np.unpackbits(patrones, axis=1, count=len(self.hospitales)).astype(bool)
+        textos = np.array([", ".join(nombres[m]) for m in marcas], dtype=object)
+        return textos[inverso.ravel()]
+
+    def calcular_vistas(self) -> "MatrizCartera":
+        """Calcula de una vez las vistas en caché (cobertura, etiquetas,
+        df_matriz, conteos) y devuelve la misma matriz.
+
+        Antes de guardarla en una caché con límite de memoria, para que
+        su tamaño ya incluya lo que esas vistas ocupan.
+        """
+        self.cobertura, self.df_matriz, self.conteos_por_hospital
+        return self
+
+    @cached_property
+    def cobertura(self) -> np.ndarray:
+        """Hospitales que realizan cada examen (SI), como bits."""
+        return empaquetar_bits(self.codigos == SI)
+
+    def bits_de(self, hospitales: list) -> np.ndarray:
+        """Bits de un conjunto de hospitales (los que no están en la matriz no cuentan)."""
+        return empaquetar_bits(np.isin(np.array(self.hospitales, dtype=object), list(hospitales)))[0]
+
+    @cached_property
+    def cartera_norm(self) -> pd.DataFrame:
+        return pd.DataFrame({
+            h: pd.Categorical.from_codes(self.codigos[:, j], categories=self.etiquetas)
+            for j, h in enumerate(self.hospitales)
+        })
+
+    @cached_property
+    def df_matriz(self) -> pd.DataFrame:
+        return pd.concat([self.base, self.cartera_norm], axis=1)
+
+    @cached_property
+    def conteos_por_hospital(self) -> pd.DataFrame:
+        """Exámenes por hospital y estado (Hospital, Estado, Cantidad).
+
+        Una pasada vectorizada por código sobre la matriz int8, sin
+        pasarla a formato largo; solo las combinaciones presentes.
+        """
+        conteos = np.zeros((len(self.hospitales), len(self.etiquetas)), dtype=np.int64)
+        for codigo in range(len(self.etiquetas)):
+            conteos[:, codigo] = np.count_nonzero(self.codigos == codigo, axis=0)
+        orden = np.argsort(np.array(self.hospitales, dtype=object), kind="stable")
+        filas, estados = np.nonzero(conteos[orden])
+        return pd.DataFrame({
+            "Hospital": np.array(self.hospitales, dtype=object)[orden[filas]],
+            "Estado": pd.Categorical.from_codes(estados, categories=self.etiquetas),
+            "Cantidad": conteos[orden[filas], estados].astype(np.int64),
+        })
+
+
+# -------------------------------------------------------------------
+# Normalizar la columna Cartera de una hoja de hospital
+# -------------------------------------------------------------------
+def _normalizar_cartera(serie: pd.Series) -> pd.Series:
+    return (
+        serie
+        .astype(str)
+        .str.strip()
+        .str.upper()
+        .replace({"NAN": None, "": None})
+    )
+
+
+# -------------------------------------------------------------------
+# Construcción de la matriz en un solo paso: cada hoja se indexa por
+# la clave canónica de Número (quedando la última fila si se repite) y
+# se ubica contra la clave de BD con get_indexer, escribiendo directo en
+# un arreglo de códigos exámenes × hospitales. Evita los merges
+# encadenados, que copiaban la matriz completa una vez por hospital. La
+# normalización de Cartera se aplica solo a los valores distintos de
+# cada hoja. Sin `claves` (de cargar_insumos) se calculan aquí.
+# -------------------------------------------------------------------
+def construir_matriz(
+    df_bd: pd.DataFrame,
+    dfs_hospitales: dict,
+    hospitales: list,
+    claves: dict = None,
+) -> MatrizCartera:
+    if claves is None:
+        claves = {"BD": clave_numero(df_bd["Número"])}
+    claves_h = {}
+    for h in hospitales:
+        df_h = dfs_hospitales[h]
+        if h in claves:
+            claves_h[h] = claves[h]
+        else:
+            # Detectar columna Número (si no, columna A)
+            num_col = "Número" if "Número" in df_h.columns else df_h.columns[0]
+            claves_h[h] = clave_numero(df_h[num_col])
+    clave_bd, *lista_h = claves_comparables(claves["BD"], *(claves_h[h] for h in hospitales))
+    claves_h = dict(zip(hospitales, lista_h))
+
+    # Un examen por clave + nombre
+    repetidos = pd.DataFrame({
+        "clave": clave_bd.to_numpy(),
+        "nombre": df_bd["Nombre exámen SIEL"].to_numpy(),
+    }).duplicated().to_numpy()
+    base = df_bd.loc[~repetidos, ["Número", "Nombre exámen SIEL"]].reset_index(drop=True)
+    claves_base = clave_bd[~repetidos].reset_index(drop=True)
+    numeros = pd.Index(claves_base)
+
+    etiquetas = list(ESTADOS)
+    codigo_de = {e: c for c, e in enumerate(etiquetas)}
+
+    # Sin fila en la hoja del hospital = NO INFORMADO
+    codigos = np.full((len(base), len(hospitales)), NO_INFORMADO, dtype=np.int8)
+    for j, h in enumerate(hospitales):
+        df_h = dfs_hospitales[h]
+
+        # Normalizar Cartera (sobre los valores distintos de la hoja)
+        codigos_h, unicos = pd.factorize(df_h["Cartera"].astype(str))
+        traduccion = np.full(len(unicos) + 1, NO_INFORMADO, dtype=np.int8)
+        for k, valor in enumerate(_normalizar_cartera(pd.Series(unicos, dtype=object))):
+            if isinstance(valor, str):
+                if valor not in codigo_de:
+                    if len(etiquetas) > np.iinfo(np.int8).max:
+                        raise ValueError(f"Demasiados valores distintos en Cartera ({h})")
+                    codigo_de[valor] = len(etiquetas)
+                    etiquetas.append(valor)
+                traduccion[k] = codigo_de[valor]
+        # -1 (nulo en factorize) cae en la última posición: NO INFORMADO
+        cartera_h = pd.Series(traduccion[codigos_h], index=claves_h[h].to_numpy())
+        cartera_h = cartera_h[~cartera_h.index.duplicated(keep="last")]
+
+        posiciones = cartera_h.index.get_indexer(numeros)
+        encontrados = posiciones >= 0
+        codigos[encontrados, j] = cartera_h.to_numpy()[posiciones[encontrados]]
+
+    return MatrizCartera(base, codigos, list(hospitales), etiquetas, claves_base)
+
+
+# -------------------------------------------------------------------
+# Solapamiento de carteras entre hospitales. Con R el indicador
+# exámenes × hospitales de `estado` (SI: el hospital lo realiza), un
+# solo producto RᵀR da los exámenes comunes de cada par, con el total
+# de cada hospital en la diagonal; Jaccard y "solo X" (lo que X realiza
+# y el otro no) salen de esa matriz sin recorrer pares de hospitales.
+# El producto va por bloques de filas en float32 (BLAS, exacto hasta
+# 2**24 por bloque), así la memoria no crece con el número de exámenes.
+# -------------------------------------------------------------------
+FILAS_POR_BLOQUE = 65536
+
+
+def solapamiento_hospitales(matriz: MatrizCartera, estado: int = SI) -> dict:
+    """Tablas hospital × hospital (primera columna "Hospital"):
+
+    - COMUNES: exámenes que ambos realizan (diagonal: total del hospital).
+    - JACCARD: comunes / exámenes que realiza al menos uno.
+    - SOLO_FILA: exámenes que el hospital de la fila realiza y el de la
+      columna no.
+    - EXCLUSIVOS: por hospital, exámenes que solo él realiza en la red.
+    """
+    n_hospitales = len(matriz.hospitales)
+    comunes = np.zeros((n_hospitales, n_hospitales))
+    exclusivos = np.zeros(n_hospitales)
+    for inicio in range(0, len(matriz.codigos), FILAS_POR_BLOQUE):
+        r = (matriz.codigos[inicio:inicio + FILAS_POR_BLOQUE] == estado).astype(np.float32)
+        comunes += r.T @ r
+        exclusivos += r[r.sum(axis=1) == 1].sum(axis=0)
+    comunes = comunes.astype(np.int64)
+    totales = np.diag(comunes)
+
+    union = totales[:, None] + totales[None, :] - comunes
+    with np.errstate(divide="ignore", invalid="ignore"):
+        jaccard = np.where(union > 0, np.round(comunes / union, 3), 0.0)
+
+    def tabla(valores):
+        df = pd.DataFrame(valores, columns=matriz.hospitales)
+        df.insert(0, "Hospital", matriz.hospitales)
+        return df
+
+    return {
+        "COMUNES": tabla(comunes),
+        "JACCARD": tabla(jaccard),
+        "SOLO_FILA": tabla(totales[:, None] - comunes),
+        "EXCLUSIVOS": pd.DataFrame({
+            "Hospital": matriz.hospitales,
+            "Realiza": totales,
+            "Exclusivos": exclusivos.astype(np.int64),
+        }),
+    }
+
+
+# -------------------------------------------------------------------
+# Resumen por grupos de hospitales (Nodo, nivel de complejidad) para
+# todos los exámenes a la vez. Los conteos salen de un producto
+# matricial: indicador de estado (exámenes × hospitales) por la matriz
+# de pertenencia (hospitales × grupos). El resultado queda en formato
+# largo, ordenado por examen, así la tabla de un examen es un corte
+# contiguo de largo igual al número de grupos.
+# -------------------------------------------------------------------
+def agrupar_por_nivel(complejidad: dict) -> dict:
+    grupos = {}
+    for hosp, nivel in complejidad.items():
+        grupos.setdefault(nivel, []).append(hosp)
+    return grupos
+
+
+def resumen_por_grupos(
+    matriz: MatrizCartera,
+    grupos: dict,
+    col_grupo: str,
+    col_total: str,
+    col_estado: str = None,
+) -> pd.DataFrame:
+    grupos = {
+        g: [h for h in lista if h in matriz.hospitales]
+        for g, lista in grupos.items()
+    }
+    grupos = {g: lista for g, lista in grupos.items() if lista}
+    nombres = list(grupos)
+
+    pertenencia = np.zeros((len(matriz.hospitales), len(nombres)), dtype=np.int32)
+    for k, g in enumerate(nombres):
+        for h in grupos[g]:
+            pertenencia[matriz.hospitales.index(h), k] = 1
+
+    def contar(estado):
+        return ((matriz.codigos == estado).astype(np.int32) @ pertenencia).astype(np.int64)
+
+    n_si, n_no, n_no_inf = contar(SI), contar(NO), contar(NO_INFORMADO)
+    total = np.broadcast_to(pertenencia.sum(axis=0).astype(np.int64), n_si.shape)
+
+    # Porcentaje con round() de Python por cada combinación (SI, total),
+    # para coincidir exactamente con el cálculo examen por examen
+    max_total = int(total.max()) if total.size else 0
+    tabla_pct = np.zeros((max_total + 1, max_total + 1))
+    for t in range(1, max_total + 1):
+        for s in range(t + 1):
+            tabla_pct[s, t] = round((s / t) * 100, 1)
+
+    n_examenes, n_grupos = n_si.shape
+    resumen = pd.DataFrame({
+        "Número": np.repeat(matriz.base["Número"].to_numpy(), n_grupos),
+        "Nombre exámen SIEL": np.repeat(matriz.base["Nombre exámen SIEL"].to_numpy(), n_grupos),
+        col_grupo: np.tile(np.array(nombres, dtype=object), n_examenes),
+        col_total: total.ravel(),
+        "Hospitales_SI": n_si.ravel(),
+        "Hospitales_NO": n_no.ravel(),
+        "Hospitales_NO_INFORMADO": n_no_inf.ravel(),
+        "%_hospitales_SI": tabla_pct[n_si, total].ravel(),
+    })
+
+    # Regla de estado del grupo: SI si algún hospital lo realiza; si no,
+    # NO INFORMADO si falta información; en otro caso NO
+    if col_estado is not None:
+        resumen[col_estado] = np.select(
+            [n_si.ravel() >= 1, n_no_inf.ravel() > 0],
+            ["SI", "NO INFORMADO"],
+            default="NO",
+        ).astype(object)
+
+    resumen.attrs["n_grupos"] = n_grupos
+    return resumen
+
+
+def resumen_de_examen(resumen: pd.DataFrame, fila: int) -> pd.DataFrame:
+    """Tabla de un examen (posición `fila` en la matriz), sin recalcular."""
+    n_grupos = resumen.attrs["n_grupos"]
+    return (
+        resumen.iloc[fila * n_grupos:(fila + 1) * n_grupos]
+        .drop(columns=["Número", "Nombre exámen SIEL"])
+        .reset_index(drop=True)
+    )
@@ -0,0 +1,306 @@
+"""Motor de comparación SIEL vs cartera de prestaciones (sin Streamlit).
+
+Reúne los pasos que hace la app (homologación, diferencias por Número,
+revisión de nombres, matriz hospitalaria, exámenes sin prestador / no
+informados, resúmenes por Nodo y complejidad, carteras agregadas,
+solapamiento entre hospitales) para usarlos desde la app, desde
+`lote.py` o desde otros scripts.
+"""
+import os
+from dataclasses import dataclass, field
+from pathlib import Path
+
+import pandas as pd
+
+from carga import (
+    cargar_insumos,
+    clave_numero,
+    claves_comparables,
+    hash_contenido,
+    validar_esquema,
+)
+from exportar import FORMATOS, exportar
+from historial import DeltaVersiones, Historial, comparar_versiones
+from matriz import (
+    NO,
+    NO_INFORMADO,
+    SI,
+    MatrizCartera,
+    agrupar_por_nivel,
+    construir_matriz,
+    resumen_por_grupos,
+    solapamiento_hospitales,
+)
+from nombres import nombres_a_actualizar, posibles_duplicados
+from rendimiento import Medidor
+from topologia import Topologia, cargar_topologia
+
+# Topología de la red (hospitales, Nodos, complejidad, grupos y carteras
+# agregadas), desde topologia_ssasur.json o el archivo de SIEL_TOPOLOGIA
+TOPOLOGIA = cargar_topologia(os.environ.get("SIEL_TOPOLOGIA") or None)
+HOSPITALES = TOPOLOGIA.hospitales
+NODOS = TOPOLOGIA.nodos
+COMPLEJIDAD = TOPOLOGIA.complejidad
+
+COLUMNAS_EXAMEN = ["Número", "Nombre exámen SIEL"]
+
+
+# -------------------------------------------------------------------
+# Exámenes en SIEL y no en cartera (BD), y viceversa
+# -------------------------------------------------------------------
+def comparar_numeros(df_siel: pd.DataFrame, df_bd: pd.DataFrame, claves: dict = None):
+    # Comparación por la clave canónica de Número (ver carga.clave_numero)
+    if claves is None:
+        claves = {"SIEL": clave_numero(df_siel["Número"]), "BD": clave_numero(df_bd["Número"])}
+    siel_num, bd_num = claves_comparables(claves["SIEL"], claves["BD"])
+
+    examenes_siel_no_en_cartera = df_siel[~siel_num.isin(bd_num).to_numpy()].copy()
+    examenes_cartera_no_en_siel = df_bd[~bd_num.isin(siel_num).to_numpy()].copy()
+    return examenes_siel_no_en_cartera, examenes_cartera_no_en_siel
+
+
+# -------------------------------------------------------------------
+# Nombres a actualizar (mismo Número, distinto nombre en SIEL y BD) y
+# posibles duplicados (distinto Número, nombre casi igual); ver nombres.py
+# -------------------------------------------------------------------
+def calcular_nombres(df_siel: pd.DataFrame, df_bd: pd.DataFrame, claves: dict = None):
+    return (
+        nombres_a_actualizar(df_siel, df_bd, claves),
+        posibles_duplicados(df_siel, df_bd, claves),
+    )
+
+
+# -------------------------------------------------------------------
+# Exámenes que ningún hospital realiza (todos NO)
+# -------------------------------------------------------------------
+def calcular_nadie_realiza(matriz: MatrizCartera) -> pd.DataFrame:
+    return matriz.base.loc[matriz.todos(NO), COLUMNAS_EXAMEN]
+
+
+# -------------------------------------------------------------------
+# Exámenes no informados (algún hospital NO INFORMADO)
+# -------------------------------------------------------------------
+def calcular_no_informados(matriz: MatrizCartera) -> pd.DataFrame:
+    mask_no_inf = matriz.alguno(NO_INFORMADO)
+    df_no_informado = matriz.base.loc[mask_no_inf, COLUMNAS_EXAMEN].copy()
+    df_no_informado["Hospitales_no_informaron"] = matriz.hospitales_con(
+        NO_INFORMADO, mask_no_inf
+    )
+    return df_no_informado
+
+
+# -------------------------------------------------------------------
+# Resumen por Nodo y por nivel de complejidad de todos los exámenes
+# -------------------------------------------------------------------
+def calcular_resumenes_grupos(matriz: MatrizCartera, topologia: Topologia = TOPOLOGIA):
+    df_nodos_todos = resumen_por_grupos(
+        matriz, topologia.nodos, "Nodo", "Total_hospitales_nodo", "Estado_nodo"
+    )
+    df_complejidad_todos = resumen_por_grupos(
+        matriz, agrupar_por_nivel(topologia.complejidad), "Complejidad", "Total_hospitales"
+    )
+    return df_nodos_todos, df_complejidad_todos
+
+
+# -------------------------------------------------------------------
+# Carteras agregadas de la topología (básica, nodos, alta y baja
+# complejidad en SSASUR): cada una es una consulta de bits sobre los
+# hospitales que realizan cada examen (ver topologia.py)
+# -------------------------------------------------------------------
+def calcular_carteras_agregadas(matriz: MatrizCartera, topologia: Topologia = TOPOLOGIA) -> dict:
+    return {
+        nombre: cartera_de_consulta(matriz, topologia, cartera["consulta"])
+        for nombre, cartera in topologia.carteras.items()
+    }
+
+
+def cartera_de_consulta(matriz: MatrizCartera, topologia: Topologia, consulta: dict) -> pd.DataFrame:
+    """Exámenes (Número, nombre) que cumplen `consulta`; ValueError si no es válida."""
+    mascara = topologia.mascara(matriz, consulta)
+    return matriz.base.loc[mascara, COLUMNAS_EXAMEN].drop_duplicates()
+
+
+# -------------------------------------------------------------------
+# Solapamiento de carteras entre hospitales (comunes, Jaccard, solo uno)
+# -------------------------------------------------------------------
+def calcular_solapamiento(matriz: MatrizCartera) -> dict:
+    return solapamiento_hospitales(matriz, SI)
+
+
+# -------------------------------------------------------------------
+# Resultado completo de una comparación y sus archivos de salida
+# -------------------------------------------------------------------
+SALIDAS = [
+    "examenes_siel_no_en_cartera",
+    "examenes_cartera_no_en_siel",
+    "ANALISIS_HOSPITALES_SSASUR",
+    "RESUMEN_NODOS_COMPLEJIDAD_SSASUR",
+    "CARTERAS_AGREGADAS_SSASUR",
+    "SOLAPAMIENTO_HOSPITALES_SSASUR",
+]
+
+
+@dataclass
+class Resultado:
+    clave: str                                  # hash SIEL:hash cartera
+    siel_no_en_cartera: pd.DataFrame = None
+    cartera_no_en_siel: pd.DataFrame = None
+    nombres_a_actualizar: pd.DataFrame = None
+    posibles_duplicados: pd.DataFrame = None
+    matriz: MatrizCartera = None
+    nadie_realiza: pd.DataFrame = None
+    no_informado: pd.DataFrame = None
+    nodos: pd.DataFrame = None
+    complejidad: pd.DataFrame = None
+    carteras: dict = field(default_factory=dict)
+    solapamiento: dict = field(default_factory=dict)
+    delta: DeltaVersiones = None                # cambios respecto de la versión anterior
+    version_anterior: str = None                # versión comparada en `delta`
+
+    def clave_de(self, salida: str) -> str:
+        """Clave de caché de un archivo de salida."""
+        if salida == "CAMBIOS_ENTRE_VERSIONES":
+            return f"{self.clave}:{self.version_anterior}"
+        return self.clave
+
+    def hojas(self, salida: str) -> dict:
+        """Hojas (nombre -> DataFrame) de uno de los archivos de SALIDAS."""
+        if salida == "examenes_siel_no_en_cartera":
+            hojas = {"SIEL_no_en_cartera": self.siel_no_en_cartera}
+            # Revisión de nombres, si se calculó
+            if self.nombres_a_actualizar is not None:
+                hojas["NOMBRES_A_ACTUALIZAR"] = self.nombres_a_actualizar
+            if self.posibles_duplicados is not None:
+                hojas["POSIBLES_DUPLICADOS"] = self.posibles_duplicados
+            return hojas
+        if salida == "examenes_cartera_no_en_siel":
+            return {"cartera_no_en_SIEL": self.cartera_no_en_siel}
+        if salida == "ANALISIS_HOSPITALES_SSASUR":
+            return {
+                "NINGUN_HOSPITAL_REALIZA": self.nadie_realiza,
+                "NO_INFORMADO": self.no_informado,
+                "MATRIZ_COMPLETA": self.matriz.df_matriz,
+            }
+        if salida == "RESUMEN_NODOS_COMPLEJIDAD_SSASUR":
+            return {
+                "RESUMEN_NODOS": self.nodos,
+                "RESUMEN_COMPLEJIDAD": self.complejidad,
+            }
+        if salida == "CARTERAS_AGREGADAS_SSASUR":
+            return dict(self.carteras)
+        if salida == "SOLAPAMIENTO_HOSPITALES_SSASUR":
+            return dict(self.solapamiento)
+        if salida == "CAMBIOS_ENTRE_VERSIONES":
+            return self.delta.hojas()
+        raise KeyError(salida)
+
+
+def procesar(
+    datos_siel: bytes,
+    datos_cartera: bytes,
+    n_procesos: int = 1,
+    medidor: Medidor = None,
+    topologia: Topologia = None,
+) -> Resultado:
+    """Ejecuta la comparación completa sobre el contenido de dos archivos.
+
+    Antes de leer los datos valida hojas y encabezados; si hay problemas
+    levanta ValueError con todos ellos. Cada paso queda medido en
+    `medidor` (si no se entrega, se usa uno nuevo). Sin `topologia` se
+    usa la configurada (TOPOLOGIA).
+    """
+    medidor = medidor if medidor is not None else Medidor()
+    topologia = topologia if topologia is not None else TOPOLOGIA
+    hospitales = topologia.hospitales
+
+    with medidor.etapa("validacion"):
+        problemas = validar_esquema(datos_siel, datos_cartera, hospitales)
+    if problemas:
+        raise ValueError("; ".join(problemas))
+
+    resultado = Resultado(clave=f"{hash_contenido(datos_siel)}:{hash_contenido(datos_cartera)}")
+
+    with medidor.etapa("lectura") as registro:
+        df_siel, df_bd, dfs_hospitales, claves = cargar_insumos(
+            datos_siel, datos_cartera, hospitales, n_procesos
+        )
+        registro["filas"] = len(df_bd)
+
+    with medidor.etapa("comparacion_numeros") as registro:
+        resultado.siel_no_en_cartera, resultado.cartera_no_en_siel = comparar_numeros(
+            df_siel, df_bd, claves
+        )
+        registro["filas"] = len(df_siel) + len(df_bd)
+
+    with medidor.etapa("nombres") as registro:
+        resultado.nombres_a_actualizar, resultado.posibles_duplicados = calcular_nombres(
+            df_siel, df_bd, claves
+        )
+        registro["filas"] = len(df_siel) + len(df_bd)
+
+    with medidor.etapa("matriz") as registro:
+        resultado.matriz = construir_matriz(df_bd, dfs_hospitales, hospitales, claves)
+        registro["filas"] = len(resultado.matriz.base)
+
+    with medidor.etapa("nadie_realiza_no_informados") as registro:
+        resultado.nadie_realiza = calcular_nadie_realiza(resultado.matriz)
+        resultado.no_informado = calcular_no_informados(resultado.matriz)
+        registro["filas"] = len(resultado.no_informado)
+
+    with medidor.etapa("resumen_nodos_complejidad") as registro:
+        resultado.nodos, resultado.complejidad = calcular_resumenes_grupos(resultado.matriz, topologia)
+        registro["filas"] = len(resultado.nodos) + len(resultado.complejidad)
+
+    with medidor.etapa("carteras_agregadas") as registro:
+        resultado.carteras = calcular_carteras_agregadas(resultado.matriz, topologia)
+        registro["filas"] = sum(len(df) for df in resultado.carteras.values())
+
+    with medidor.etapa("solapamiento_hospitales") as registro:
+        resultado.solapamiento = calcular_solapamiento(resultado.matriz)
+        registro["filas"] = len(resultado.matriz.base)
+    return resultado
+
+
+def registrar_en_historial(
+    resultado: Resultado,
+    historial: Historial,
+    nombre_cartera: str,
+    medidor: Medidor = None,
+) -> str:
+    """Guarda la matriz en el historial y deja en resultado.delta los
+    cambios respecto de la versión anterior (None si es la primera).
+    Devuelve la versión anterior comparada."""
+    medidor = medidor if medidor is not None else Medidor()
+    version = resultado.clave.split(":")[1]     # hash de la cartera
+    with medidor.etapa("historial") as registro:
+        historial.guardar(version, nombre_cartera, resultado.matriz)
+        anterior = historial.anterior(version)
+        if anterior is not None:
+            resultado.version_anterior = anterior
+            resultado.delta = comparar_versiones(historial.cargar(anterior), resultado.matriz)
+            registro["filas"] = len(resultado.delta.cambios)
+    return anterior
+
+
+def escribir_salidas(
+    resultado: Resultado,
+    carpeta,
+    formato: str = "Excel (.xlsx)",
+    medidor: Medidor = None,
+) -> list:
+    """Escribe los archivos de SALIDAS (y los cambios entre versiones, si
+    hay) en `carpeta` y devuelve sus rutas."""
+    medidor = medidor if medidor is not None else Medidor()
+    carpeta = Path(carpeta)
+    carpeta.mkdir(parents=True, exist_ok=True)
+    _, extension, _ = FORMATOS[formato]
+
+    salidas = SALIDAS + (["CAMBIOS_ENTRE_VERSIONES"] if resultado.delta is not None else [])
+    rutas = []
+    for salida in salidas:
+        ruta = carpeta / f"{salida}{extension}"
+        hojas = resultado.hojas(salida)
+        with medidor.etapa(f"exportar {salida}", filas=sum(len(df) for df in hojas.values())):
+            ruta.write_bytes(exportar(hojas, formato))
+        rutas.append(ruta)
+    return rutas
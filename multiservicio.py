@@ -0,0 +1,398 @@
+"""SIEL contra las carteras de varios servicios de salud en una corrida,
+con una matriz consolidada entre servicios.
+
+Cada servicio tiene su topología (topologia_<servicio>.json, cuyos
+hospitales son las hojas de su cartera). Las matrices de los servicios
+se construyen en paralelo, un proceso por servicio y a lo más
+`n_procesos` a la vez; de cada uno vuelve solo una parte compacta
+(clave de Número, nombre y códigos int8 por hospital) y las hojas leídas
+se descartan en el proceso que las leyó. Las partes se incorporan una a
+una a un almacén combinado y se unen al final por la clave canónica de
+Número (carga.clave_numero).
+
+Ejemplos:
+    python multiservicio.py --siel SIEL.xlsx \\
+        --servicio topologia_ssasur.json CARTERA_SSASUR.xlsx \\
+        --servicio topologia_otro.json CARTERA_OTRO.xlsx \\
+        --salida consolidado --procesos 2
+    python multiservicio.py --siel SIEL.xlsx --cartera CARTERA_1.xlsx \\
+        --cartera CARTERA_2.xlsx --topologias carpeta_topologias --salida consolidado
+"""
+import argparse
+import itertools
+import multiprocessing
+import sys
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from dataclasses import dataclass, field
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from carga import (
+    clave_numero,
+    claves_comparables,
+    encabezados_xlsx,
+    homologar_bd,
+    leer_cartera,
+    leer_siel,
+    validar_esquema,
+)
+from exportar import FORMATOS, FORMATOS_CLI, exportar
+from matriz import ESTADOS, NO_INFORMADO, SI, MatrizCartera, construir_matriz
+from rendimiento import Medidor, configurar_log
+from topologia import Topologia, cargar_topologia, topologias_disponibles
+
+# Separador entre servicio y hospital en las columnas de la matriz consolidada
+SEPARADOR = "/"
+
+
+@dataclass
+class Servicio:
+    topologia: Topologia
+    cartera: object         # contenido del libro (bytes) o ruta (se lee en el proceso)
+
+    @property
+    def nombre(self) -> str:
+        return self.topologia.servicio
+
+    def datos(self) -> bytes:
+        if isinstance(self.cartera, (str, Path)):
+            return Path(self.cartera).read_bytes()
+        return self.cartera
+
+
+# -------------------------------------------------------------------
+# Topología de un libro: la del servicio cuyos hospitales están todos
+# entre las hojas (solo se leen los nombres de hojas). Si calzan varias,
+# la de más hospitales.
+# -------------------------------------------------------------------
+def detectar_topologia(datos_cartera: bytes, topologias: list) -> Topologia:
+    hojas, _ = encabezados_xlsx(datos_cartera, [])
+    candidatas = [t for t in topologias if set(t.hospitales) <= set(hojas)]
+    if not candidatas:
+        raise ValueError(
+            "Ninguna topología calza con las hojas del libro "
+            f"(disponibles: {', '.join(t.servicio for t in topologias) or 'ninguna'})"
+        )
+    return max(candidatas, key=lambda t: len(t.hospitales))
+
+
+# -------------------------------------------------------------------
+# Parte compacta de un servicio: una fila por Número (la primera si un
+# Número aparece con dos nombres en BD), con sus códigos int8 por hospital
+# -------------------------------------------------------------------
+@dataclass
+class ParteServicio:
+    base: pd.DataFrame      # Número + Nombre exámen SIEL
+    claves: pd.Series       # clave canónica de Número
+    codigos: np.ndarray     # int8, una columna por hospital del servicio
+    etiquetas: list
+
+
+def parte_de_servicio(servicio: Servicio) -> ParteServicio:
+    """Lee la cartera de un servicio y deja solo su matriz compacta."""
+    hospitales = servicio.topologia.hospitales
+    df_bd, dfs_hospitales = leer_cartera(servicio.datos(), hospitales)
+    df_bd = homologar_bd(df_bd)
+    matriz = construir_matriz(df_bd, dfs_hospitales, hospitales)
+    primeras = ~matriz.claves.duplicated().to_numpy()
+    return ParteServicio(
+        base=matriz.base[primeras].reset_index(drop=True),
+        claves=matriz.claves[primeras].reset_index(drop=True),
+        codigos=matriz.codigos[primeras],
+        etiquetas=matriz.etiquetas,
+    )
+
+
+def _partes_en_paralelo(servicios: list, n_procesos: int):
+    """(índice, ParteServicio) de cada servicio, a medida que terminan.
+
+    Con varios procesos hay a lo más `n_procesos` servicios en curso: el
+    siguiente se lanza recién cuando se entrega uno, así las partes no
+    se acumulan si la unión va más lenta que la lectura.
+    """
+    if n_procesos <= 1:
+        for indice, servicio in enumerate(servicios):
+            yield indice, parte_de_servicio(servicio)
+        return
+
+    # "spawn" evita heredar los hilos del servidor de Streamlit
+    with ProcessPoolExecutor(
+        max_workers=n_procesos, mp_context=multiprocessing.get_context("spawn")
+    ) as pool:
+        siguientes = iter(enumerate(servicios))
+        pendientes = {}
+
+        def lanzar():
+            for indice, servicio in itertools.islice(siguientes, n_procesos - len(pendientes)):
+                pendientes[pool.submit(parte_de_servicio, servicio)] = indice
+
+        lanzar()
+        while pendientes:
+            listos, _ = wait(pendientes, return_when=FIRST_COMPLETED)
+            for futuro in listos:
+                yield pendientes.pop(futuro), futuro.result()
+            lanzar()
+
+
+# -------------------------------------------------------------------
+# Almacén combinado: guarda la parte compacta de cada servicio con sus
+# códigos ya traducidos a una tabla de etiquetas común. La unión por
+# clave se arma al final en el orden de los servicios (no en el de
+# llegada), así el resultado no depende de qué proceso terminó antes.
+# -------------------------------------------------------------------
+class AlmacenServicios:
+    def __init__(self, servicios: list):
+        self.nombres = [s.nombre for s in servicios]
+        self.hospitales = [list(s.topologia.hospitales) for s in servicios]
+        self.partes = [None] * len(servicios)
+        self.etiquetas = list(ESTADOS)
+        self._codigo_de = {e: c for c, e in enumerate(self.etiquetas)}
+
+    def agregar(self, indice: int, parte: ParteServicio):
+        traduccion = np.empty(len(parte.etiquetas), dtype=np.int8)
+        for codigo, etiqueta in enumerate(parte.etiquetas):
+            if etiqueta not in self._codigo_de:
+                if len(self.etiquetas) > np.iinfo(np.int8).max:
+                    raise ValueError("Demasiados valores distintos en Cartera entre servicios")
+                self._codigo_de[etiqueta] = len(self.etiquetas)
+                self.etiquetas.append(etiqueta)
+            traduccion[codigo] = self._codigo_de[etiqueta]
+        parte.codigos = traduccion[parte.codigos]
+        self.partes[indice] = parte
+
+    def consolidar(self):
+        """(MatrizCartera consolidada, presencia exámenes × servicios).
+
+        Las columnas son "SERVICIO/HOSPITAL". Un examen que no está en la
+        BD de un servicio queda NO INFORMADO en todos sus hospitales; la
+        presencia indica en qué carteras está. Nombre y Número son los
+        del primer servicio que tiene el examen.
+        """
+        claves = claves_comparables(*(p.claves for p in self.partes))
+        todas = pd.concat(claves, ignore_index=True)
+        primeras = ~todas.duplicated().to_numpy()
+        union = pd.Index(todas[primeras])
+        base = pd.concat([p.base for p in self.partes], ignore_index=True)
+        base = base[primeras].reset_index(drop=True)
+
+        anchos = [len(h) for h in self.hospitales]
+        codigos = np.full((len(union), sum(anchos)), NO_INFORMADO, dtype=np.int8)
+        presencia = np.zeros((len(union), len(self.partes)), dtype=bool)
+        inicio = 0
+        for s, (parte, clave) in enumerate(zip(self.partes, claves)):
+            filas = union.get_indexer(clave)
+            codigos[filas, inicio:inicio + anchos[s]] = parte.codigos
+            presencia[filas, s] = True
+            inicio += anchos[s]
+
+        hospitales = [
+            f"{servicio}{SEPARADOR}{h}"
+            for servicio, lista in zip(self.nombres, self.hospitales)
+            for h in lista
+        ]
+        matriz = MatrizCartera(
+            base=base,
+            codigos=codigos,
+            hospitales=hospitales,
+            etiquetas=list(self.etiquetas),
+            claves=pd.Series(union),
+        )
+        return matriz, presencia
+
+
+# -------------------------------------------------------------------
+# Resultado consolidado
+# -------------------------------------------------------------------
+@dataclass
+class ResultadoServicios:
+    matriz: MatrizCartera = None
+    servicios: list = field(default_factory=list)
+    presencia: np.ndarray = None            # exámenes × servicios
+    resumen: pd.DataFrame = None            # una fila por servicio
+    siel_no_en_servicios: pd.DataFrame = None
+
+    def servicios_con_examen(self) -> np.ndarray:
+        """Texto "S1, S2" con los servicios cuya cartera incluye cada examen."""
+        pesos = 1 << np.arange(len(self.servicios), dtype=np.int64)
+        patrones, unicos = pd.factorize(self.presencia.astype(np.int64) @ pesos)
+        nombres = np.array(self.servicios, dtype=object)
+        textos = np.array(
+            [", ".join(nombres[(p & pesos) != 0]) for p in unicos], dtype=object
+        )
+        return textos[patrones]
+
+    def conteos_por_hospital(self) -> pd.DataFrame:
+        conteos = self.matriz.conteos_por_hospital
+        partes = conteos["Hospital"].str.split(SEPARADOR, n=1, expand=True)
+        partes.columns = ["Servicio", "Hospital"]
+        return pd.concat([partes, conteos[["Estado", "Cantidad"]]], axis=1)
+
+    def hojas(self) -> dict:
+        matriz = self.matriz
+        df_matriz = pd.concat(
+            [
+                matriz.base,
+                pd.DataFrame({"Servicios": self.servicios_con_examen()}),
+                matriz.cartera_norm,
+            ],
+            axis=1,
+        )
+        return {
+            "MATRIZ_MULTISERVICIO": df_matriz,
+            "RESUMEN_SERVICIOS": self.resumen,
+            "CONTEOS_POR_HOSPITAL": self.conteos_por_hospital(),
+            "SIEL_NO_EN_NINGUN_SERVICIO": self.siel_no_en_servicios,
+        }
+
+
+def _resumen_servicio(nombre: str, hospitales: list, parte: ParteServicio, clave_siel: pd.Series) -> dict:
+    clave_siel, clave_bd = claves_comparables(clave_siel, parte.claves)
+    return {
+        "Servicio": nombre,
+        "Hospitales": len(hospitales),
+        "Exámenes en cartera": len(parte.claves),
+        "SIEL no en cartera": int((~clave_siel.isin(clave_bd)).sum()),
+        "Cartera no en SIEL": int((~clave_bd.isin(clave_siel)).sum()),
+        "Realizados en algún hospital": int((parte.codigos == SI).any(axis=1).sum()),
+    }
+
+
+def procesar_servicios(
+    datos_siel: bytes,
+    servicios: list,
+    n_procesos: int = 1,
+    medidor: Medidor = None,
+) -> ResultadoServicios:
+    """Compara SIEL con la cartera de cada servicio y consolida sus matrices.
+
+    Antes de leer los datos valida hojas y encabezados de todos los
+    libros; si hay problemas levanta ValueError con todos ellos.
+    """
+    medidor = medidor if medidor is not None else Medidor()
+    nombres = [s.nombre for s in servicios]
+    if not servicios:
+        raise ValueError("Indica al menos un servicio")
+    repetidos = sorted({n for n in nombres if nombres.count(n) > 1})
+    if repetidos:
+        raise ValueError(f"Servicios repetidos: {', '.join(repetidos)}")
+
+    with medidor.etapa("validacion"):
+        problemas = [
+            f"{s.nombre}: {problema}"
+            for s in servicios
+            for problema in validar_esquema(datos_siel, s.datos(), s.topologia.hospitales)
+        ]
+    if problemas:
+        raise ValueError("; ".join(problemas))
+
+    with medidor.etapa("lectura_siel") as registro:
+        df_siel = leer_siel(datos_siel)
+        clave_siel = clave_numero(df_siel["Número"])
+        registro["filas"] = len(df_siel)
+
+    almacen = AlmacenServicios(servicios)
+    filas_resumen = [None] * len(servicios)
+    with medidor.etapa("matrices_servicios") as registro:
+        for indice, parte in _partes_en_paralelo(servicios, n_procesos):
+            filas_resumen[indice] = _resumen_servicio(
+                nombres[indice], almacen.hospitales[indice], parte, clave_siel
+            )
+            almacen.agregar(indice, parte)
+        registro["filas"] = sum(f["Exámenes en cartera"] for f in filas_resumen)
+
+    resultado = ResultadoServicios(servicios=nombres, resumen=pd.DataFrame(filas_resumen))
+    with medidor.etapa("consolidacion") as registro:
+        resultado.matriz, resultado.presencia = almacen.consolidar()
+        registro["filas"] = len(resultado.matriz.base)
+
+    with medidor.etapa("siel_no_en_servicios") as registro:
+        clave_siel, clave_union = claves_comparables(clave_siel, resultado.matriz.claves)
+        resultado.siel_no_en_servicios = df_siel[~clave_siel.isin(clave_union).to_numpy()].copy()
+        registro["filas"] = len(df_siel)
+    return resultado
+
+
+def escribir_consolidado(
+    resultado: ResultadoServicios,
+    carpeta,
+    formato: str = "Excel (.xlsx)",
+    medidor: Medidor = None,
+) -> Path:
+    """Escribe CONSOLIDADO_SERVICIOS en `carpeta` y devuelve su ruta."""
+    medidor = medidor if medidor is not None else Medidor()
+    carpeta = Path(carpeta)
+    carpeta.mkdir(parents=True, exist_ok=True)
+    _, extension, _ = FORMATOS[formato]
+    ruta = carpeta / f"CONSOLIDADO_SERVICIOS{extension}"
+    hojas = resultado.hojas()
+    with medidor.etapa("exportar CONSOLIDADO_SERVICIOS", filas=sum(len(df) for df in hojas.values())):
+        ruta.write_bytes(exportar(hojas, formato))
+    return ruta
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--siel", type=Path, required=True, help="archivo SIEL")
+    parser.add_argument(
+        "--servicio", nargs=2, action="append", default=[], metavar=("TOPOLOGIA", "CARTERA"),
+        help="topología (JSON) y cartera de un servicio (se puede repetir)",
+    )
+    parser.add_argument(
+        "--cartera", type=Path, action="append", default=[],
+        help="cartera de un servicio; su topología se elige por las hojas del libro (se puede repetir)",
+    )
+    parser.add_argument(
+        "--topologias", metavar="CARPETA",
+        help="carpeta con los topologia_*.json para --cartera (por defecto la del programa)",
+    )
+    parser.add_argument("--salida", type=Path, required=True, help="carpeta de resultados")
+    parser.add_argument("--formato", choices=FORMATOS_CLI, default="xlsx")
+    parser.add_argument(
+        "--procesos", type=int, default=1,
+        help="servicios leídos en paralelo (1 = en serie)",
+    )
+    parser.add_argument(
+        "--log-rendimiento", metavar="ARCHIVO",
+        help="agrega una línea JSON por etapa (tiempo, filas, memoria) a ARCHIVO",
+    )
+    args = parser.parse_args(argv)
+    if not args.servicio and not args.cartera:
+        parser.error("indica al menos un --servicio o una --cartera")
+
+    try:
+        servicios = [Servicio(cargar_topologia(t), Path(c)) for t, c in args.servicio]
+        if args.cartera:
+            disponibles = topologias_disponibles(args.topologias)
+            for ruta in args.cartera:
+                servicios.append(Servicio(detectar_topologia(ruta.read_bytes(), disponibles), ruta))
+    except (OSError, ValueError) as e:
+        parser.error(str(e))
+
+    if args.log_rendimiento:
+        configurar_log(args.log_rendimiento)
+    medidor = Medidor({"siel": args.siel.name, "servicios": [s.nombre for s in servicios]})
+    try:
+        resultado = procesar_servicios(args.siel.read_bytes(), servicios, args.procesos, medidor)
+        ruta = escribir_consolidado(resultado, args.salida, FORMATOS_CLI[args.formato], medidor)
+    except Exception as e:
+        print(f"[ERROR] {e}", file=sys.stderr)
+        return 1
+
+    for fila in resultado.resumen.to_dict("records"):
+        print(
+            f"[OK] {fila['Servicio']}: {fila['Exámenes en cartera']} exámenes, "
+            f"{fila['SIEL no en cartera']} SIEL no en cartera, "
+            f"{fila['Cartera no en SIEL']} cartera no en SIEL"
+        )
+    print(
+        f"{len(resultado.matriz.base)} exámenes y {len(resultado.matriz.hospitales)} hospitales "
+        f"en la matriz consolidada, {len(resultado.siel_no_en_servicios)} SIEL en ningún servicio "
+        f"({medidor.total_segundos()} s) -> {ruta}"
+    )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,300 @@
+"""Nombres de exámenes: nombres a actualizar y posibles duplicados.
+
+- NOMBRES A ACTUALIZAR: mismo Número en SIEL y en la cartera (BD) con
+  distinto "Nombre exámen SIEL".
+- POSIBLES DUPLICADOS: exámenes con distinto Número y nombre casi igual
+  (el mismo examen cargado dos veces), en SIEL y BD juntos.
+
+Los nombres se comparan sin tildes ni mayúsculas (busqueda.normalizar_texto)
+como conjuntos de trigramas de caracteres, con similitud de Jaccard. Para
+no comparar todos contra todos, un índice invertido de trigramas arma los
+pares candidatos: cada nombre se indexa solo por sus trigramas más raros
+(filtro de prefijo, que no pierde ningún par sobre el umbral) y los
+candidatos se verifican en tandas, así que los bloques grandes tampoco
+se descartan: el resultado es el mismo que comparar todos los pares.
+"""
+
+import numpy as np
+import pandas as pd
+
+from busqueda import normalizar_texto
+from carga import clave_numero, claves_comparables
+from matriz import contar_bits
+
+UMBRAL_DUPLICADOS = 0.8
+ORIGENES = np.array(["SIEL", "cartera", "SIEL y cartera"], dtype=object)
+
+
+def trigramas(texto: str) -> set:
+    texto = f" {texto} "
+    return {texto[i:i + 3] for i in range(len(texto) - 2)}
+
+
+def _nombres(df: pd.DataFrame) -> np.ndarray:
+    """Nombres sin espacios extremos; los vacíos (NaN) quedan como "".
+
+    Se rellenan antes de pasar a texto para que no aparezcan como "nan".
+    """
+    return df["Nombre exámen SIEL"].fillna("").astype(str).str.strip().to_numpy()
+
+
+def similitud(a: set, b: set) -> float:
+    if not a and not b:
+        return 1.0
+    comunes = len(a & b)
+    return comunes / (len(a) + len(b) - comunes)
+
+
+# -------------------------------------------------------------------
+# Mismo Número, distinto nombre (SIEL vs cartera)
+# -------------------------------------------------------------------
+def nombres_a_actualizar(df_siel: pd.DataFrame, df_bd: pd.DataFrame, claves: dict = None) -> pd.DataFrame:
+    """Pares (Número, nombre en SIEL, nombre en cartera) con nombres distintos.
+
+    Primero las diferencias mayores (menor similitud). "Diferencia" indica
+    si solo cambian mayúsculas, tildes o espacios.
+    """
+    if claves is None:
+        claves = {"SIEL": clave_numero(df_siel["Número"]), "BD": clave_numero(df_bd["Número"])}
+    clave_siel, clave_bd = claves_comparables(claves["SIEL"], claves["BD"])
+
+    siel = pd.DataFrame({
+        "clave": clave_siel.to_numpy(),
+        "Número": df_siel["Número"].to_numpy(),
+        "Nombre_SIEL": _nombres(df_siel),
+    }).dropna(subset=["clave"]).drop_duplicates(["clave", "Nombre_SIEL"])
+    bd = pd.DataFrame({
+        "clave": clave_bd.to_numpy(),
+        "Nombre_cartera": _nombres(df_bd),
+    }).dropna(subset=["clave"]).drop_duplicates()
+
+    pares = siel.merge(bd, on="clave")
+    pares = pares[pares["Nombre_SIEL"] != pares["Nombre_cartera"]]
+
+    normal_siel = pares["Nombre_SIEL"].map(normalizar_texto)
+    normal_bd = pares["Nombre_cartera"].map(normalizar_texto)
+    similitudes = [
+        similitud(trigramas(a), trigramas(b)) for a, b in zip(normal_siel, normal_bd)
+    ]
+    resultado = pd.DataFrame({
+        "Número": pares["Número"].to_numpy(),
+        "Nombre_SIEL": pares["Nombre_SIEL"].to_numpy(),
+        "Nombre_cartera": pares["Nombre_cartera"].to_numpy(),
+        "Similitud": np.round(similitudes, 3),
+        "Diferencia": np.where(
+            (normal_siel == normal_bd).to_numpy(), "mayúsculas/tildes/espacios", "nombre distinto"
+        ),
+    })
+    return resultado.sort_values("Similitud", kind="stable").reset_index(drop=True)
+
+
+# -------------------------------------------------------------------
+# Distinto Número, nombre casi igual: índice invertido de trigramas con
+# filtro de prefijo. Con los trigramas de cada nombre ordenados del más
+# raro al más común, dos nombres con Jaccard >= umbral comparten al
+# menos un trigrama entre el prefijo de búsqueda del mayor
+# (len - ceil(umbral * len) + 1 trigramas) y el prefijo indexado del
+# menor (len - ceil(2 * umbral / (1 + umbral) * len) + 1), así que basta
+# cruzar esos prefijos y verificar los candidatos. Todo en arreglos de
+# numpy: los nombres van de menor a mayor tamaño, de modo que los
+# candidatos de un nombre son un rango contiguo de cada bloque del
+# índice (lo que además aplica el filtro por tamaño, Jaccard <= min/max).
+# Los candidatos se verifican en tandas, sin bucles por par; un bloque
+# muy grande (trigrama frecuente) queda repartido entre las tandas de
+# los nombres que lo buscan, sin descartar ninguno de sus pares.
+# -------------------------------------------------------------------
+# Trigramas más comunes, verificados como bits (popcount) y no por búsqueda
+N_BITS = 256
+# Candidatos por tanda (memoria acotada)
+PARES_POR_TANDA = 2_000_000
+
+
+def _prefijo(tam: np.ndarray, fraccion: float) -> np.ndarray:
+    # El épsilon evita que 0.8 * 15 = 12.000000000000002 acorte el prefijo
+    return tam - np.ceil(fraccion * tam - 1e-9).astype(np.int64) + 1
+
+
+def _rango(inicio: np.ndarray, largo: np.ndarray) -> np.ndarray:
+    """Concatenación de arange(inicio[k], inicio[k] + largo[k])."""
+    total = int(largo.sum())
+    desplazamiento = np.repeat(inicio - (np.cumsum(largo) - largo), largo)
+    return np.arange(total, dtype=np.int64) + desplazamiento
+
+
+def _pares_similares(conjuntos: list, umbral: float):
+    """Pares (i, j, similitud) de conjuntos con Jaccard >= umbral, i != j."""
+    vacio = (np.array([], dtype=np.int64),) * 2 + (np.array([]),)
+    tam = np.fromiter(map(len, conjuntos), dtype=np.int64, count=len(conjuntos))
+    orden = np.argsort(tam, kind="stable")
+    tam = tam[orden]
+    n = len(tam)
+    if n < 2 or tam[-1] == 0:
+        return vacio
+
+    # Trigramas como enteros por rango de frecuencia (0 = el más raro)
+    codigos, vocabulario = pd.factorize(
+        pd.Series([g for k in orden for g in conjuntos[k]], dtype=object)
+    )
+    frecuencia = np.bincount(codigos)
+    v = len(vocabulario)
+    rango_de = np.empty(v, dtype=np.int64)
+    rango_de[np.argsort(frecuencia, kind="stable")] = np.arange(v)
+
+    # Entradas (nombre, trigrama) ordenadas por nombre y rango
+    registro = np.repeat(np.arange(n, dtype=np.int64), tam)
+    rango = rango_de[codigos]
+    rango = rango[np.lexsort((rango, registro))]
+    inicio = np.cumsum(tam) - tam
+    posicion = np.arange(len(rango)) - inicio[registro]
+    entradas = registro * v + rango     # ordenado
+
+    # Índice invertido de los prefijos indexados, por (trigrama, nombre)
+    indexada = posicion < _prefijo(tam, 2 * umbral / (1 + umbral))[registro]
+    indice = rango[indexada] * n + registro[indexada]
+    orden_indice = np.argsort(indice, kind="stable")
+    indice = indice[orden_indice]
+    posicion_indice = posicion[indexada][orden_indice]
+
+    # Prefijos de búsqueda: candidatos del nombre x en el bloque g son los
+    # nombres y < x con tam[y] >= umbral * tam[x]
+    buscada = posicion < _prefijo(tam, umbral)[registro]
+    x_busca, g_busca, p_busca = registro[buscada], rango[buscada], posicion[buscada]
+    menor = np.searchsorted(tam, np.ceil(umbral * tam - 1e-9))
+    desde = np.searchsorted(indice, g_busca * n + menor[x_busca])
+    hasta = np.searchsorted(indice, g_busca * n + x_busca)
+    cantidad = hasta - desde
+
+    # Trigramas comunes como bits; los raros se buscan en `entradas`
+    corte = max(v - N_BITS, 0)
+    marcas = np.zeros((n, v - corte), dtype=bool)
+    comun = rango >= corte
+    marcas[registro[comun], rango[comun] - corte] = True
+    bits = np.packbits(marcas, axis=1)
+    del marcas
+    n_raros = np.bincount(registro[~comun], minlength=n)
+
+    pares_i, pares_j, similitudes = [], [], []
+    # Tandas por nombre buscado (x_busca está ordenado), así los repetidos
+    # de un par caen en la misma tanda
+    por_nombre = np.bincount(x_busca, weights=cantidad, minlength=n).astype(np.int64)
+    acumulado = np.concatenate([[0], np.cumsum(por_nombre)])
+    a = 0
+    while a < n:
+        b = max(int(np.searchsorted(acumulado, acumulado[a] + PARES_POR_TANDA, "right")) - 1, a + 1)
+        tanda = slice(*np.searchsorted(x_busca, [a, b]))
+        c = cantidad[tanda]
+        x = np.repeat(x_busca[tanda], c)
+        emitidos = _rango(desde[tanda], c)
+        y = indice[emitidos] % n
+        # Filtro de posición: desde el primer trigrama común del par (el
+        # primero emitido, los prefijos van del más raro al más común)
+        # quedan a lo más min(tam - posición) comunes, y Jaccard >= umbral
+        # exige ceil(umbral / (1 + umbral) * (tam_x + tam_y))
+        cota = np.minimum(
+            tam[x] - np.repeat(p_busca[tanda], c), tam[y] - posicion_indice[emitidos]
+        )
+        par = x * n + y
+        orden_par = np.argsort(par, kind="stable")
+        par, cota = par[orden_par], cota[orden_par]
+        primero = np.ones(len(par), dtype=bool)
+        primero[1:] = par[1:] != par[:-1]
+        par, cota = par[primero], cota[primero]
+        x, y = par // n, par % n
+        alcanza = cota >= np.ceil(umbral / (1 + umbral) * (tam[x] + tam[y]) - 1e-9)
+        x, y = x[alcanza], y[alcanza]
+
+        # Verificación exacta: bits comunes + trigramas raros de y en x
+        comunes = contar_bits(bits[x] & bits[y])
+        r = n_raros[y]
+        cuales = np.repeat(np.arange(len(y)), r)
+        buscados = x[cuales] * v + rango[_rango(inicio[y], r)]
+        encontrados = entradas[np.minimum(np.searchsorted(entradas, buscados), len(entradas) - 1)] == buscados
+        comunes += np.bincount(cuales[encontrados], minlength=len(y))
+
+        s = comunes / (tam[x] + tam[y] - comunes)
+        ok = s >= umbral
+        pares_i.append(orden[y[ok]])
+        pares_j.append(orden[x[ok]])
+        similitudes.append(s[ok])
+        a = b
+    return np.concatenate(pares_i), np.concatenate(pares_j), np.concatenate(similitudes)
+
+
+def posibles_duplicados(
+    df_siel: pd.DataFrame,
+    df_bd: pd.DataFrame,
+    claves: dict = None,
+    umbral: float = UMBRAL_DUPLICADOS,
+) -> pd.DataFrame:
+    """Pares de exámenes con distinto Número y nombre normalizado con
+    similitud >= `umbral`, de mayor a menor similitud."""
+    if claves is None:
+        claves = {"SIEL": clave_numero(df_siel["Número"]), "BD": clave_numero(df_bd["Número"])}
+    clave_siel, clave_bd = claves_comparables(claves["SIEL"], claves["BD"])
+
+    registros = pd.concat([
+        pd.DataFrame({
+            "clave": clave_siel.to_numpy(),
+            "Número": df_siel["Número"].to_numpy(),
+            "Nombre": _nombres(df_siel),
+            "origen": 0,
+        }),
+        pd.DataFrame({
+            "clave": clave_bd.to_numpy(),
+            "Número": df_bd["Número"].to_numpy(),
+            "Nombre": _nombres(df_bd),
+            "origen": 1,
+        }),
+    ], ignore_index=True).dropna(subset=["clave"])
+    # Se normaliza cada nombre distinto una vez (SIEL y BD repiten casi todos)
+    codigos, unicos = pd.factorize(registros["Nombre"])
+    registros["normal"] = np.array([normalizar_texto(t) for t in unicos], dtype=object)[codigos]
+    registros = registros[registros["normal"] != ""]
+
+    # Un registro por Número y nombre normalizado, con su origen
+    # ("SIEL", "cartera" o "SIEL y cartera")
+    registros = (
+        registros.groupby(["clave", "normal"], sort=False)
+        .agg(
+            Número=("Número", "first"),
+            Nombre=("Nombre", "first"),
+            origen_min=("origen", "min"),
+            origen_max=("origen", "max"),
+        )
+        .reset_index()
+    )
+    registros["Origen"] = ORIGENES[np.where(
+        registros["origen_min"] == registros["origen_max"], registros["origen_max"], 2
+    )]
+    # Nombres idénticos se comparan una vez; luego cada par de nombres se
+    # expande a los registros que los tienen
+    normales, grupo = np.unique(registros["normal"].to_numpy(dtype=object), return_inverse=True)
+    a, b, s = _pares_similares([trigramas(t) for t in normales], umbral)
+    miembros = pd.DataFrame({"grupo": grupo.ravel(), "fila": np.arange(len(registros))})
+    distintos = (
+        pd.DataFrame({"a": a, "b": b, "Similitud": s})
+        .merge(miembros.rename(columns={"grupo": "a", "fila": "i"}), on="a")
+        .merge(miembros.rename(columns={"grupo": "b", "fila": "j"}), on="b")
+    )
+    iguales = miembros.merge(miembros, on="grupo", suffixes=("_i", "_j"))
+    iguales = iguales[iguales["fila_i"] < iguales["fila_j"]]
+    i = np.concatenate([distintos["i"].to_numpy(), iguales["fila_i"].to_numpy()])
+    j = np.concatenate([distintos["j"].to_numpy(), iguales["fila_j"].to_numpy()])
+    s = np.concatenate([distintos["Similitud"].to_numpy(), np.ones(len(iguales))])
+
+    columnas = [
+        "Número_1", "Nombre_1", "Origen_1", "Número_2", "Nombre_2", "Origen_2", "Similitud",
+    ]
+    distinta_clave = registros["clave"].to_numpy()[i] != registros["clave"].to_numpy()[j]
+    i, j, s = i[distinta_clave], j[distinta_clave], s[distinta_clave]
+    uno, dos = registros.iloc[i], registros.iloc[j]
+    resultado = pd.DataFrame({
+        "Número_1": uno["Número"].to_numpy(),
+        "Nombre_1": uno["Nombre"].to_numpy(),
+        "Origen_1": uno["Origen"].to_numpy(),
+        "Número_2": dos["Número"].to_numpy(),
+        "Nombre_2": dos["Nombre"].to_numpy(),
+        "Origen_2": dos["Origen"].to_numpy(),
+        "Similitud": np.round(s, 3),
+    }, columns=columnas)
+    return resultado.sort_values("Similitud", ascending=False, kind="stable").reset_index(drop=True)
@@ -0,0 +1,97 @@
+"""Medición por etapas (tiempo, filas, memoria) con registro en JSON."""
+import json
+import logging
+import sys
+import time
+import tracemalloc
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+logger = logging.getLogger("siel.rendimiento")
+logger.setLevel(logging.INFO)
+
+
+# -------------------------------------------------------------------
+# Registro JSON: una línea por etapa en el archivo indicado. Se puede
+# llamar en cada rerun o en cada proceso; el archivo se agrega una vez.
+# -------------------------------------------------------------------
+def configurar_log(ruta: str):
+    for handler in logger.handlers:
+        if getattr(handler, "ruta_rendimiento", None) == ruta:
+            return
+    handler = logging.FileHandler(ruta, encoding="utf-8")
+    handler.setFormatter(logging.Formatter("%(message)s"))
+    handler.ruta_rendimiento = ruta
+    logger.addHandler(handler)
+
+
+def _rss_max_mb():
+    # Máximo de memoria residente del proceso hasta ahora
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux informa KB, macOS bytes
+    return round(rss / (2**20 if sys.platform == "darwin" else 2**10), 1)
+
+
+# -------------------------------------------------------------------
+# Medidor de una ejecución: cada etapa guarda segundos, filas (si se
+# indican), pico de memoria Python/numpy de la etapa (solo con
+# memoria=True, vía tracemalloc, que hace más lento el proceso) y el
+# máximo de memoria residente del proceso al terminar la etapa.
+# Las etapas no se anidan. tracemalloc mide todo el proceso: si otros
+# hilos asignan memoria durante la etapa (sesiones y trabajos de la app),
+# su pico la incluye, así que memoria=True solo tiene sentido cuando la
+# etapa corre sola, como en lote.py y benchmark.py.
+# -------------------------------------------------------------------
+class Medidor:
+    def __init__(self, contexto: dict = None, memoria: bool = False):
+        self.contexto = dict(contexto or {})
+        self.memoria = memoria
+        self.etapas = []
+
+    @contextmanager
+    def etapa(self, nombre: str, filas: int = None):
+        """Mide el bloque; dentro se puede fijar registro["filas"]."""
+        registro = {"etapa": nombre, "filas": filas}
+        if self.memoria:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+            tracemalloc.reset_peak()
+            memoria_inicial, _ = tracemalloc.get_traced_memory()
+        inicio = time.perf_counter()
+        try:
+            yield registro
+        except Exception as e:
+            registro["error"] = repr(e)
+            raise
+        finally:
+            registro["segundos"] = round(time.perf_counter() - inicio, 4)
+            if self.memoria:
+                _, pico = tracemalloc.get_traced_memory()
+                registro["pico_mb"] = round((pico - memoria_inicial) / 2**20, 2)
+            registro["rss_max_mb"] = _rss_max_mb()
+            self.etapas.append(registro)
+            logger.info(json.dumps(
+                {
+                    "momento": datetime.now(timezone.utc).isoformat(timespec="milliseconds"),
+                    **self.contexto,
+                    **registro,
+                },
+                ensure_ascii=False,
+                default=str,
+            ))
+
+    def tabla(self):
+        """Etapas como DataFrame (pandas se importa recién aquí)."""
+        import pandas as pd
+
+        return pd.DataFrame(self.etapas)
+
+    def total_segundos(self) -> float:
+        return round(sum(e["segundos"] for e in self.etapas), 4)
@@ -0,0 +1,228 @@
+"""Tendencias de cobertura a lo largo de muchas versiones de la cartera.
+
+Ejemplos:
+    python tendencias.py --historial historial ingestar carteras_antiguas --procesos 4
+    python tendencias.py consultar --por nodo --salida tendencia_nodos.xlsx
+    python tendencias.py consultar --por examen --numero 1234
+
+`ingestar` incorpora al historial (historial.py) cada libro de cartera de
+una carpeta que aún no esté guardado (por hash), leyendo solo BD y las
+hojas de hospitales, en paralelo. Las consultas cargan una vez las
+matrices int8 de todas las versiones y responden por hospital, Nodo,
+nivel de complejidad o examen sin volver a leer ningún Excel.
+"""
+import argparse
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from carga import clave_numero, encabezados_xlsx, hash_contenido, homologar_bd, leer_cartera
+from exportar import exportar
+from historial import Historial
+from matriz import SI, MatrizCartera, agrupar_por_nivel, construir_matriz
+from motor import COMPLEJIDAD, HOSPITALES, NODOS
+
+NO_ESTA = "NO ESTÁ EN LA CARTERA"
+
+
+# -------------------------------------------------------------------
+# Ingesta de una carpeta de carteras al historial
+# -------------------------------------------------------------------
+def matriz_de_cartera(datos_cartera: bytes, hospitales: list) -> MatrizCartera:
+    """Matriz de una cartera sin archivo SIEL (solo BD + hospitales).
+
+    Las versiones antiguas pueden no tener todas las hojas: se usan las
+    que existan.
+    """
+    hojas, _ = encabezados_xlsx(datos_cartera, [])
+    if "BD" not in hojas:
+        raise ValueError("La cartera no tiene la hoja BD")
+    presentes = [h for h in hospitales if h in hojas]
+
+    df_bd, dfs_hospitales = leer_cartera(datos_cartera, presentes)
+    df_bd = homologar_bd(df_bd)
+    return construir_matriz(df_bd, dfs_hospitales, presentes)
+
+
+def _leer_version(ruta: Path, hospitales: list):
+    datos = ruta.read_bytes()
+    return hash_contenido(datos), matriz_de_cartera(datos, hospitales)
+
+
+def ingestar_carpeta(
+    historial: Historial,
+    carpeta,
+    hospitales: list = HOSPITALES,
+    n_procesos: int = 1,
+) -> pd.DataFrame:
+    """Agrega al historial las carteras .xlsx de `carpeta` que falten.
+
+    Devuelve una fila por archivo con su versión y lo que pasó con él.
+    """
+    informe = []
+    pendientes = []
+    vistas = set()
+    for ruta in sorted(Path(carpeta).glob("*.xlsx")):
+        version = hash_contenido(ruta.read_bytes())
+        if version in vistas or historial.contiene(version):
+            informe.append({"Archivo": ruta.name, "Versión": version, "Estado": "ya estaba"})
+        else:
+            pendientes.append(ruta)
+        vistas.add(version)
+
+    def guardar(ruta, obtener):
+        try:
+            version, matriz = obtener()
+        except Exception as e:
+            informe.append({"Archivo": ruta.name, "Versión": None, "Estado": f"error: {e}"})
+            return
+        historial.guardar(version, ruta.name, matriz)
+        informe.append({"Archivo": ruta.name, "Versión": version, "Estado": "agregada"})
+
+    if n_procesos > 1 and len(pendientes) > 1:
+        with ProcessPoolExecutor(
+            max_workers=n_procesos, mp_context=multiprocessing.get_context("spawn")
+        ) as pool:
+            futuros = [(r, pool.submit(_leer_version, r, hospitales)) for r in pendientes]
+            for ruta, futuro in futuros:
+                guardar(ruta, futuro.result)
+    else:
+        for ruta in pendientes:
+            guardar(ruta, lambda: _leer_version(ruta, hospitales))
+
+    return pd.DataFrame(informe, columns=["Archivo", "Versión", "Estado"])
+
+
+# -------------------------------------------------------------------
+# Consultas sobre todas las versiones guardadas. Las matrices se cargan
+# una vez; cada consulta recorre los arreglos int8 en memoria.
+# -------------------------------------------------------------------
+class Tendencias:
+    def __init__(self, historial: Historial):
+        self.versiones = historial.versiones()
+        self.matrices = [historial.cargar(v) for v in self.versiones["version"]]
+        # Por versión: índice de claves (primera fila de cada una) -> fila
+        self._indices = []
+        for m in self.matrices:
+            unicas = ~pd.Series(m.claves).duplicated().to_numpy()
+            self._indices.append((pd.Index(m.claves[unicas]), np.flatnonzero(unicas)))
+
+    def __len__(self):
+        return len(self.matrices)
+
+    def _columnas_version(self) -> pd.DataFrame:
+        return pd.DataFrame({
+            "Fecha": pd.to_datetime(self.versiones["fecha"]),
+            "Versión": self.versiones["nombre"],
+        })
+
+    def por_hospital(self, estado: int = SI) -> pd.DataFrame:
+        """Exámenes en `estado` por hospital y versión."""
+        filas = []
+        for (_, version), matriz in zip(self._columnas_version().iterrows(), self.matrices):
+            conteos = (matriz.codigos == estado).sum(axis=0)
+            for h, n in zip(matriz.hospitales, conteos):
+                filas.append((version["Fecha"], version["Versión"], h, int(n), len(matriz.base)))
+        df = pd.DataFrame(filas, columns=["Fecha", "Versión", "Hospital", "Exámenes", "Total_exámenes"])
+        df["%_exámenes"] = (100 * df["Exámenes"] / df["Total_exámenes"]).round(1)
+        return df
+
+    def por_grupos(self, grupos: dict, col_grupo: str) -> pd.DataFrame:
+        """Exámenes que al menos un hospital del grupo realiza (SI), por versión."""
+        filas = []
+        for (_, version), matriz in zip(self._columnas_version().iterrows(), self.matrices):
+            realiza = matriz.codigos == SI
+            for grupo, lista in grupos.items():
+                columnas = [matriz.hospitales.index(h) for h in lista if h in matriz.hospitales]
+                if not columnas:
+                    continue
+                n = int(realiza[:, columnas].any(axis=1).sum())
+                filas.append((version["Fecha"], version["Versión"], grupo, len(columnas), n, len(matriz.base)))
+        df = pd.DataFrame(
+            filas,
+            columns=["Fecha", "Versión", col_grupo, "Hospitales", "Exámenes_cubiertos", "Total_exámenes"],
+        )
+        df["%_cubierto"] = (100 * df["Exámenes_cubiertos"] / df["Total_exámenes"]).round(1)
+        return df
+
+    def por_nodo(self) -> pd.DataFrame:
+        return self.por_grupos(NODOS, "Nodo")
+
+    def por_complejidad(self) -> pd.DataFrame:
+        return self.por_grupos(agrupar_por_nivel(COMPLEJIDAD), "Complejidad")
+
+    def por_examen(self, numero) -> pd.DataFrame:
+        """Estado del examen en cada hospital y versión."""
+        clave = clave_numero(pd.Series([numero], dtype=object)).iloc[0]
+        filas = []
+        for (_, version), matriz, (indice, filas_indice) in zip(
+            self._columnas_version().iterrows(), self.matrices, self._indices
+        ):
+            # Claves int64 solo calzan con enteros; las de texto, con el texto
+            if indice.dtype == np.int64:
+                encontrada = -1 if isinstance(clave, str) else indice.get_indexer([clave])[0]
+            else:
+                encontrada = indice.get_indexer([None if clave is None else str(clave)])[0]
+            posicion = -1 if encontrada < 0 else filas_indice[encontrada]
+            for j, h in enumerate(matriz.hospitales):
+                estado = NO_ESTA if posicion < 0 else matriz.etiquetas[matriz.codigos[posicion, j]]
+                filas.append((version["Fecha"], version["Versión"], h, estado))
+        return pd.DataFrame(filas, columns=["Fecha", "Versión", "Hospital", "Estado"])
+
+
+CONSULTAS = {
+    "hospital": ("Hospital", "%_exámenes"),
+    "nodo": ("Nodo", "%_cubierto"),
+    "complejidad": ("Complejidad", "%_cubierto"),
+    "examen": ("Hospital", "Estado"),
+}
+
+
+def consultar(tendencias: Tendencias, por: str, numero=None) -> pd.DataFrame:
+    if por == "hospital":
+        return tendencias.por_hospital()
+    if por == "nodo":
+        return tendencias.por_nodo()
+    if por == "complejidad":
+        return tendencias.por_complejidad()
+    if por == "examen":
+        return tendencias.por_examen(numero)
+    raise KeyError(por)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--historial", default="historial", help="carpeta del historial")
+    sub = parser.add_subparsers(dest="accion", required=True)
+
+    p_ingestar = sub.add_parser("ingestar", help="incorpora las carteras de una carpeta")
+    p_ingestar.add_argument("carpeta", type=Path)
+    p_ingestar.add_argument("--procesos", type=int, default=1)
+
+    p_consultar = sub.add_parser("consultar", help="tendencia por hospital, nodo, complejidad o examen")
+    p_consultar.add_argument("--por", choices=CONSULTAS, default="nodo")
+    p_consultar.add_argument("--numero", help="Número del examen (con --por examen)")
+    p_consultar.add_argument("--salida", type=Path, help="archivo .xlsx donde guardar la tabla")
+
+    args = parser.parse_args(argv)
+    historial = Historial(args.historial)
+
+    if args.accion == "ingestar":
+        informe = ingestar_carpeta(historial, args.carpeta, HOSPITALES, args.procesos)
+        print(informe.to_string(index=False))
+        return
+
+    if args.por == "examen" and args.numero is None:
+        parser.error("--por examen requiere --numero")
+    tabla = consultar(Tendencias(historial), args.por, args.numero)
+    if args.salida is not None:
+        args.salida.write_bytes(exportar({f"TENDENCIA_{args.por.upper()}": tabla}))
+    else:
+        print(tabla.to_string(index=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,138 @@
+import re
+import zipfile
+from io import BytesIO
+
+import numpy as np
+import pandas as pd
+import pytest
+from openpyxl import Workbook
+from openpyxl.styles import Font
+
+from carga import cargar_insumos, encabezados_xlsx, leer_cartera, validar_esquema
+
+HOSPITALES = ["HHHA", "CAPLC"]
+
+
+def libro_con_celdas_vacias_con_formato() -> bytes:
+    libro = Workbook()
+    negrita = Font(bold=True)
+
+    bd = libro.active
+    bd.title = "BD"
+    bd.append(["Número", "Nombre exámen SIEL", "Sección"])
+    bd.append([101, "Hemograma", "HEMATOLOGIA"])
+    bd.append([102.0, None, "QUIMICA"])
+    bd.append(["103 ", "Glicemia", None])
+    bd.append([104.5, "#N/A", True])
+    # Celdas con formato y sin valor a la derecha del encabezado y de los
+    # datos, y una fila final solo con formato
+    bd["F1"].font = negrita
+    bd["E3"].font = negrita
+    bd["D5"].font = negrita
+    bd["B7"].font = negrita
+
+    for h in HOSPITALES:
+        hoja = libro.create_sheet(h)
+        hoja.append(["Número", "Nombre", "Cartera"])
+        hoja.append([101, "Hemograma", "SI"])
+        hoja.append([102, "Otro", None])
+        hoja.append([None, None, "NO"])
+        hoja["H1"].font = negrita
+        hoja["E2"].font = negrita
+
+    buffer = BytesIO()
+    libro.save(buffer)
+    return buffer.getvalue()
+
+
+def test_leer_cartera_igual_a_read_excel():
+    datos = libro_con_celdas_vacias_con_formato()
+    df_bd, dfs_hospitales = leer_cartera(datos, HOSPITALES)
+
+    esperado_bd = pd.read_excel(BytesIO(datos), sheet_name="BD")
+    assert list(df_bd.columns) == ["Número", "Nombre exámen SIEL", "Sección"]
+    pd.testing.assert_frame_equal(df_bd, esperado_bd)
+    assert df_bd["Nombre exámen SIEL"].isna().tolist() == [False, True, False, True]
+
+    for h in HOSPITALES:
+        esperado = pd.read_excel(BytesIO(datos), sheet_name=h)[["Número", "Cartera"]]
+        pd.testing.assert_frame_equal(dfs_hospitales[h], esperado)
+
+
+@pytest.mark.parametrize("columna", ["Número", "Nombre exámen SIEL", "Sección"])
+def test_tipos_iguales_a_read_excel(columna):
+    datos = libro_con_celdas_vacias_con_formato()
+    df_bd, _ = leer_cartera(datos, HOSPITALES)
+    esperado = pd.read_excel(BytesIO(datos), sheet_name="BD")[columna]
+    assert df_bd[columna].dtype == esperado.dtype
+    assert [type(v) for v in df_bd[columna]] == [type(v) for v in esperado]
+    assert np.array_equal(df_bd[columna].isna(), esperado.isna())
+
+
+# -------------------------------------------------------------------
+# Validación previa: libros válidos con otra estructura interna
+# -------------------------------------------------------------------
+def reescribir_zip(datos: bytes, cambiar) -> bytes:
+    """Copia del .xlsx con cada parte pasada por cambiar(nombre, contenido)."""
+    salida = BytesIO()
+    with zipfile.ZipFile(BytesIO(datos)) as origen, zipfile.ZipFile(salida, "w") as destino:
+        for nombre in origen.namelist():
+            destino.writestr(*cambiar(nombre, origen.read(nombre)))
+    return salida.getvalue()
+
+
+def sin_numero_de_fila(nombre: str, contenido: bytes):
+    if nombre.startswith("xl/worksheets/"):
+        contenido = re.sub(rb'(<row\b[^>]*?) r="\d+"', rb"\1", contenido)
+    return nombre, contenido
+
+
+def libro_en_otra_carpeta(nombre: str, contenido: bytes):
+    # Todo xl/ pasa a excel/; una hoja con destino relativo al libro y
+    # las demás con destino absoluto
+    if nombre == "xl/_rels/workbook.xml.rels":
+        contenido = contenido.replace(b'"/xl/worksheets/sheet1', b'"worksheets/sheet1')
+    if nombre in ("[Content_Types].xml", "_rels/.rels", "xl/_rels/workbook.xml.rels"):
+        contenido = contenido.replace(b"/xl/", b"/excel/").replace(b'"xl/', b'"excel/')
+    return nombre.replace("xl/", "excel/", 1), contenido
+
+
+@pytest.mark.parametrize("cambiar", [sin_numero_de_fila, libro_en_otra_carpeta])
+def test_encabezados_de_libros_que_lee_read_excel(cambiar):
+    original = libro_con_celdas_vacias_con_formato()
+    datos = reescribir_zip(original, cambiar)
+    hojas = ["BD"] + HOSPITALES
+
+    for h in hojas:
+        pd.testing.assert_frame_equal(
+            pd.read_excel(BytesIO(datos), sheet_name=h, engine="openpyxl"),
+            pd.read_excel(BytesIO(original), sheet_name=h),
+        )
+    assert leer_cartera(datos, HOSPITALES)[0].equals(leer_cartera(original, HOSPITALES)[0])
+    assert encabezados_xlsx(datos, hojas) == encabezados_xlsx(original, hojas)
+    assert all(numero == 1 for numero, _ in encabezados_xlsx(datos, hojas)[1].values())
+
+
+def test_bd_con_nombre_antiguo_se_homologa():
+    # BD y SIEL con "Nombre exámen" en vez de "Nombre exámen SIEL"
+    libro = Workbook()
+    bd = libro.active
+    bd.title = "BD"
+    bd.append(["Número", "Nombre exámen"])
+    bd.append([101, "Hemograma"])
+    for h in HOSPITALES:
+        hoja = libro.create_sheet(h)
+        hoja.append(["Número", "Cartera"])
+        hoja.append([101, "SI"])
+    cartera = BytesIO()
+    libro.save(cartera)
+
+    libro = Workbook()
+    libro.active.append(["Número", "Nombre exámen", "Sección"])
+    libro.active.append([101, "Hemograma", "HEMATOLOGIA"])
+    siel = BytesIO()
+    libro.save(siel)
+
+    assert validar_esquema(siel.getvalue(), cartera.getvalue(), HOSPITALES) == []
+    df_siel, df_bd, _, _ = cargar_insumos(siel.getvalue(), cartera.getvalue(), HOSPITALES)
+    assert list(df_bd.columns) == list(df_siel.columns) == ["Número", "Nombre exámen SIEL"]
@@ -0,0 +1,45 @@
+import threading
+
+import numpy as np
+import pandas as pd
+
+from historial import Historial
+from matriz import MatrizCartera
+
+
+def matriz_de_prueba() -> MatrizCartera:
+    return MatrizCartera(
+        base=pd.DataFrame({"Número": [101, 102, 103], "Nombre exámen SIEL": ["A", "B", "C"]}),
+        codigos=np.array([[0, 1], [1, 1], [2, 0]], dtype=np.int8),
+        hospitales=["HHHA", "CAPLC"],
+        etiquetas=["SI", "NO", "NO INFORMADO"],
+        claves=pd.Series([101, 102, 103], name="Número"),
+    )
+
+
+def test_guardar_la_misma_version_a_la_vez(tmp_path):
+    matriz = matriz_de_prueba()
+    for ronda in range(10):
+        historial = Historial(tmp_path / f"historial_{ronda}")
+        barrera = threading.Barrier(4)
+        agregadas, errores = [], []
+
+        def guardar():
+            barrera.wait()
+            try:
+                agregadas.append(historial.guardar("v1", "CARTERA_01012025.xlsx", matriz))
+            except Exception as e:
+                errores.append(e)
+
+        hilos = [threading.Thread(target=guardar) for _ in range(4)]
+        for hilo in hilos:
+            hilo.start()
+        for hilo in hilos:
+            hilo.join()
+
+        assert errores == []
+        assert sorted(agregadas) == [False, False, False, True]
+        assert list(historial.versiones()["version"]) == ["v1"]
+        assert list((historial.carpeta / "versiones").iterdir()) == [historial._ruta("v1")]
+        cargada = historial.cargar("v1")
+        assert np.array_equal(cargada.codigos, matriz.codigos)
@@ -0,0 +1,73 @@
+import itertools
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import nombres
+from nombres import _pares_similares, posibles_duplicados, similitud, trigramas
+
+
+def pares_fuerza_bruta(conjuntos: list, umbral: float) -> dict:
+    pares = {}
+    for i, j in itertools.combinations(range(len(conjuntos)), 2):
+        s = similitud(conjuntos[i], conjuntos[j])
+        if s >= umbral:
+            pares[frozenset((i, j))] = s
+    return pares
+
+
+def pares_indice(conjuntos: list, umbral: float) -> dict:
+    a, b, s = _pares_similares(conjuntos, umbral)
+    pares = {frozenset((int(i), int(j))): float(x) for i, j, x in zip(a, b, s)}
+    assert len(pares) == len(a), "pares repetidos"
+    return pares
+
+
+def nombres_aleatorios(n: int, semilla: int) -> list:
+    # Alfabeto chico y variantes de unas pocas bases: muchos pares similares
+    # y trigramas muy frecuentes (bloques grandes)
+    rng = np.random.default_rng(semilla)
+    bases = ["".join(rng.choice(list("abcde "), size=rng.integers(4, 20))) for _ in range(n // 4)]
+    salida = []
+    for _ in range(n):
+        texto = list(bases[rng.integers(len(bases))])
+        for _ in range(rng.integers(0, 3)):
+            texto.insert(rng.integers(len(texto) + 1), rng.choice(list("abcdexyz")))
+        salida.append("".join(texto))
+    return salida
+
+
+@pytest.mark.parametrize("umbral", [0.5, 0.8, 0.9])
+@pytest.mark.parametrize("por_tanda", [1, 50, 2_000_000])
+def test_pares_iguales_a_fuerza_bruta(monkeypatch, umbral, por_tanda):
+    monkeypatch.setattr(nombres, "PARES_POR_TANDA", por_tanda)
+    conjuntos = [trigramas(t) for t in nombres_aleatorios(300, semilla=1)]
+    esperado = pares_fuerza_bruta(conjuntos, umbral)
+    obtenido = pares_indice(conjuntos, umbral)
+    assert esperado
+    assert obtenido.keys() == esperado.keys()
+    for par, s in esperado.items():
+        assert obtenido[par] == pytest.approx(s)
+
+
+def test_tanda_sin_candidatos(monkeypatch):
+    # Una tanda por nombre: los primeros no tienen candidatos
+    monkeypatch.setattr(nombres, "PARES_POR_TANDA", 1)
+    conjuntos = [trigramas(t) for t in ["xyz", "hemograma", "hemograma completo", "hemogramas"]]
+    assert pares_indice(conjuntos, 0.5) == pares_fuerza_bruta(conjuntos, 0.5)
+    assert pares_indice([trigramas("abc"), trigramas("xyz")], 0.8) == {}
+
+
+def test_nombres_vacios_no_forman_duplicados():
+    df_siel = pd.DataFrame({
+        "Número": [1, 2, 3],
+        "Nombre exámen SIEL": ["Hemograma", np.nan, "Glicemia"],
+    })
+    df_bd = pd.DataFrame({
+        "Número": [4, 5],
+        "Nombre exámen SIEL": [None, "GLICEMIA "],
+    })
+    resultado = posibles_duplicados(df_siel, df_bd)
+    assert resultado[["Número_1", "Número_2"]].values.tolist() == [[3, 5]]
+    assert "nan" not in set(resultado["Nombre_1"]) | set(resultado["Nombre_2"])
@@ -0,0 +1,19 @@
+import json
+
+import pytest
+
+from topologia import RUTA_TOPOLOGIA, cargar_topologia
+
+
+def test_topologia_configurada_sin_problemas():
+    assert cargar_topologia().problemas() == []
+
+
+@pytest.mark.parametrize("nombre", ["X" * 32, "BASICA/NODOS", "CARTERA[1]", "", "'CARTERA'"])
+def test_nombre_de_cartera_invalido_como_hoja(tmp_path, nombre):
+    datos = json.loads(RUTA_TOPOLOGIA.read_text(encoding="utf-8"))
+    datos["carteras"][nombre] = {"consulta": {"todos": ["RED"]}}
+    ruta = tmp_path / "topologia_prueba.json"
+    ruta.write_text(json.dumps(datos), encoding="utf-8")
+    with pytest.raises(ValueError, match="nombre de hoja"):
+        cargar_topologia(ruta)
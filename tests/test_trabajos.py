@@ -0,0 +1,49 @@
+import threading
+
+from trabajos import iniciar_trabajo, soltar_trabajo
+
+
+def trabajo_bloqueado(clave: str, seguir: threading.Event):
+    def funcion(trabajo):
+        seguir.wait(5)
+        with trabajo.etapa("despues"):
+            pass
+
+    return iniciar_trabajo(clave, ["despues"], funcion)
+
+
+def test_trabajo_compartido_sigue_hasta_que_lo_suelta_la_ultima_sesion():
+    seguir = threading.Event()
+    sesion_1 = trabajo_bloqueado("compartido", seguir)
+    sesion_2 = trabajo_bloqueado("compartido", seguir)
+    assert sesion_1 is sesion_2
+    assert sesion_1.suscriptores == 2
+
+    soltar_trabajo(sesion_1)
+    assert not sesion_2.cancelado
+    soltar_trabajo(sesion_2)
+    assert sesion_2.cancelado
+
+    seguir.set()
+    assert sesion_2.esperar(5)
+    assert sesion_2.completadas == []
+
+
+def test_trabajo_soltado_no_se_cancela_si_ya_termino():
+    seguir = threading.Event()
+    seguir.set()
+    trabajo = trabajo_bloqueado("terminado", seguir)
+    assert trabajo.esperar(5)
+    soltar_trabajo(trabajo)
+    assert not trabajo.cancelado
+    assert trabajo.completadas == ["despues"]
+
+
+def test_sesion_nueva_tras_cancelar_inicia_otro_trabajo():
+    seguir = threading.Event()
+    anterior = trabajo_bloqueado("reinicio", seguir)
+    soltar_trabajo(anterior)
+    nuevo = trabajo_bloqueado("reinicio", seguir)
+    assert nuevo is not anterior and not nuevo.cancelado
+    seguir.set()
+    assert nuevo.esperar(5) and nuevo.completadas == ["despues"]
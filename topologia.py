@@ -0,0 +1,186 @@
+"""Topología de la red de un servicio de salud y carteras como consultas.
+
+La lista de hospitales (hojas de la cartera), los Nodos, el nivel de
+complejidad de cada hospital, grupos con nombre y las carteras agregadas
+se leen de un archivo JSON: `topologia_ssasur.json` por defecto, u otro
+con `SIEL_TOPOLOGIA=archivo.json`. Agregar un servicio es escribir su
+archivo, sin cambiar código.
+
+Una cartera es una consulta sobre los hospitales que realizan cada
+examen (SI), evaluada con operaciones de bits (matriz.MatrizCartera.cobertura):
+
+    {"todos": [refs]}               todos los hospitales indicados
+    {"alguno": [refs]}              al menos uno
+    {"al_menos": 2, "de": [refs]}   al menos k
+    {"ninguno": [refs]}             ninguno
+    {"y": [consultas]}, {"o": [consultas]}, {"no": consulta}
+
+Cada referencia es un código de hospital, "NODO:<nodo>",
+"COMPLEJIDAD:<nivel>", "GRUPO:<grupo>" o "RED" (todos los hospitales).
+Por ejemplo, "todo el Nodo SUR más HHHA" es {"todos": ["NODO:SUR", "HHHA"]}
+y "al menos 2 de LACUSTRE" es {"al_menos": 2, "de": ["NODO:LACUSTRE"]}.
+"""
+import json
+from dataclasses import dataclass, field
+from pathlib import Path
+
+import numpy as np
+
+from exportar import problema_nombre_hoja
+from matriz import MatrizCartera, contar_bits
+
+RUTA_TOPOLOGIA = Path(__file__).with_name("topologia_ssasur.json")
+
+
+@dataclass
+class Topologia:
+    servicio: str
+    hospitales: list
+    nodos: dict                     # Nodo -> hospitales
+    complejidad: dict               # hospital -> nivel
+    grupos: dict = field(default_factory=dict)      # nombre -> hospitales
+    carteras: dict = field(default_factory=dict)    # nombre -> {"descripcion", "consulta"}
+
+    def referencias(self) -> list:
+        """Referencias válidas en una consulta, para selectores."""
+        niveles = list(dict.fromkeys(self.complejidad.values()))
+        return (
+            ["RED"]
+            + [f"NODO:{n}" for n in self.nodos]
+            + [f"COMPLEJIDAD:{c}" for c in niveles]
+            + [f"GRUPO:{g}" for g in self.grupos]
+            + list(self.hospitales)
+        )
+
+    def hospitales_de(self, referencias: list) -> list:
+        """Hospitales de una lista de referencias, en el orden de la red."""
+        if isinstance(referencias, str):
+            referencias = [referencias]
+        elegidos = set()
+        for ref in referencias:
+            tipo, _, nombre = str(ref).partition(":")
+            if ref == "RED":
+                elegidos.update(self.hospitales)
+            elif tipo == "NODO" and nombre in self.nodos:
+                elegidos.update(self.nodos[nombre])
+            elif tipo == "COMPLEJIDAD" and nombre in self.complejidad.values():
+                elegidos.update(h for h, c in self.complejidad.items() if c == nombre)
+            elif tipo == "GRUPO" and nombre in self.grupos:
+                elegidos.update(self.grupos[nombre])
+            elif ref in self.hospitales:
+                elegidos.add(ref)
+            else:
+                raise ValueError(f"Referencia desconocida en la consulta: {ref!r}")
+        return [h for h in self.hospitales if h in elegidos]
+
+    def mascara(self, matriz: MatrizCartera, consulta: dict) -> np.ndarray:
+        """Máscara de exámenes de `matriz` que cumplen `consulta`."""
+        return _evaluar(
+            consulta, matriz.cobertura, lambda refs: matriz.bits_de(self.hospitales_de(refs))
+        )
+
+    def problemas(self) -> list:
+        """Inconsistencias de la topología (lista vacía si está bien)."""
+        problemas = []
+        if not self.hospitales:
+            problemas.append("no hay hospitales")
+        repetidos = sorted({h for h in self.hospitales if self.hospitales.count(h) > 1})
+        if repetidos:
+            problemas.append(f"hospitales repetidos: {', '.join(repetidos)}")
+        for tipo, grupos in (("Nodo", self.nodos), ("grupo", self.grupos)):
+            for nombre, lista in grupos.items():
+                faltan = [h for h in lista if h not in self.hospitales]
+                if faltan:
+                    problemas.append(f"{tipo} {nombre}: hospitales desconocidos {', '.join(faltan)}")
+        faltan = [h for h in self.complejidad if h not in self.hospitales]
+        if faltan:
+            problemas.append(f"complejidad de hospitales desconocidos: {', '.join(faltan)}")
+
+        # Cada cartera es una hoja de Excel en las descargas
+        for nombre in self.carteras:
+            problema = problema_nombre_hoja(nombre)
+            if problema:
+                problemas.append(f"cartera {nombre!r}: {problema}")
+
+        # Cada cartera se evalúa sobre cero exámenes para revisar su consulta
+        def revisar_refs(refs):
+            self.hospitales_de(refs)
+            return np.zeros(1, dtype="<u8")
+
+        for nombre, cartera in self.carteras.items():
+            try:
+                _evaluar(cartera.get("consulta"), np.zeros((0, 1), dtype="<u8"), revisar_refs)
+            except (ValueError, TypeError, AttributeError) as e:
+                problemas.append(f"cartera {nombre}: {e}")
+        return problemas
+
+
+# -------------------------------------------------------------------
+# Evaluación de una consulta sobre la cobertura en bits (exámenes ×
+# palabras). `bits_de(refs)` da la palabra de un conjunto de hospitales.
+# -------------------------------------------------------------------
+def _evaluar(consulta: dict, cobertura: np.ndarray, bits_de) -> np.ndarray:
+    if not isinstance(consulta, dict) or not consulta:
+        raise ValueError(f"consulta inválida: {consulta!r}")
+    operador = "al_menos" if "al_menos" in consulta else next(iter(consulta))
+    esperadas = {"al_menos", "de"} if operador == "al_menos" else {operador}
+    if set(consulta) != esperadas:
+        raise ValueError(f"consulta inválida: {consulta!r}")
+    argumento = consulta[operador]
+
+    if operador == "todos":
+        bits = bits_de(argumento)
+        return ((cobertura & bits) == bits).all(axis=1)
+    if operador == "alguno":
+        return (cobertura & bits_de(argumento)).any(axis=1)
+    if operador == "ninguno":
+        return ~(cobertura & bits_de(argumento)).any(axis=1)
+    if operador == "al_menos":
+        if not isinstance(argumento, int) or isinstance(argumento, bool) or argumento < 0:
+            raise ValueError(f"al_menos debe ser un entero >= 0: {argumento!r}")
+        return contar_bits(cobertura & bits_de(consulta["de"])) >= argumento
+    if operador in ("y", "o"):
+        if not isinstance(argumento, list) or not argumento:
+            raise ValueError(f"'{operador}' necesita una lista de consultas")
+        partes = [_evaluar(c, cobertura, bits_de) for c in argumento]
+        return np.logical_and.reduce(partes) if operador == "y" else np.logical_or.reduce(partes)
+    if operador == "no":
+        return ~_evaluar(argumento, cobertura, bits_de)
+    raise ValueError(f"operador desconocido: {operador!r}")
+
+
+def cargar_topologia(ruta=None) -> Topologia:
+    """Topología desde un archivo JSON (por defecto, la de SSASUR).
+
+    Levanta ValueError si el archivo no se puede leer o es inconsistente.
+    """
+    ruta = Path(ruta) if ruta else RUTA_TOPOLOGIA
+    try:
+        datos = json.loads(ruta.read_text(encoding="utf-8"))
+    except (OSError, ValueError) as e:
+        raise ValueError(f"No se pudo leer la topología {ruta}: {e}") from e
+
+    topologia = Topologia(
+        servicio=datos.get("servicio", ruta.stem),
+        hospitales=list(datos.get("hospitales", [])),
+        nodos={n: list(lista) for n, lista in datos.get("nodos", {}).items()},
+        complejidad=dict(datos.get("complejidad", {})),
+        grupos={g: list(lista) for g, lista in datos.get("grupos", {}).items()},
+        carteras=dict(datos.get("carteras", {})),
+    )
+    problemas = topologia.problemas()
+    if problemas:
+        raise ValueError(f"Topología {ruta}: " + "; ".join(problemas))
+    return topologia
+
+
+def topologias_disponibles(carpeta=None) -> list:
+    """Topologías de los archivos topologia_*.json de `carpeta` (por
+    defecto, la de este módulo), una por servicio."""
+    carpeta = Path(carpeta) if carpeta else RUTA_TOPOLOGIA.parent
+    topologias = [cargar_topologia(ruta) for ruta in sorted(carpeta.glob("topologia_*.json"))]
+    servicios = [t.servicio for t in topologias]
+    repetidos = sorted({s for s in servicios if servicios.count(s) > 1})
+    if repetidos:
+        raise ValueError(f"Servicios repetidos en {carpeta}: {', '.join(repetidos)}")
+    return topologias
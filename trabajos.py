@@ -0,0 +1,124 @@
+"""Trabajos en segundo plano con avance por etapa y cancelación.
+
+La app lanza el proceso pesado en un hilo y, mientras corre, muestra el
+avance y los resultados parciales que ya estén listos. Un trabajo por
+par de archivos (hash): si otra sesión sube los mismos archivos mientras
+se procesan, se une al trabajo en curso en vez de lanzar otro. Un
+trabajo compartido se cancela solo cuando todas sus sesiones lo sueltan.
+"""
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from rendimiento import Medidor
+
+
+class Cancelado(Exception):
+    """El trabajo se canceló (se subió otro archivo)."""
+
+
+# -------------------------------------------------------------------
+# Un trabajo: ejecuta `funcion(trabajo)` en un hilo. La función marca
+# sus etapas con `trabajo.etapa(nombre)` (medidas con el Medidor del
+# trabajo) y sus hitos con `trabajo.hito(nombre)`; la cancelación se
+# revisa al comenzar cada etapa.
+# -------------------------------------------------------------------
+class Trabajo:
+    def __init__(self, clave: str, etapas: list, funcion, medidor: Medidor = None):
+        self.clave = clave
+        self.etapas = list(etapas)      # nombres esperados, para el avance
+        self.medidor = medidor if medidor is not None else Medidor({"clave": clave})
+        self.completadas = []
+        self.actual = None
+        self.error = None
+        self.datos = {}                 # resultados parciales, por nombre
+        self.suscriptores = 0           # sesiones que lo usan (ver iniciar_trabajo)
+        self._hitos = set()
+        self._cancelar = threading.Event()
+        self._terminado = threading.Event()
+        self._hilo = threading.Thread(
+            target=self._ejecutar, args=(funcion,), name=f"trabajo-{clave[:16]}", daemon=True
+        )
+
+    def _ejecutar(self, funcion):
+        try:
+            funcion(self)
+        except Cancelado:
+            pass
+        except Exception as e:
+            self.error = e
+        finally:
+            self.actual = None
+            self._terminado.set()
+
+    def iniciar(self) -> "Trabajo":
+        self._hilo.start()
+        return self
+
+    @contextmanager
+    def etapa(self, nombre: str, filas: int = None):
+        if self._cancelar.is_set():
+            raise Cancelado(self.clave)
+        self.actual = nombre
+        with self.medidor.etapa(nombre, filas) as registro:
+            yield registro
+        self.completadas.append(nombre)
+
+    def hito(self, nombre: str):
+        self._hitos.add(nombre)
+
+    def alcanzo(self, nombre: str) -> bool:
+        return nombre in self._hitos
+
+    def cancelar(self):
+        # Un trabajo terminado no se marca: otras sesiones pueden seguir usándolo
+        if not self.terminado:
+            self._cancelar.set()
+
+    @property
+    def cancelado(self) -> bool:
+        return self._cancelar.is_set()
+
+    @property
+    def terminado(self) -> bool:
+        return self._terminado.is_set()
+
+    def esperar(self, segundos: float = None) -> bool:
+        return self._terminado.wait(segundos)
+
+    def avance(self) -> float:
+        """Fracción de las etapas esperadas ya completadas (0 a 1)."""
+        if self.terminado:
+            return 1.0
+        return min(len(self.completadas) / max(len(self.etapas), 1), 1.0)
+
+
+# -------------------------------------------------------------------
+# Registro de trabajos en curso del proceso, por clave. Los terminados
+# salen del registro: quien los lanzó conserva su referencia. Cada sesión
+# que inicia o se une a un trabajo lo suelta al dejar de usarlo; el
+# trabajo se cancela cuando no queda ninguna.
+# -------------------------------------------------------------------
+_en_curso = OrderedDict()
+_candado = threading.Lock()
+
+
+def iniciar_trabajo(clave: str, etapas: list, funcion, medidor: Medidor = None) -> Trabajo:
+    """Trabajo en curso para `clave` o uno nuevo si no hay (o se canceló)."""
+    with _candado:
+        for k in [k for k, t in _en_curso.items() if t.terminado]:
+            del _en_curso[k]
+        trabajo = _en_curso.get(clave)
+        if trabajo is None or trabajo.cancelado:
+            trabajo = Trabajo(clave, etapas, funcion, medidor).iniciar()
+            _en_curso[clave] = trabajo
+        trabajo.suscriptores += 1
+        return trabajo
+
+
+def soltar_trabajo(trabajo: Trabajo):
+    """Una sesión deja de usar `trabajo`; si era la última, se cancela."""
+    with _candado:
+        trabajo.suscriptores = max(trabajo.suscriptores - 1, 0)
+        if trabajo.suscriptores == 0:
+            trabajo.cancelar()